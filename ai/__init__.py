@@ -1,6 +1,36 @@
-"""AI模块"""
-from .chat import ChatService
-from .history import ConversationHistory
+"""
+AI模块
+导出的类在首次访问时才导入所在子模块：只用到准入控制、调度等模块时（如压测、基准工具）
+不会连带导入 langchain
+"""
+import importlib
 
-__all__ = ["ChatService", "ConversationHistory"]
+# 导出名 -> 所在子模块
+_EXPORTS = {
+    "AdmissionController": "admission",
+    "AsyncFairScheduler": "scheduler",
+    "ChatService": "chat",
+    "ConversationHistory": "history",
+    "FairScheduler": "scheduler",
+    "HistoryCompactor": "summary",
+    "LLMRouter": "router",
+    "ReplyQueue": "reply_queue",
+    "ResponseCache": "cache",
+    "SessionLock": "session_lock",
+}
 
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    # 缓存到模块属性，之后的访问不再经过 __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,138 @@
+"""
+AI任务准入控制模块
+统计进程内已准入尚未完成（执行中 + 排队中）的AI任务数和近期单次耗时，估算新任务的完成时间：
+- 预计能在被动回复时限内完成：正常处理
+- 预计超出被动回复时限：直接转为主动推送，不再占用回调请求等待
+- 积压超过上限（按近期耗时估算最长等待时间内能完成的任务数）：快速返回繁忙提示，不调用AI
+近期有过对话的会话可使用全部名额，新会话只能使用其中一部分，高峰期优先保证进行中的对话
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import metrics
+from config import Config
+
+# 近期耗时的指数移动平均系数
+_LATENCY_ALPHA = 0.2
+# 记录的活跃会话数上限
+_MAX_ACTIVE_SESSIONS = 10000
+
+
+class AdmissionController:
+    """按LLM积压情况准入AI任务"""
+    
+    ADMIT = "admit"  # 正常处理
+    DEFER = "defer"  # 处理，但直接转为主动推送
+    REJECT = "reject"  # 不处理，返回繁忙提示
+    
+    def __init__(self, capacity: int):
+        """
+        Args:
+            capacity: 同时执行的AI任务数（线程池大小或异步并发上限）
+        """
+        self.capacity = capacity
+        self.max_backlog = Config.AI_ADMISSION_MAX_BACKLOG
+        self.max_wait_seconds = Config.AI_ADMISSION_MAX_WAIT_SECONDS
+        self.new_session_share = Config.AI_ADMISSION_NEW_SESSION_SHARE
+        self.active_seconds = Config.AI_ADMISSION_ACTIVE_SECONDS
+        
+        self._backlog = 0
+        self._latency: Optional[float] = None
+        # 会话ID -> 最近一次准入时间，按时间顺序排列
+        self._active: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _limit(self, active: bool) -> int:
+        """当前允许的积压任务数（需持有锁）"""
+        limit = self.max_backlog
+        if self._latency:
+            # 最长等待时间内能完成的任务数，至少保证满并发
+            limit = min(limit, max(self.capacity, int(self.capacity * self.max_wait_seconds / self._latency)))
+        if active:
+            return limit
+        return max(1, int(limit * self.new_session_share))
+    
+    def _predicted_seconds(self, backlog: int) -> float:
+        """前面已有 backlog 个任务时，新任务的预计完成时间（需持有锁）"""
+        if not self._latency:
+            return 0.0
+        return (backlog // self.capacity + 1) * self._latency
+    
+    def _is_active(self, session_id: str, now: float) -> bool:
+        """会话近期是否有过对话（需持有锁）"""
+        last_seen = self._active.get(session_id)
+        return last_seen is not None and now - last_seen <= self.active_seconds
+    
+    def _touch(self, session_id: str, now: float) -> None:
+        """记录会话活跃时间并清理过期记录（需持有锁）"""
+        self._active[session_id] = now
+        self._active.move_to_end(session_id)
+        while self._active:
+            oldest_id, last_seen = next(iter(self._active.items()))
+            if now - last_seen <= self.active_seconds and len(self._active) <= _MAX_ACTIVE_SESSIONS:
+                break
+            del self._active[oldest_id]
+    
+    def acquire(self, session_id: str) -> str:
+        """
+        判断是否准入新的AI任务
+        
+        Args:
+            session_id: 会话ID（通常是用户ID）
+        
+        Returns:
+            ADMIT、DEFER 或 REJECT。ADMIT、DEFER 占用一个名额，需在任务中使用 running 释放，
+            任务未能执行时调用 release 释放
+        """
+        now = time.monotonic()
+        with self._lock:
+            active = self._is_active(session_id, now)
+            if self._backlog >= self._limit(active):
+                decision = self.REJECT
+            else:
+                predicted = self._predicted_seconds(self._backlog)
+                decision = self.DEFER if predicted > Config.AI_REPLY_DEADLINE_SECONDS else self.ADMIT
+                self._backlog += 1
+                self._touch(session_id, now)
+        
+        metrics.ADMISSION_DECISIONS.labels(decision, "active" if active else "new").inc()
+        if decision != self.REJECT:
+            metrics.AI_BACKLOG.inc()
+        return decision
+    
+    def release(self, elapsed: Optional[float] = None) -> None:
+        """
+        释放名额
+        
+        Args:
+            elapsed: 任务执行耗时（秒），计入近期耗时；任务未执行时为None
+        """
+        with self._lock:
+            self._backlog -= 1
+            if elapsed is not None:
+                if self._latency is None:
+                    self._latency = elapsed
+                else:
+                    self._latency += _LATENCY_ALPHA * (elapsed - self._latency)
+        metrics.AI_BACKLOG.dec()
+    
+    @contextmanager
+    def running(self) -> Iterator[None]:
+        """执行已准入的AI任务：记录执行耗时，结束后释放名额"""
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started_at)
+    
+    def stats(self) -> dict:
+        """准入状态"""
+        with self._lock:
+            return {
+                "backlog": self._backlog,
+                "limit": self._limit(True),
+                "latency_seconds": round(self._latency, 3) if self._latency else None
+            }
@@ -0,0 +1,160 @@
+"""
+AI回复缓存模块
+对无上下文（或上下文很短）的常见问题缓存AI回复：进程内LRU + Redis共享缓存
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+import redis
+
+import metrics
+from config import Config
+from redis_client import get_redis_client
+
+# 归一化时去除的首尾标点和空白
+_STRIP_CHARS = " \t\r\n。？！，、；：…~～.?!,;:"
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """
+    问题文本归一化：全角转半角、统一小写、合并空白、去除首尾标点
+    
+    Args:
+        text: 用户输入
+    
+    Returns:
+        归一化后的文本
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _WHITESPACE_PATTERN.sub(" ", text)
+    return text.strip(_STRIP_CHARS)
+
+
+class ResponseCache:
+    """AI回复两级缓存（进程内LRU + Redis）"""
+    
+    def __init__(self, model: str, system_prompt: str):
+        """
+        Args:
+            model: 模型名称，不同模型的回复分开缓存
+            system_prompt: 系统提示词，修改提示词后旧缓存自动失效
+        """
+        self.ttl_seconds = Config.AI_CACHE_TTL_SECONDS
+        self.max_local_size = Config.AI_CACHE_LOCAL_SIZE
+        self._namespace = hashlib.sha1(
+            f"{model}\0{system_prompt}".encode("utf-8")
+        ).hexdigest()[:16]
+        self._redis_client: Optional[redis.Redis] = None
+        # 缓存key -> (过期时间, 回复内容)
+        self._local: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # 命中统计
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+    
+    @property
+    def redis_client(self) -> redis.Redis:
+        """懒加载Redis客户端"""
+        if self._redis_client is None:
+            self._redis_client = get_redis_client()
+        return self._redis_client
+    
+    def _get_key(self, user_input: str) -> Optional[str]:
+        """生成缓存key，归一化后为空的输入不缓存"""
+        question = normalize_question(user_input)
+        if not question:
+            return None
+        digest = hashlib.sha1(question.encode("utf-8")).hexdigest()
+        return f"wecom:ai:cache:{self._namespace}:{digest}"
+    
+    def _set_local(self, key: str, reply: str, expires_at: float) -> None:
+        """写入进程内LRU（需持有锁）"""
+        self._local[key] = (expires_at, reply)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_local_size:
+            self._local.popitem(last=False)
+    
+    def get(self, user_input: str) -> Optional[str]:
+        """
+        查询缓存的回复
+        
+        Args:
+            user_input: 用户输入
+        
+        Returns:
+            缓存的回复，未命中返回None
+        """
+        key = self._get_key(user_input)
+        if key is None:
+            return None
+        
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._local.move_to_end(key)
+                    self.local_hits += 1
+                    metrics.CACHE_LOCAL_HITS.inc()
+                    return entry[1]
+                del self._local[key]
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.ttl(key)
+            reply, ttl = pipe.execute()
+        except Exception as e:
+            metrics.redis_error("cache")
+            print(f"读取回复缓存失败: {e}")
+            reply, ttl = None, 0
+        
+        with self._lock:
+            if reply is None:
+                self.misses += 1
+                metrics.CACHE_MISSES.inc()
+                return None
+            self.redis_hits += 1
+            metrics.CACHE_REDIS_HITS.inc()
+            self._set_local(key, reply, now + max(ttl, 1))
+        return reply
+    
+    def put(self, user_input: str, reply: str) -> None:
+        """
+        缓存回复
+        
+        Args:
+            user_input: 用户输入
+            reply: AI回复
+        """
+        key = self._get_key(user_input)
+        if key is None:
+            return
+        
+        with self._lock:
+            self._set_local(key, reply, time.time() + self.ttl_seconds)
+        try:
+            self.redis_client.setex(key, self.ttl_seconds, reply)
+        except Exception as e:
+            metrics.redis_error("cache")
+            print(f"写入回复缓存失败: {e}")
+    
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        with self._lock:
+            total = self.local_hits + self.redis_hits + self.misses
+            hits = self.local_hits + self.redis_hits
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "local_size": len(self._local)
+            }
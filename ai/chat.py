@@ -1,32 +1,47 @@
 """
 AI对话服务模块
 支持通义千问（DashScope）和 DeepSeek（OpenAI兼容接口）
+配置多个模型（AI_ROUTER_MODELS）时通过 LLMRouter 按延迟路由
+同时提供异步接口（achat/achat_stream），供 ASGI 模式在事件循环中直接调用
 """
+import asyncio
 import os
-from typing import Optional
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional, Tuple
 
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
+import metrics
+from breaker import CircuitBreaker, CircuitOpenError
 from config import Config
+from wecom.segment import TextSegmenter, split_text
+from .cache import ResponseCache
 from .history import ConversationHistory
+from .router import LLMRouter
+from .session_lock import SessionBusyError, SessionLock
+from .summary import HistoryCompactor
 
 
-def create_llm() -> BaseChatModel:
+def create_llm(model_name: Optional[str] = None) -> BaseChatModel:
     """
     根据配置创建对应的 LLM 实例
     支持通义千问和 DeepSeek
+    
+    Args:
+        model_name: 模型名称，默认使用 Config.AI_MODEL
     """
-    model = Config.AI_MODEL.lower()
+    model_name = model_name or Config.AI_MODEL
+    model = model_name.lower()
     
-    # DeepSeek 模型（使用 OpenAI 兼容接口）
-    if "deepseek" in model:
+    # DeepSeek 模型或指定了 OpenAI 兼容接口地址
+    if "deepseek" in model or Config.AI_BASE_URL:
         from langchain_openai import ChatOpenAI
         
         return ChatOpenAI(
-            model=Config.AI_MODEL,
-            api_key=Config.DASHSCOPE_API_KEY,  # 复用这个配置存 DeepSeek API Key
-            base_url="https://api.deepseek.com/v1",
+            model=model_name,
+            api_key=Config.DEEPSEEK_API_KEY or Config.DASHSCOPE_API_KEY,  # 未单独配置时复用 DashScope 的配置
+            base_url=Config.AI_BASE_URL or "https://api.deepseek.com/v1",
             temperature=Config.AI_TEMPERATURE,
             max_tokens=Config.AI_MAX_TOKENS,
         )
@@ -38,7 +53,7 @@ def create_llm() -> BaseChatModel:
         os.environ["DASHSCOPE_API_KEY"] = Config.DASHSCOPE_API_KEY
         
         return ChatTongyi(
-            model=Config.AI_MODEL,
+            model=model_name,
             temperature=Config.AI_TEMPERATURE,
             max_tokens=Config.AI_MAX_TOKENS,
         )
@@ -56,16 +71,43 @@ class ChatService:
 
 请用中文回复用户的问题。"""
     
+    # 早期对话摘要在系统提示词中的引导语
+    SUMMARY_INTRO = "\n\n以下是与该用户早期对话的摘要，供参考：\n"
+    
     def __init__(self):
-        # 根据配置创建 LLM
-        self.llm = create_llm()
+        # 根据配置创建 LLM，配置了多个模型时通过路由器调用
+        self.router = None
+        if Config.AI_ROUTER_MODELS:
+            self.router = LLMRouter({name: create_llm(name) for name in Config.AI_ROUTER_MODELS})
+        self.llm = self.router or create_llm()
+        
+        # 单模型时在此熔断（多模型路由时由路由器按模型熔断）
+        self.llm_breaker = None
+        if self.router is None:
+            self.llm_breaker = CircuitBreaker(
+                f"llm:{Config.AI_MODEL}",
+                Config.AI_BREAKER_FAILURE_THRESHOLD,
+                Config.AI_BREAKER_RESET_SECONDS
+            )
         
         # 初始化对话历史管理器
         self.history = ConversationHistory()
         
-        # 构建对话提示模板
+        # 后台对话摘要压缩
+        self.compactor = HistoryCompactor(self.history)
+        
+        # 会话锁（同一会话的对话轮次按顺序执行）
+        self.session_lock = SessionLock()
+        
+        # 常见问题回复缓存（多模型路由时回复可能来自任一模型，按模型集合区分缓存）
+        self.cache = None
+        if Config.AI_CACHE_ENABLED:
+            cache_model = ",".join(sorted(b.name for b in self.router.backends)) if self.router is not None else Config.AI_MODEL
+            self.cache = ResponseCache(cache_model, self.SYSTEM_PROMPT)
+        
+        # 构建对话提示模板（系统提示词在调用时传入，以便附带早期对话摘要）
         self.prompt = ChatPromptTemplate.from_messages([
-            ("system", self.SYSTEM_PROMPT),
+            ("system", "{system_prompt}"),
             MessagesPlaceholder(variable_name="history"),
             ("human", "{input}")
         ])
@@ -73,9 +115,157 @@ class ChatService:
         # 构建对话链
         self.chain = self.prompt | self.llm
     
+    def _system_prompt(self, summary: Optional[str]) -> str:
+        """构建系统提示词，附带早期对话摘要"""
+        if not summary:
+            return self.SYSTEM_PROMPT
+        return self.SYSTEM_PROMPT + self.SUMMARY_INTRO + summary
+    
+    # 清除历史命令
+    CLEAR_COMMANDS = ["清除历史", "清除记录", "重新开始", "/clear"]
+    
+    # AI服务异常时的回复
+    ERROR_REPLY = "抱歉，我现在无法处理您的请求，请稍后再试或联系人工客服。"
+    
+    # 同一会话的上一轮对话长时间未完成、等待会话锁超时时的回复（本轮不调用AI、不写入历史）
+    BUSY_REPLY = "您的上一条消息还在处理中，请稍后再发送。"
+    
+    @contextmanager
+    def _llm_call(self, stream: bool = False) -> Iterator[metrics.LLMCallTimer]:
+        """
+        统计LLM调用并维护熔断状态
+        多模型路由时此处的耗时记在 "router" 下，为含对冲与切换的端到端耗时；
+        完整返回的模型自身的耗时由路由器记在该模型名下
+        
+        Args:
+            stream: 是否流式调用（流式调用耗时随回复长度增长，不按慢调用计为失败）
+        
+        Returns:
+            计时器，流式调用中推送分段的耗时通过 timer.exclude() 扣除
+        
+        Raises:
+            CircuitOpenError: LLM处于熔断状态
+        """
+        if self.llm_breaker is not None:
+            self.llm_breaker.check()
+        model = "router" if self.router is not None else Config.AI_MODEL
+        with metrics.llm_call(model) as timer:
+            try:
+                yield timer
+            except Exception:
+                if self.llm_breaker is not None:
+                    self.llm_breaker.record_failure()
+                raise
+        if self.llm_breaker is not None:
+            if not stream and timer.elapsed() > Config.AI_BREAKER_SLOW_SECONDS:
+                self.llm_breaker.record_failure()
+            else:
+                self.llm_breaker.record_success()
+    
+    def _prepare(
+        self,
+        session_id: str,
+        user_input: str,
+        fence: Optional[int] = None
+    ) -> Tuple[Optional[str], dict, bool]:
+        """
+        处理命令和缓存，准备调用对话链的输入
+        
+        Args:
+            session_id: 会话ID
+            user_input: 用户输入
+            fence: 会话锁的栅栏令牌（写入历史时校验）
+        
+        Returns:
+            (无需调用AI时的直接回复, 对话链输入, 回复是否可缓存)
+        """
+        # 检查是否是清除历史命令
+        if user_input.strip().lower() in self.CLEAR_COMMANDS:
+            self.history.clear_history(session_id)
+            return "对话历史已清除，我们可以重新开始了！", {}, False
+        
+        # 获取早期对话摘要和token预算内的历史消息
+        with metrics.HISTORY_READ_SECONDS.time():
+            summary, history_messages, history_length = self.history.get_window(
+                session_id, max_tokens=Config.CONVERSATION_MAX_TOKENS
+            )
+        
+        # 无上下文（或上下文很短）的问题优先查询回复缓存
+        # 按保存的历史消息数判断：token预算裁剪后的窗口可能很短，但会话本身有上下文
+        cacheable = (
+            self.cache is not None
+            and not summary
+            and history_length <= Config.AI_CACHE_MAX_HISTORY
+        )
+        if cacheable:
+            cached_reply = self.cache.get(user_input)
+            if cached_reply is not None:
+                self._save_turn(session_id, user_input, cached_reply, fence)
+                return cached_reply, {}, False
+        
+        inputs = {
+            "system_prompt": self._system_prompt(summary),
+            "history": history_messages,
+            "input": user_input
+        }
+        return None, inputs, cacheable
+    
+    async def _aprepare(
+        self,
+        session_id: str,
+        user_input: str,
+        fence: Optional[int] = None
+    ) -> Tuple[Optional[str], dict, bool]:
+        """_prepare 的异步版本"""
+        if user_input.strip().lower() in self.CLEAR_COMMANDS:
+            await self.history.aclear_history(session_id)
+            return "对话历史已清除，我们可以重新开始了！", {}, False
+        
+        with metrics.HISTORY_READ_SECONDS.time():
+            summary, history_messages, history_length = await self.history.aget_window(
+                session_id, max_tokens=Config.CONVERSATION_MAX_TOKENS
+            )
+        
+        cacheable = (
+            self.cache is not None
+            and not summary
+            and history_length <= Config.AI_CACHE_MAX_HISTORY
+        )
+        if cacheable:
+            # 回复缓存使用同步Redis客户端，放到线程中执行
+            cached_reply = await asyncio.to_thread(self.cache.get, user_input)
+            if cached_reply is not None:
+                await self._asave_turn(session_id, user_input, cached_reply, fence)
+                return cached_reply, {}, False
+        
+        inputs = {
+            "system_prompt": self._system_prompt(summary),
+            "history": history_messages,
+            "input": user_input
+        }
+        return None, inputs, cacheable
+    
+    def _save_turn(self, session_id: str, user_input: str, ai_reply: str, fence: Optional[int] = None) -> None:
+        """保存对话历史（用户消息与AI回复一次写入），必要时在后台压缩早期对话"""
+        with metrics.HISTORY_WRITE_SECONDS.time():
+            message_count = self.history.add_turn(session_id, user_input, ai_reply, fence=fence)
+        self.compactor.maybe_schedule(session_id, message_count)
+    
+    async def _asave_turn(
+        self,
+        session_id: str,
+        user_input: str,
+        ai_reply: str,
+        fence: Optional[int] = None
+    ) -> None:
+        """_save_turn 的异步版本"""
+        with metrics.HISTORY_WRITE_SECONDS.time():
+            message_count = await self.history.aadd_turn(session_id, user_input, ai_reply, fence=fence)
+        self.compactor.maybe_schedule(session_id, message_count)
+    
     def chat(self, session_id: str, user_input: str) -> str:
         """
-        处理用户对话
+        处理用户对话（同一会话的多条消息按顺序处理）
         
         Args:
             session_id: 会话ID（通常是用户ID）
@@ -85,32 +275,186 @@ class ChatService:
             AI回复内容
         """
         try:
-            # 检查是否是清除历史命令
-            if user_input.strip().lower() in ["清除历史", "清除记录", "重新开始", "/clear"]:
-                self.history.clear_history(session_id)
-                return "对话历史已清除，我们可以重新开始了！"
-            
-            # 获取历史消息
-            history_messages = self.history.get_messages(session_id)
+            with self.session_lock.hold(session_id) as fence:
+                return self._chat(session_id, user_input, fence)
+        except SessionBusyError:
+            return self.BUSY_REPLY
+    
+    def _chat(self, session_id: str, user_input: str, fence: Optional[int]) -> str:
+        """持有会话锁处理一轮对话"""
+        try:
+            reply, inputs, cacheable = self._prepare(session_id, user_input, fence)
+            if reply is not None:
+                return reply
             
             # 调用AI生成回复
-            response = self.chain.invoke({
-                "history": history_messages,
-                "input": user_input
-            })
+            with self._llm_call():
+                response = self.chain.invoke(inputs)
             
             ai_reply = response.content
+            if cacheable:
+                self.cache.put(user_input, ai_reply)
             
-            # 保存对话历史
-            self.history.add_user_message(session_id, user_input)
-            self.history.add_ai_message(session_id, ai_reply)
+            self._save_turn(session_id, user_input, ai_reply, fence)
             
             return ai_reply
             
+        except CircuitOpenError:
+            # 熔断期间直接返回固定回复
+            return self.ERROR_REPLY
         except Exception as e:
             error_msg = f"AI服务异常: {str(e)}"
             print(error_msg)
-            return "抱歉，我现在无法处理您的请求，请稍后再试或联系人工客服。"
+            return self.ERROR_REPLY
+    
+    def chat_stream(self, session_id: str, user_input: str, on_segment: Callable[[str], None]) -> str:
+        """
+        流式处理用户对话，回复在段落/句子边界处分段，生成一段即回调一段
+        
+        Args:
+            session_id: 会话ID（通常是用户ID）
+            user_input: 用户输入
+            on_segment: 分段回调（按顺序调用），通常为主动发送消息
+        
+        Returns:
+            完整的AI回复内容
+        """
+        try:
+            with self.session_lock.hold(session_id) as fence:
+                return self._chat_stream(session_id, user_input, on_segment, fence)
+        except SessionBusyError:
+            on_segment(self.BUSY_REPLY)
+            return self.BUSY_REPLY
+    
+    def _chat_stream(
+        self,
+        session_id: str,
+        user_input: str,
+        on_segment: Callable[[str], None],
+        fence: Optional[int]
+    ) -> str:
+        """持有会话锁流式处理一轮对话"""
+        try:
+            reply, inputs, cacheable = self._prepare(session_id, user_input, fence)
+            if reply is not None:
+                for segment in split_text(reply):
+                    on_segment(segment)
+                return reply
+            
+            segmenter = TextSegmenter()
+            chunks = []
+            with self._llm_call(stream=True) as timer:
+                for chunk in self.chain.stream(inputs):
+                    chunks.append(chunk.content)
+                    with timer.exclude():
+                        for segment in segmenter.feed(chunk.content):
+                            on_segment(segment)
+            for segment in segmenter.flush():
+                on_segment(segment)
+            
+            ai_reply = "".join(chunks)
+            if cacheable:
+                self.cache.put(user_input, ai_reply)
+            
+            self._save_turn(session_id, user_input, ai_reply, fence)
+            
+            return ai_reply
+            
+        except CircuitOpenError:
+            on_segment(self.ERROR_REPLY)
+            return self.ERROR_REPLY
+        except Exception as e:
+            print(f"AI服务异常: {str(e)}")
+            on_segment(self.ERROR_REPLY)
+            return self.ERROR_REPLY
+    
+    async def achat(self, session_id: str, user_input: str) -> str:
+        """chat 的异步版本"""
+        try:
+            async with self.session_lock.ahold(session_id) as fence:
+                return await self._achat(session_id, user_input, fence)
+        except SessionBusyError:
+            return self.BUSY_REPLY
+    
+    async def _achat(self, session_id: str, user_input: str, fence: Optional[int]) -> str:
+        """_chat 的异步版本"""
+        try:
+            reply, inputs, cacheable = await self._aprepare(session_id, user_input, fence)
+            if reply is not None:
+                return reply
+            
+            with self._llm_call():
+                response = await self.chain.ainvoke(inputs)
+            
+            ai_reply = response.content
+            if cacheable:
+                await asyncio.to_thread(self.cache.put, user_input, ai_reply)
+            
+            await self._asave_turn(session_id, user_input, ai_reply, fence)
+            
+            return ai_reply
+            
+        except CircuitOpenError:
+            return self.ERROR_REPLY
+        except Exception as e:
+            print(f"AI服务异常: {str(e)}")
+            return self.ERROR_REPLY
+    
+    async def achat_stream(
+        self,
+        session_id: str,
+        user_input: str,
+        on_segment: Callable[[str], Awaitable[None]]
+    ) -> str:
+        """chat_stream 的异步版本，on_segment 为协程函数"""
+        try:
+            async with self.session_lock.ahold(session_id) as fence:
+                return await self._achat_stream(session_id, user_input, on_segment, fence)
+        except SessionBusyError:
+            await on_segment(self.BUSY_REPLY)
+            return self.BUSY_REPLY
+    
+    async def _achat_stream(
+        self,
+        session_id: str,
+        user_input: str,
+        on_segment: Callable[[str], Awaitable[None]],
+        fence: Optional[int]
+    ) -> str:
+        """_chat_stream 的异步版本"""
+        try:
+            reply, inputs, cacheable = await self._aprepare(session_id, user_input, fence)
+            if reply is not None:
+                for segment in split_text(reply):
+                    await on_segment(segment)
+                return reply
+            
+            segmenter = TextSegmenter()
+            chunks = []
+            with self._llm_call(stream=True) as timer:
+                async for chunk in self.chain.astream(inputs):
+                    chunks.append(chunk.content)
+                    with timer.exclude():
+                        for segment in segmenter.feed(chunk.content):
+                            await on_segment(segment)
+            for segment in segmenter.flush():
+                await on_segment(segment)
+            
+            ai_reply = "".join(chunks)
+            if cacheable:
+                await asyncio.to_thread(self.cache.put, user_input, ai_reply)
+            
+            await self._asave_turn(session_id, user_input, ai_reply, fence)
+            
+            return ai_reply
+            
+        except CircuitOpenError:
+            await on_segment(self.ERROR_REPLY)
+            return self.ERROR_REPLY
+        except Exception as e:
+            print(f"AI服务异常: {str(e)}")
+            await on_segment(self.ERROR_REPLY)
+            return self.ERROR_REPLY
     
     def get_session_info(self, session_id: str) -> dict:
         """获取会话信息"""
@@ -1,13 +1,241 @@
 """
 对话历史持久化模块
-使用Redis存储对话历史
+使用Redis列表存储对话历史，每条消息为一个列表元素，追加写入无需读出整段历史
+列表元素格式为 "<token数>|<消息JSON>"，token数在写入时计算，选取历史窗口时无需重新分词
+同时提供基于 redis.asyncio 的异步接口（a 前缀方法，ASGI模式使用），存储格式一致
+
+每个会话在Redis中维护一个版本号，所有写操作（追加、摘要压缩、迁移、清除）在同一事务或脚本内递增版本号。
+进程内按LRU缓存最近会话的已反序列化窗口，读取时只需校验版本号：版本未变直接使用缓存，
+清除历史后其他进程的下一次读取即失效
+
+Redis不可用（含熔断）时降级为进程内存储，保证对话仍可继续，Redis恢复后以Redis中的历史为准
 """
+import asyncio
 import json
-from typing import List, Optional
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 import redis
 
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, messages_from_dict, messages_to_dict
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, message_to_dict, messages_from_dict
+import metrics
+from breaker import CircuitOpenError
 from config import Config
+from redis_client import get_async_redis_client, get_redis_client
+from .session_lock import get_fence_key
+from .tokens import count_tokens
+
+
+# 旧版整段JSON存储迁移到列表：仅当旧key仍存在时执行，旧消息插入到列表头部
+_MIGRATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+for i = #ARGV - 1, 1, -1 do
+    redis.call('LPUSH', KEYS[1], ARGV[i])
+end
+local max_history = tonumber(ARGV[#ARGV])
+redis.call('LTRIM', KEYS[1], -max_history, -1)
+local ttl = redis.call('TTL', KEYS[2])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+redis.call('DEL', KEYS[2])
+redis.call('INCR', KEYS[3])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[3], ttl)
+end
+return 1
+"""
+
+# 摘要压缩：确认列表头部仍是被摘要的那批消息后，删除它们并写入新摘要
+_COMPACT_SCRIPT = """
+local count = tonumber(ARGV[2])
+if redis.call('LINDEX', KEYS[1], 0) ~= ARGV[3] or redis.call('LINDEX', KEYS[1], count - 1) ~= ARGV[4] then
+    return 0
+end
+redis.call('LTRIM', KEYS[1], count, -1)
+redis.call('SET', KEYS[2], ARGV[1], 'EX', tonumber(ARGV[5]))
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], tonumber(ARGV[5]))
+return 1
+"""
+
+# 持有会话锁时的追加写入：栅栏令牌仍是最新的（会话锁未被他人接管）才写入，与 _queue_append 的命令一致
+# 返回 {追加后的长度, 新版本号}，令牌过期返回 {-1, -1}
+_FENCED_APPEND_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[4]) or '0') ~= tonumber(ARGV[1]) then
+    return {-1, -1}
+end
+local max_history = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local length = redis.call('RPUSH', KEYS[1], unpack(ARGV, 4))
+redis.call('LTRIM', KEYS[1], -max_history, -1)
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('EXPIRE', KEYS[2], ttl)
+local version = redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ttl)
+return {length, version}
+"""
+
+# 读取会话上下文：版本号与调用方缓存的一致时只返回版本号，否则一并返回摘要和历史窗口
+# 返回 {版本号, 是否有摘要, 摘要, 消息...}，会话不存在时版本号为 '0'
+_CONTEXT_SCRIPT = """
+local version = redis.call('GET', KEYS[1]) or '0'
+if version == ARGV[1] then
+    return {version}
+end
+local summary = redis.call('GET', KEYS[3])
+local result = {version, summary and '1' or '0', summary or ''}
+for _, item in ipairs(redis.call('LRANGE', KEYS[2], -tonumber(ARGV[2]), -1)) do
+    result[#result + 1] = item
+end
+return result
+"""
+
+# 未缓存会话时传给 _CONTEXT_SCRIPT 的版本号，不会与真实版本号相同
+_NO_VERSION = "-"
+
+# 估算缓存内存占用时每条消息对象的固定开销（字节）
+_MESSAGE_OVERHEAD = 400
+
+
+@dataclass
+class _CachedSession:
+    """进程内缓存的会话窗口，创建后不再修改，更新时整体替换"""
+    version: str
+    summary: Optional[str]
+    tokens: List[int]
+    messages: List[BaseMessage]
+    size: int
+    expires_at: float
+
+
+class _SessionCache:
+    """最近会话的进程内LRU，按估算内存占用淘汰"""
+    
+    def __init__(self, max_bytes: int, ttl_seconds: int):
+        """
+        Args:
+            max_bytes: 缓存内存上限（估算字节数）
+            ttl_seconds: 条目最长保留时间，防止Redis中版本号过期重建后与旧条目的版本号重合
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _CachedSession]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def estimate_size(summary: Optional[str], messages: List[BaseMessage]) -> int:
+        """估算会话窗口占用的内存"""
+        size = sys.getsizeof(summary) if summary else 0
+        for message in messages:
+            size += sys.getsizeof(message.content) + _MESSAGE_OVERHEAD
+        return size
+    
+    def get(self, session_id: str) -> Optional[_CachedSession]:
+        """获取未过期的缓存条目"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(session_id)
+                return None
+            self._entries.move_to_end(session_id)
+            return entry
+    
+    def put(self, session_id: str, version: str, summary: Optional[str],
+            tokens: List[int], messages: List[BaseMessage]) -> _CachedSession:
+        """写入缓存条目，超出内存上限时淘汰最久未使用的会话"""
+        entry = _CachedSession(
+            version=version,
+            summary=summary,
+            tokens=tokens,
+            messages=messages,
+            size=self.estimate_size(summary, messages),
+            expires_at=time.monotonic() + self.ttl_seconds
+        )
+        with self._lock:
+            self._remove(session_id)
+            if entry.size > self.max_bytes:
+                return entry
+            self._entries[session_id] = entry
+            self._size += entry.size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return entry
+    
+    def advance(self, session_id: str, version: int, tokens: List[int], messages: List[BaseMessage]) -> None:
+        """
+        本进程追加消息后同步更新缓存
+        仅当缓存恰好是写入前的版本时追加，否则（期间有其他写入）丢弃条目
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        if entry.version != str(version - 1):
+            self.discard(session_id)
+            return
+        max_history = Config.CONVERSATION_MAX_HISTORY
+        self.put(
+            session_id,
+            str(version),
+            entry.summary,
+            (entry.tokens + tokens)[-max_history:],
+            (entry.messages + messages)[-max_history:]
+        )
+    
+    def discard(self, session_id: str) -> None:
+        """移除缓存条目"""
+        with self._lock:
+            self._remove(session_id)
+    
+    def _remove(self, session_id: str) -> None:
+        """移除条目并更新内存占用（需持有锁）"""
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+
+class _LocalHistory:
+    """Redis不可用时的降级存储：进程内保存各会话最近的消息，按LRU限制会话数"""
+    
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        # 会话ID -> (token数列表, 消息列表)
+        self._sessions: "OrderedDict[str, Tuple[List[int], List[BaseMessage]]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, session_id: str) -> _CachedSession:
+        """获取会话窗口，不存在时为空"""
+        with self._lock:
+            tokens, messages = self._sessions.get(session_id, ([], []))
+            return _CachedSession("", None, list(tokens), list(messages), 0, 0.0)
+    
+    def append(self, session_id: str, tokens: List[int], messages: List[BaseMessage]) -> None:
+        """追加消息，超出 CONVERSATION_MAX_HISTORY 的早期消息被丢弃"""
+        max_history = Config.CONVERSATION_MAX_HISTORY
+        with self._lock:
+            old_tokens, old_messages = self._sessions.pop(session_id, ([], []))
+            self._sessions[session_id] = (
+                (old_tokens + tokens)[-max_history:],
+                (old_messages + messages)[-max_history:]
+            )
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+    
+    def discard(self, session_id: str) -> None:
+        """移除会话（Redis写入成功后不再需要降级数据）"""
+        if session_id not in self._sessions:
+            return
+        with self._lock:
+            self._sessions.pop(session_id, None)
 
 
 class ConversationHistory:
@@ -15,44 +243,352 @@ class ConversationHistory:
     
     def __init__(self):
         self._redis_client: Optional[redis.Redis] = None
+        self._async_redis_client = None
+        self._migrate_script = None
+        self._compact_script = None
+        self._context_script = None
+        self._async_context_script = None
+        self._fenced_append_script = None
+        self._async_fenced_append_script = None
+        self._fallback = _LocalHistory(Config.CONVERSATION_FALLBACK_MAX_SESSIONS)
+        self._local: Optional[_SessionCache] = None
+        if Config.CONVERSATION_LOCAL_CACHE_ENABLED:
+            self._local = _SessionCache(
+                Config.CONVERSATION_LOCAL_CACHE_MAX_BYTES,
+                Config.CONVERSATION_LOCAL_CACHE_TTL_SECONDS
+            )
     
     @property
     def redis_client(self) -> redis.Redis:
         """懒加载Redis客户端"""
         if self._redis_client is None:
-            self._redis_client = redis.Redis(
-                host=Config.REDIS_HOST,
-                port=Config.REDIS_PORT,
-                password=Config.REDIS_PASSWORD or None,
-                db=Config.REDIS_DB,
-                decode_responses=True
-            )
+            self._redis_client = get_redis_client()
         return self._redis_client
     
+    @property
+    def async_redis_client(self):
+        """懒加载异步Redis客户端"""
+        if self._async_redis_client is None:
+            self._async_redis_client = get_async_redis_client()
+        return self._async_redis_client
+    
     def _get_key(self, session_id: str) -> str:
         """生成Redis key"""
+        return f"wecom:chat:messages:{session_id}"
+    
+    def _get_summary_key(self, session_id: str) -> str:
+        """生成对话摘要的Redis key"""
+        return f"wecom:chat:summary:{session_id}"
+    
+    def _get_legacy_key(self, session_id: str) -> str:
+        """旧版整段JSON存储的Redis key"""
         return f"wecom:chat:history:{session_id}"
     
-    def get_messages(self, session_id: str) -> List[BaseMessage]:
+    def _get_version_key(self, session_id: str) -> str:
+        """会话版本号的Redis key"""
+        return f"wecom:chat:version:{session_id}"
+    
+    @staticmethod
+    def _encode(message: BaseMessage) -> str:
+        """序列化单条消息，附带token数"""
+        tokens = count_tokens(message.content)
+        return f"{tokens}|{json.dumps(message_to_dict(message), ensure_ascii=False)}"
+    
+    @staticmethod
+    def _split(item: str) -> Tuple[int, str]:
+        """拆分列表元素为 (token数, 消息JSON)，兼容不带token数的旧元素"""
+        if item.startswith("{"):
+            data = json.loads(item)
+            return count_tokens(data.get("data", {}).get("content", "")), item
+        tokens, _, payload = item.partition("|")
+        return int(tokens), payload
+    
+    @staticmethod
+    def _select_window(entry: _CachedSession, max_tokens: int) -> List[BaseMessage]:
+        """
+        从最新消息向前选取不超过token预算的消息，窗口不以AI回复开头
+        最近一轮对话（最后一条用户消息及其后的回复）总是完整保留，即使单独超出预算，
+        避免超长消息使窗口为空、或只剩AI回复被整体丢弃
+        
+        Args:
+            entry: 会话窗口
+            max_tokens: token预算，0表示不限制
+        
+        Returns:
+            选中的消息列表（按时间正序）
+        """
+        start = len(entry.messages)
+        while start > 0 and not isinstance(entry.messages[start - 1], HumanMessage):
+            start -= 1
+        if start > 0:
+            start -= 1
+        else:
+            start = len(entry.messages)
+        total = sum(entry.tokens[start:])
+        while start > 0:
+            tokens = entry.tokens[start - 1]
+            if max_tokens and total + tokens > max_tokens:
+                break
+            total += tokens
+            start -= 1
+        messages = entry.messages[start:]
+        while messages and not isinstance(messages[0], HumanMessage):
+            messages.pop(0)
+        return messages
+    
+    def _migrate_legacy(self, session_id: str) -> bool:
+        """
+        将旧版整段JSON格式的历史迁移为列表格式
+        
+        Returns:
+            是否存在旧数据并完成迁移
+        """
+        data = self.redis_client.get(self._get_legacy_key(session_id))
+        if not data:
+            return False
+        
+        items = [self._encode(message) for message in messages_from_dict(json.loads(data))]
+        if self._migrate_script is None:
+            self._migrate_script = self.redis_client.register_script(_MIGRATE_SCRIPT)
+        self._migrate_script(
+            keys=[self._get_key(session_id), self._get_legacy_key(session_id), self._get_version_key(session_id)],
+            args=items + [Config.CONVERSATION_MAX_HISTORY]
+        )
+        return True
+    
+    def _context_keys(self, session_id: str) -> List[str]:
+        """_CONTEXT_SCRIPT 使用的key"""
+        return [self._get_version_key(session_id), self._get_key(session_id), self._get_summary_key(session_id)]
+    
+    def _context_args(self, entry: Optional[_CachedSession]) -> list:
+        """_CONTEXT_SCRIPT 的参数"""
+        return [entry.version if entry is not None else _NO_VERSION, Config.CONVERSATION_MAX_HISTORY]
+    
+    def _resolve_context(self, session_id: str, entry: Optional[_CachedSession], result: list) -> _CachedSession:
+        """
+        根据 _CONTEXT_SCRIPT 的结果返回会话窗口
+        版本号未变时直接返回缓存条目，否则反序列化并写入缓存
+        """
+        if len(result) == 1:
+            metrics.HISTORY_CACHE_HITS.inc()
+            return entry
+        
+        version, has_summary, summary, *items = result
+        tokens, payloads = [], []
+        for item in items:
+            count, payload = self._split(item)
+            tokens.append(count)
+            payloads.append(payload)
+        messages = messages_from_dict([json.loads(payload) for payload in payloads])
+        summary = summary if has_summary == "1" else None
+        
+        if self._local is None:
+            return _CachedSession(version, summary, tokens, messages, 0, 0.0)
+        if entry is None:
+            metrics.HISTORY_CACHE_MISSES.inc()
+        else:
+            metrics.HISTORY_CACHE_STALE.inc()
+        return self._local.put(session_id, version, summary, tokens, messages)
+    
+    @staticmethod
+    def _needs_migration(result: list) -> bool:
+        """_CONTEXT_SCRIPT 返回了空历史，可能存在旧版数据"""
+        return len(result) == 3
+    
+    def get_context(self, session_id: str, max_tokens: int = 0) -> Tuple[Optional[str], List[BaseMessage]]:
+        """
+        获取会话的对话摘要和历史消息（单次往返）
+        进程内缓存的版本号与Redis一致时，Redis只返回版本号，不再传输和反序列化历史
+        
+        Args:
+            session_id: 会话ID（通常是用户ID）
+            max_tokens: token预算，只返回预算内的最近消息，0表示不限制
+        
+        Returns:
+            (早期对话摘要或None, 消息列表)
+        """
+        summary, messages, _ = self.get_window(session_id, max_tokens)
+        return summary, messages
+    
+    def get_window(self, session_id: str, max_tokens: int = 0) -> Tuple[Optional[str], List[BaseMessage], int]:
+        """
+        获取会话的对话摘要、token预算内的历史消息，以及保存的历史消息总数
+        
+        Args:
+            session_id: 会话ID（通常是用户ID）
+            max_tokens: token预算，只返回预算内的最近消息，0表示不限制
+        
+        Returns:
+            (早期对话摘要或None, 消息列表, 保存的消息数)
+        """
+        entry = self._load_context(session_id)
+        return entry.summary, self._select_window(entry, max_tokens), len(entry.messages)
+    
+    def _load_context(self, session_id: str) -> _CachedSession:
+        """读取会话窗口，Redis不可用时使用进程内历史"""
+        try:
+            if self._context_script is None:
+                self._context_script = self.redis_client.register_script(_CONTEXT_SCRIPT)
+            entry = self._local.get(session_id) if self._local is not None else None
+            keys = self._context_keys(session_id)
+            result = self._context_script(keys=keys, args=self._context_args(entry))
+            if self._needs_migration(result) and self._migrate_legacy(session_id):
+                entry = None
+                result = self._context_script(keys=keys, args=self._context_args(None))
+            return self._resolve_context(session_id, entry, result)
+        except CircuitOpenError:
+            return self._fallback.get(session_id)
+        except Exception as e:
+            metrics.redis_error("history")
+            print(f"获取对话历史失败，使用进程内历史: {e}")
+            return self._fallback.get(session_id)
+    
+    def get_messages(self, session_id: str, max_tokens: int = 0) -> List[BaseMessage]:
         """
         获取会话的历史消息
         
         Args:
             session_id: 会话ID（通常是用户ID）
+            max_tokens: token预算，只返回预算内的最近消息，0表示不限制
         
         Returns:
             消息列表
         """
+        return self.get_context(session_id, max_tokens)[1]
+    
+    def get_oldest(self, session_id: str, count: int) -> Tuple[List[str], List[BaseMessage]]:
+        """
+        获取最早的若干条消息，用于摘要压缩
+        
+        Args:
+            session_id: 会话ID
+            count: 消息条数
+        
+        Returns:
+            (原始列表元素, 消息列表)
+        """
+        items = self.redis_client.lrange(self._get_key(session_id), 0, count - 1)
+        messages = messages_from_dict([json.loads(self._split(item)[1]) for item in items])
+        return items, messages
+    
+    def get_summary(self, session_id: str) -> Optional[str]:
+        """获取早期对话摘要"""
+        return self.redis_client.get(self._get_summary_key(session_id))
+    
+    def apply_summary(self, session_id: str, items: List[str], summary: str) -> bool:
+        """
+        用摘要替换最早的一批消息
+        
+        Args:
+            session_id: 会话ID
+            items: 已被摘要的原始列表元素（来自 get_oldest）
+            summary: 合并后的新摘要
+        
+        Returns:
+            是否替换成功（期间历史被清除或裁剪时放弃）
+        """
+        if self._compact_script is None:
+            self._compact_script = self.redis_client.register_script(_COMPACT_SCRIPT)
+        return bool(self._compact_script(
+            keys=[self._get_key(session_id), self._get_summary_key(session_id), self._get_version_key(session_id)],
+            args=[summary, len(items), items[0], items[-1], Config.CONVERSATION_TTL_SECONDS]
+        ))
+    
+    def _queue_append(self, pipe, session_id: str, messages: List[BaseMessage]) -> List[int]:
+        """
+        在pipeline中加入追加消息、裁剪、续期和递增版本号的命令
+        
+        Returns:
+            各条消息的token数
+        """
         key = self._get_key(session_id)
+        version_key = self._get_version_key(session_id)
+        items, tokens = self._encode_all(messages)
+        pipe.rpush(key, *items)
+        pipe.ltrim(key, -Config.CONVERSATION_MAX_HISTORY, -1)
+        pipe.expire(key, Config.CONVERSATION_TTL_SECONDS)
+        pipe.expire(self._get_summary_key(session_id), Config.CONVERSATION_TTL_SECONDS)
+        pipe.incr(version_key)
+        pipe.expire(version_key, Config.CONVERSATION_TTL_SECONDS)
+        return tokens
+    
+    def _encode_all(self, messages: List[BaseMessage]) -> Tuple[List[str], List[int]]:
+        """序列化消息列表，返回 (列表元素, 各条消息的token数)"""
+        items = [self._encode(m) for m in messages]
+        return items, [self._split(item)[0] for item in items]
+    
+    def _fenced_append_params(self, session_id: str, items: List[str], fence: int) -> dict:
+        """_FENCED_APPEND_SCRIPT 的参数"""
+        return {
+            "keys": [
+                self._get_key(session_id),
+                self._get_summary_key(session_id),
+                self._get_version_key(session_id),
+                get_fence_key(session_id)
+            ],
+            "args": [fence, Config.CONVERSATION_MAX_HISTORY, Config.CONVERSATION_TTL_SECONDS] + items
+        }
+    
+    def _after_fenced_append(self, session_id: str, result: list, tokens: List[int], messages: List[BaseMessage]) -> int:
+        """根据 _FENCED_APPEND_SCRIPT 的结果更新进程内缓存，令牌过期时放弃写入"""
+        length, version = result
+        if length < 0:
+            if self._local is not None:
+                self._local.discard(session_id)
+            metrics.SESSION_LOCKS.labels("fenced").inc()
+            print(f"会话锁已被接管，放弃写入过期的对话: session={session_id}")
+            return 0
+        return self._after_append(session_id, length, version, tokens, messages)
+    
+    def _after_append(self, session_id: str, length: int, version: int,
+                      tokens: List[int], messages: List[BaseMessage]) -> int:
+        """
+        追加成功后更新进程内缓存
+        
+        Returns:
+            追加后的消息数量
+        """
+        if self._local is not None:
+            self._local.advance(session_id, version, tokens, messages)
+        self._fallback.discard(session_id)
+        return min(length, Config.CONVERSATION_MAX_HISTORY)
+    
+    def _append_fallback(self, session_id: str, messages: List[BaseMessage], error: Exception) -> None:
+        """Redis写入失败时改写进程内存储"""
+        if self._local is not None:
+            self._local.discard(session_id)
+        if not isinstance(error, CircuitOpenError):
+            metrics.redis_error("history")
+            print(f"保存对话历史失败，改存进程内: {error}")
+        self._fallback.append(session_id, [count_tokens(m.content) for m in messages], messages)
+    
+    def _append(self, session_id: str, messages: List[BaseMessage], fence: Optional[int] = None) -> int:
+        """
+        追加消息并裁剪、续期，单次往返完成
+        
+        Args:
+            session_id: 会话ID
+            messages: 消息列表
+            fence: 会话锁的栅栏令牌，令牌已过期（会话锁被他人接管）时放弃写入
+        
+        Returns:
+            追加后的消息数量，失败返回0
+        """
         try:
-            data = self.redis_client.get(key)
-            if data:
-                messages_data = json.loads(data)
-                return messages_from_dict(messages_data)
-            return []
+            if fence is not None:
+                if self._fenced_append_script is None:
+                    self._fenced_append_script = self.redis_client.register_script(_FENCED_APPEND_SCRIPT)
+                items, tokens = self._encode_all(messages)
+                result = self._fenced_append_script(**self._fenced_append_params(session_id, items, fence))
+                return self._after_fenced_append(session_id, result, tokens, messages)
+            
+            pipe = self.redis_client.pipeline(transaction=True)
+            tokens = self._queue_append(pipe, session_id, messages)
+            results = pipe.execute()
+            return self._after_append(session_id, results[0], results[4], tokens, messages)
         except Exception as e:
-            print(f"获取对话历史失败: {e}")
-            return []
+            self._append_fallback(session_id, messages, e)
+            return 0
     
     def add_message(self, session_id: str, message: BaseMessage) -> None:
         """
@@ -62,24 +598,7 @@ class ConversationHistory:
             session_id: 会话ID
             message: 消息对象
         """
-        key = self._get_key(session_id)
-        try:
-            messages = self.get_messages(session_id)
-            messages.append(message)
-            
-            # 限制历史消息数量
-            if len(messages) > Config.CONVERSATION_MAX_HISTORY:
-                messages = messages[-Config.CONVERSATION_MAX_HISTORY:]
-            
-            # 序列化并保存
-            messages_data = messages_to_dict(messages)
-            self.redis_client.setex(
-                key,
-                Config.CONVERSATION_TTL_SECONDS,
-                json.dumps(messages_data)
-            )
-        except Exception as e:
-            print(f"保存对话历史失败: {e}")
+        self._append(session_id, [message])
     
     def add_user_message(self, session_id: str, content: str) -> None:
         """添加用户消息"""
@@ -89,17 +608,51 @@ class ConversationHistory:
         """添加AI回复消息"""
         self.add_message(session_id, AIMessage(content=content))
     
+    def add_turn(self, session_id: str, user_input: str, ai_reply: str, fence: Optional[int] = None) -> int:
+        """
+        一次写入一轮对话（用户消息 + AI回复）
+        
+        Args:
+            session_id: 会话ID
+            user_input: 用户消息
+            ai_reply: AI回复
+            fence: 会话锁的栅栏令牌（见 SessionLock），None表示不校验
+        
+        Returns:
+            写入后的消息数量
+        """
+        return self._append(session_id, [HumanMessage(content=user_input), AIMessage(content=ai_reply)], fence)
+    
+    def _queue_clear(self, pipe, session_id: str) -> None:
+        """
+        在pipeline中加入删除历史并递增版本号的命令
+        版本号只递增不删除，避免重建后与其他进程缓存的版本号重合
+        """
+        version_key = self._get_version_key(session_id)
+        pipe.delete(
+            self._get_key(session_id),
+            self._get_summary_key(session_id),
+            self._get_legacy_key(session_id)
+        )
+        pipe.incr(version_key)
+        pipe.expire(version_key, Config.CONVERSATION_TTL_SECONDS)
+    
     def clear_history(self, session_id: str) -> None:
         """
-        清除会话历史
+        清除会话历史，其他进程缓存的该会话在下一次读取时失效
         
         Args:
             session_id: 会话ID
         """
-        key = self._get_key(session_id)
+        self._fallback.discard(session_id)
+        if self._local is not None:
+            self._local.discard(session_id)
         try:
-            self.redis_client.delete(key)
+            pipe = self.redis_client.pipeline(transaction=True)
+            self._queue_clear(pipe, session_id)
+            pipe.execute()
         except Exception as e:
+            metrics.redis_error("history")
             print(f"清除对话历史失败: {e}")
     
     def get_session_info(self, session_id: str) -> dict:
@@ -114,18 +667,111 @@ class ConversationHistory:
         """
         key = self._get_key(session_id)
         try:
-            ttl = self.redis_client.ttl(key)
-            messages = self.get_messages(session_id)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.llen(key)
+            pipe.ttl(key)
+            count, ttl = pipe.execute()
+            if count == 0 and self._migrate_legacy(session_id):
+                pipe.llen(key)
+                pipe.ttl(key)
+                count, ttl = pipe.execute()
             return {
                 "session_id": session_id,
-                "message_count": len(messages),
+                "message_count": count,
                 "ttl_seconds": ttl if ttl > 0 else 0
             }
         except Exception as e:
+            metrics.redis_error("history")
+            print(f"获取会话信息失败: {e}")
+            return {
+                "session_id": session_id,
+                "message_count": 0,
+                "ttl_seconds": 0
+            }
+    
+    async def aget_context(self, session_id: str, max_tokens: int = 0) -> Tuple[Optional[str], List[BaseMessage]]:
+        """get_context 的异步版本"""
+        summary, messages, _ = await self.aget_window(session_id, max_tokens)
+        return summary, messages
+    
+    async def aget_window(self, session_id: str, max_tokens: int = 0) -> Tuple[Optional[str], List[BaseMessage], int]:
+        """get_window 的异步版本"""
+        entry = await self._aload_context(session_id)
+        return entry.summary, self._select_window(entry, max_tokens), len(entry.messages)
+    
+    async def _aload_context(self, session_id: str) -> _CachedSession:
+        """_load_context 的异步版本"""
+        try:
+            if self._async_context_script is None:
+                self._async_context_script = self.async_redis_client.register_script(_CONTEXT_SCRIPT)
+            entry = self._local.get(session_id) if self._local is not None else None
+            keys = self._context_keys(session_id)
+            result = await self._async_context_script(keys=keys, args=self._context_args(entry))
+            if self._needs_migration(result) and await asyncio.to_thread(self._migrate_legacy, session_id):
+                entry = None
+                result = await self._async_context_script(keys=keys, args=self._context_args(None))
+            return self._resolve_context(session_id, entry, result)
+        except CircuitOpenError:
+            return self._fallback.get(session_id)
+        except Exception as e:
+            metrics.redis_error("history")
+            print(f"获取对话历史失败，使用进程内历史: {e}")
+            return self._fallback.get(session_id)
+    
+    async def aadd_turn(self, session_id: str, user_input: str, ai_reply: str, fence: Optional[int] = None) -> int:
+        """add_turn 的异步版本"""
+        messages = [HumanMessage(content=user_input), AIMessage(content=ai_reply)]
+        try:
+            if fence is not None:
+                if self._async_fenced_append_script is None:
+                    self._async_fenced_append_script = self.async_redis_client.register_script(_FENCED_APPEND_SCRIPT)
+                items, tokens = self._encode_all(messages)
+                result = await self._async_fenced_append_script(**self._fenced_append_params(session_id, items, fence))
+                return self._after_fenced_append(session_id, result, tokens, messages)
+            
+            pipe = self.async_redis_client.pipeline(transaction=True)
+            tokens = self._queue_append(pipe, session_id, messages)
+            results = await pipe.execute()
+            return self._after_append(session_id, results[0], results[4], tokens, messages)
+        except Exception as e:
+            self._append_fallback(session_id, messages, e)
+            return 0
+    
+    async def aclear_history(self, session_id: str) -> None:
+        """clear_history 的异步版本"""
+        self._fallback.discard(session_id)
+        if self._local is not None:
+            self._local.discard(session_id)
+        try:
+            pipe = self.async_redis_client.pipeline(transaction=True)
+            self._queue_clear(pipe, session_id)
+            await pipe.execute()
+        except Exception as e:
+            metrics.redis_error("history")
+            print(f"清除对话历史失败: {e}")
+    
+    async def aget_session_info(self, session_id: str) -> dict:
+        """get_session_info 的异步版本"""
+        key = self._get_key(session_id)
+        try:
+            pipe = self.async_redis_client.pipeline(transaction=False)
+            pipe.llen(key)
+            pipe.ttl(key)
+            count, ttl = await pipe.execute()
+            if count == 0 and await asyncio.to_thread(self._migrate_legacy, session_id):
+                pipe.llen(key)
+                pipe.ttl(key)
+                count, ttl = await pipe.execute()
+            return {
+                "session_id": session_id,
+                "message_count": count,
+                "ttl_seconds": ttl if ttl > 0 else 0
+            }
+        except Exception as e:
+            metrics.redis_error("history")
             print(f"获取会话信息失败: {e}")
             return {
                 "session_id": session_id,
                 "message_count": 0,
                 "ttl_seconds": 0
             }
-
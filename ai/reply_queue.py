@@ -0,0 +1,141 @@
+"""
+AI回复任务队列模块
+基于Redis Streams消费组，实现回调接口与AI worker的解耦
+"""
+from dataclasses import asdict, fields as dataclass_fields
+from typing import List, Optional, Tuple
+import redis
+
+import metrics
+from config import Config
+from redis_client import get_redis_client
+from wecom.message import WeChatMessage
+
+
+class ReplyQueue:
+    """基于Redis Streams的AI回复任务队列"""
+    
+    def __init__(self, stream: Optional[str] = None, group: Optional[str] = None):
+        self.stream = stream or Config.AI_QUEUE_STREAM
+        self.group = group or Config.AI_QUEUE_GROUP
+        self._redis_client: Optional[redis.Redis] = None
+    
+    @property
+    def redis_client(self) -> redis.Redis:
+        """懒加载Redis客户端"""
+        if self._redis_client is None:
+            self._redis_client = get_redis_client()
+        return self._redis_client
+    
+    @staticmethod
+    def _to_fields(msg: WeChatMessage) -> dict:
+        """消息序列化为Stream字段"""
+        return {k: str(v) for k, v in asdict(msg).items()}
+    
+    @staticmethod
+    def _from_fields(fields: dict) -> WeChatMessage:
+        """Stream字段反序列化为消息"""
+        values = {f.name: fields.get(f.name, "") for f in dataclass_fields(WeChatMessage)}
+        values["create_time"] = int(fields.get("create_time") or 0)
+        return WeChatMessage(**values)
+    
+    def enqueue(self, msg: WeChatMessage) -> Optional[str]:
+        """
+        消息入队
+        
+        Args:
+            msg: 待回复的消息
+        
+        Returns:
+            Stream条目ID，入队失败返回None
+        """
+        try:
+            return self.redis_client.xadd(
+                self.stream,
+                self._to_fields(msg),
+                maxlen=Config.AI_QUEUE_MAXLEN,
+                approximate=True
+            )
+        except Exception as e:
+            metrics.redis_error("queue")
+            print(f"消息入队失败: {e}")
+            return None
+    
+    def ensure_group(self) -> None:
+        """创建消费组（已存在则忽略）"""
+        try:
+            self.redis_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+    
+    def read(self, consumer: str, count: int, block_ms: int) -> List[Tuple[str, WeChatMessage]]:
+        """
+        读取分配给当前消费者的新消息
+        
+        Args:
+            consumer: 消费者名称
+            count: 最多读取条数
+            block_ms: 无消息时的阻塞等待时间（毫秒）
+        
+        Returns:
+            (条目ID, 消息) 列表
+        """
+        result = self.redis_client.xreadgroup(
+            self.group, consumer, {self.stream: ">"}, count=count, block=block_ms
+        )
+        entries = []
+        for _, items in result or []:
+            for entry_id, fields in items:
+                entries.append((entry_id, self._from_fields(fields)))
+        return entries
+    
+    def reclaim(self, consumer: str, min_idle_ms: int, count: int) -> List[Tuple[str, WeChatMessage]]:
+        """
+        接管长时间未确认的消息（处理它们的worker可能已崩溃）
+        
+        超过最大投递次数的消息直接确认丢弃，避免毒消息反复占用worker
+        
+        Args:
+            consumer: 接管消息的消费者名称
+            min_idle_ms: 最小空闲时间（毫秒）
+            count: 最多接管条数
+        
+        Returns:
+            (条目ID, 消息) 列表
+        """
+        pending = self.redis_client.xpending_range(
+            self.stream, self.group, min="-", max="+", count=count, idle=min_idle_ms
+        )
+        if not pending:
+            return []
+        
+        claim_ids = []
+        for item in pending:
+            if item["times_delivered"] >= Config.AI_QUEUE_MAX_DELIVERIES:
+                print(f"消息超过最大投递次数，已丢弃: {item['message_id']}")
+                self.ack(item["message_id"])
+            else:
+                claim_ids.append(item["message_id"])
+        if not claim_ids:
+            return []
+        
+        claimed = self.redis_client.xclaim(
+            self.stream, self.group, consumer, min_idle_ms, claim_ids
+        )
+        # 已被 MAXLEN 裁剪掉的条目内容为空，直接确认
+        entries = []
+        for entry_id, fields in claimed:
+            if fields:
+                entries.append((entry_id, self._from_fields(fields)))
+            else:
+                self.ack(entry_id)
+        return entries
+    
+    def ack(self, entry_id: str) -> None:
+        """确认消息已处理"""
+        try:
+            self.redis_client.xack(self.stream, self.group, entry_id)
+        except Exception as e:
+            metrics.redis_error("queue")
+            print(f"消息确认失败: {e}")
@@ -0,0 +1,439 @@
+"""
+多模型路由模块
+同时持有多个 LLM 后端，按各后端近期的首包延迟和错误率排序，请求发往当前最快的健康后端；
+主后端超过其延迟分位数仍未返回时，向次优后端发出对冲请求，先返回者胜出，另一个被取消。
+主后端在返回前失败时立即切换到下一个后端。每个后端单独熔断，熔断中的后端不参与路由，
+全部熔断时抛出 CircuitOpenError，由调用方直接返回固定回复
+
+流式调用以首个分片为准：胜出后只消费胜出方的后续分片，不会在输出中途切换后端
+"""
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import Runnable, RunnableConfig
+
+import metrics
+from breaker import CircuitBreaker, CircuitOpenError
+from config import Config
+
+# 后端统计的调用类型：普通调用按完整耗时，流式调用按首个分片耗时
+_INVOKE = "invoke"
+_STREAM = "stream"
+
+# 样本数不足时不计算尾延迟分位数和错误率
+_MIN_SAMPLES = 10
+
+# 后端事件类型
+_CHUNK = "chunk"
+_END = "end"
+_ERROR = "error"
+
+
+class _BackendStats:
+    """单个后端的滑动窗口统计（按样本数和时间双重限制）"""
+    
+    def __init__(self, window_size: int, window_seconds: float):
+        """
+        Args:
+            window_size: 最多保留的样本数
+            window_seconds: 样本最长保留时间，过期后不健康的后端重新参与排序
+        """
+        self.window_seconds = window_seconds
+        # 调用类型 -> (时间, 延迟秒数)
+        self._latencies: Dict[str, deque] = {
+            _INVOKE: deque(maxlen=window_size),
+            _STREAM: deque(maxlen=window_size)
+        }
+        # (时间, 是否成功)
+        self._outcomes: deque = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+    
+    def _expire(self, samples: deque, now: float) -> None:
+        """丢弃过期样本（需持有锁）"""
+        while samples and samples[0][0] < now - self.window_seconds:
+            samples.popleft()
+    
+    def record_latency(self, kind: str, latency: float) -> None:
+        """记录一次延迟样本"""
+        with self._lock:
+            self._latencies[kind].append((time.monotonic(), latency))
+    
+    def record_outcome(self, ok: bool) -> None:
+        """记录一次调用结果"""
+        with self._lock:
+            self._outcomes.append((time.monotonic(), ok))
+    
+    def percentile(self, kind: str, q: float, min_samples: int = _MIN_SAMPLES) -> Optional[float]:
+        """延迟分位数，样本不足返回None"""
+        with self._lock:
+            samples = self._latencies[kind]
+            self._expire(samples, time.monotonic())
+            if not samples or len(samples) < min_samples:
+                return None
+            values = sorted(latency for _, latency in samples)
+        return values[min(len(values) - 1, int(len(values) * q / 100))]
+    
+    def error_rate(self) -> float:
+        """错误率，样本不足返回0"""
+        with self._lock:
+            self._expire(self._outcomes, time.monotonic())
+            if len(self._outcomes) < _MIN_SAMPLES:
+                return 0.0
+            return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+
+class _Backend:
+    """路由器中的一个模型后端"""
+    
+    def __init__(self, name: str, llm: BaseChatModel):
+        self.name = name
+        self.llm = llm
+        self.stats = _BackendStats(Config.AI_ROUTER_WINDOW_SIZE, Config.AI_ROUTER_WINDOW_SECONDS)
+        self.breaker = CircuitBreaker(
+            f"llm:{name}",
+            Config.AI_BREAKER_FAILURE_THRESHOLD,
+            Config.AI_BREAKER_RESET_SECONDS
+        )
+    
+    @property
+    def healthy(self) -> bool:
+        """错误率未超过阈值"""
+        return self.stats.error_rate() <= Config.AI_ROUTER_MAX_ERROR_RATE
+    
+    def record_first_chunk(self, kind: str, latency: float) -> None:
+        """记录首个分片（普通调用即完整结果）的耗时，过慢的调用计为熔断失败"""
+        self.stats.record_latency(kind, latency)
+        if latency > Config.AI_BREAKER_SLOW_SECONDS:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+    
+    def record_error(self) -> None:
+        """记录一次调用失败"""
+        self.stats.record_outcome(False)
+        self.breaker.record_failure()
+    
+    def latency(self, kind: str) -> float:
+        """排序用的典型延迟（中位数），无样本时为0，让新后端先获得流量"""
+        return self.stats.percentile(kind, 50, min_samples=1) or 0.0
+
+
+class LLMRouter(Runnable):
+    """延迟感知的多模型路由器，可直接替代单个 LLM 放入对话链（prompt | router）"""
+    
+    def __init__(self, backends: Dict[str, BaseChatModel]):
+        """
+        Args:
+            backends: 模型名称 -> LLM 实例，按配置顺序排列（无统计数据时按该顺序选择）
+        """
+        if not backends:
+            raise ValueError("至少需要一个模型后端")
+        self.backends: List[_Backend] = [_Backend(name, llm) for name, llm in backends.items()]
+        # 同步调用时各后端请求在线程池中执行，主线程等待首个结果
+        self._max_workers = Config.AI_EXECUTOR_MAX_WORKERS * 2
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._max_workers,
+            thread_name_prefix="llm-router"
+        )
+        # 线程池中已提交、尚未结束的后端请求数（含已落败但仍在等待后端返回的请求）
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+    
+    def _rank(self, kind: str) -> List[_Backend]:
+        """健康后端按典型延迟升序在前，不健康的后端排在最后（全部不健康时仍可使用）"""
+        return sorted(self.backends, key=lambda b: (not b.healthy, b.latency(kind)))
+    
+    @staticmethod
+    def _take(candidates: List[_Backend]) -> Optional[_Backend]:
+        """从候选列表中取出下一个未熔断的后端"""
+        while candidates:
+            backend = candidates.pop(0)
+            if backend.breaker.allow():
+                return backend
+        return None
+    
+    def _hedge_delay(self, backend: _Backend, kind: str) -> float:
+        """主后端超过该时长未返回即发出对冲请求"""
+        delay = backend.stats.percentile(kind, Config.AI_ROUTER_HEDGE_PERCENTILE)
+        if delay is None:
+            # 样本不足时按被动回复时限的一半对冲
+            delay = Config.AI_REPLY_DEADLINE_SECONDS / 2
+        return max(delay, Config.AI_ROUTER_HEDGE_MIN_SECONDS)
+    
+    @staticmethod
+    def _record_hedge(hedge: Optional[_Backend], winner: Optional[_Backend]) -> None:
+        """记录对冲请求是否胜出"""
+        if hedge is not None:
+            metrics.LLM_HEDGES.labels("won" if winner is hedge else "lost").inc()
+    
+    def _submit(self, *args) -> None:
+        """向线程池提交后端请求，并计入在途请求数"""
+        with self._in_flight_lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(self._pump, *args)
+        except BaseException:
+            self._release_thread()
+            raise
+        future.add_done_callback(self._release_thread)
+    
+    def _release_thread(self, _future=None) -> None:
+        """后端请求结束，释放在途计数"""
+        with self._in_flight_lock:
+            self._in_flight -= 1
+    
+    def _has_free_thread(self) -> bool:
+        """线程池是否还有空闲线程可立即执行对冲请求"""
+        with self._in_flight_lock:
+            return self._in_flight < self._max_workers
+    
+    def _pump(self, backend: _Backend, kind: str, open_stream: Callable[[BaseChatModel], Iterator],
+              events: queue.Queue, stop: threading.Event) -> None:
+        """
+        线程池中执行：调用后端并把分片放入事件队列，被取消后在下一个分片处停止
+        完整返回的调用按后端名称记录耗时（中途被取消的落败请求不记录）
+        """
+        started_at = time.monotonic()
+        first = True
+        try:
+            stream = open_stream(backend.llm)
+            try:
+                for chunk in stream:
+                    if first:
+                        backend.record_first_chunk(kind, time.monotonic() - started_at)
+                        first = False
+                    if stop.is_set():
+                        # 已落败：后端本身正常，只是不再需要其结果
+                        backend.stats.record_outcome(True)
+                        metrics.LLM_BACKEND_REQUESTS.labels(backend.name, "cancelled").inc()
+                        return
+                    events.put((backend, _CHUNK, chunk))
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+            backend.stats.record_outcome(True)
+            metrics.LLM_BACKEND_REQUESTS.labels(backend.name, "ok").inc()
+            metrics.LLM_SECONDS.labels(backend.name).observe(time.monotonic() - started_at)
+            events.put((backend, _END, None))
+        except Exception as e:
+            backend.record_error()
+            metrics.LLM_BACKEND_REQUESTS.labels(backend.name, "error").inc()
+            print(f"模型 {backend.name} 调用失败: {e}")
+            events.put((backend, _ERROR, e))
+    
+    def _race(self, kind: str, open_stream: Callable[[BaseChatModel], Iterator]) -> Iterator:
+        """
+        同步竞速：先向最快的后端发请求，超时后对冲、失败后切换，输出首个产生分片的后端的全部分片
+        
+        同步调用无法中断：落败的请求在后端返回（或流式调用的下一个分片）前一直占用线程池中的线程。
+        在途请求数已达线程池上限时不发出对冲请求，避免落败请求占满线程池后，
+        新的主请求和对冲请求只能排队等待；后端失败后的切换请求不受此限制
+        
+        Args:
+            kind: 调用类型
+            open_stream: 用 LLM 实例发起调用，返回分片迭代器
+        """
+        remaining = self._rank(kind)
+        events: queue.Queue = queue.Queue()
+        stops: Dict[str, threading.Event] = {}
+        
+        def launch(backend: _Backend) -> None:
+            stops[backend.name] = threading.Event()
+            self._submit(backend, kind, open_stream, events, stops[backend.name])
+        
+        current = self._take(remaining)
+        if current is None:
+            raise CircuitOpenError("所有模型均已熔断")
+        launch(current)
+        hedge_at = time.monotonic() + self._hedge_delay(current, kind)
+        # 每次调用最多发出一个对冲请求
+        hedge: Optional[_Backend] = None
+        hedge_skipped = False
+        winner: Optional[_Backend] = None
+        running = 1
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge is None and not hedge_skipped and running == 1 and remaining:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                try:
+                    backend, event, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    if not self._has_free_thread():
+                        hedge_skipped = True
+                        metrics.LLM_HEDGES.labels("skipped").inc()
+                        continue
+                    hedge = self._take(remaining)
+                    if hedge is not None:
+                        launch(hedge)
+                        running += 1
+                    continue
+                
+                if winner is not None and backend is not winner:
+                    continue
+                if event == _ERROR:
+                    if winner is not None:
+                        raise value
+                    running -= 1
+                    if running == 0:
+                        current = self._take(remaining)
+                        if current is None:
+                            self._record_hedge(hedge, None)
+                            raise value
+                        # 在途请求全部失败，立即切换到下一个后端
+                        launch(current)
+                        hedge_at = time.monotonic() + self._hedge_delay(current, kind)
+                        running = 1
+                    continue
+                
+                if winner is None:
+                    winner = backend
+                    self._record_hedge(hedge, winner)
+                    for name, stop in stops.items():
+                        if name != winner.name:
+                            stop.set()
+                if event == _END:
+                    return
+                yield value
+        finally:
+            for stop in stops.values():
+                stop.set()
+    
+    async def _apump(self, backend: _Backend, kind: str, open_stream: Callable[[BaseChatModel], AsyncIterator],
+                     events: asyncio.Queue) -> None:
+        """_pump 的异步版本，以任务方式运行，取消任务即中断后端请求"""
+        started_at = time.monotonic()
+        first = True
+        try:
+            async for chunk in open_stream(backend.llm):
+                if first:
+                    backend.record_first_chunk(kind, time.monotonic() - started_at)
+                    first = False
+                events.put_nowait((backend, _CHUNK, chunk))
+            backend.stats.record_outcome(True)
+            metrics.LLM_BACKEND_REQUESTS.labels(backend.name, "ok").inc()
+            metrics.LLM_SECONDS.labels(backend.name).observe(time.monotonic() - started_at)
+            events.put_nowait((backend, _END, None))
+        except asyncio.CancelledError:
+            # 未返回即被取消：记录已等待的时长，避免持续落败的慢后端一直排在前面
+            if first:
+                backend.stats.record_latency(kind, time.monotonic() - started_at)
+            metrics.LLM_BACKEND_REQUESTS.labels(backend.name, "cancelled").inc()
+            raise
+        except Exception as e:
+            backend.record_error()
+            metrics.LLM_BACKEND_REQUESTS.labels(backend.name, "error").inc()
+            print(f"模型 {backend.name} 调用失败: {e}")
+            events.put_nowait((backend, _ERROR, e))
+    
+    async def _arace(self, kind: str, open_stream: Callable[[BaseChatModel], AsyncIterator]) -> AsyncIterator:
+        """_race 的异步版本，落败的请求被取消"""
+        remaining = self._rank(kind)
+        events: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[str, asyncio.Task] = {}
+        
+        def launch(backend: _Backend) -> None:
+            tasks[backend.name] = asyncio.ensure_future(self._apump(backend, kind, open_stream, events))
+        
+        current = self._take(remaining)
+        if current is None:
+            raise CircuitOpenError("所有模型均已熔断")
+        launch(current)
+        hedge_at = time.monotonic() + self._hedge_delay(current, kind)
+        hedge: Optional[_Backend] = None
+        winner: Optional[_Backend] = None
+        running = 1
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge is None and running == 1 and remaining:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                try:
+                    backend, event, value = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    hedge = self._take(remaining)
+                    if hedge is not None:
+                        launch(hedge)
+                        running += 1
+                    continue
+                
+                if winner is not None and backend is not winner:
+                    continue
+                if event == _ERROR:
+                    if winner is not None:
+                        raise value
+                    running -= 1
+                    if running == 0:
+                        current = self._take(remaining)
+                        if current is None:
+                            self._record_hedge(hedge, None)
+                            raise value
+                        launch(current)
+                        hedge_at = time.monotonic() + self._hedge_delay(current, kind)
+                        running = 1
+                    continue
+                
+                if winner is None:
+                    winner = backend
+                    self._record_hedge(hedge, winner)
+                    for name, task in tasks.items():
+                        if name != winner.name:
+                            task.cancel()
+                if event == _END:
+                    return
+                yield value
+        finally:
+            for task in tasks.values():
+                task.cancel()
+    
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        """调用最快的健康后端，必要时对冲"""
+        for response in self._race(_INVOKE, lambda llm: iter([llm.invoke(input, config, **kwargs)])):
+            return response
+        raise RuntimeError("模型未返回结果")
+    
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        """invoke 的异步版本"""
+        async def single(llm: BaseChatModel) -> AsyncIterator:
+            yield await llm.ainvoke(input, config, **kwargs)
+        
+        race = self._arace(_INVOKE, single)
+        try:
+            async for response in race:
+                return response
+        finally:
+            await race.aclose()
+        raise RuntimeError("模型未返回结果")
+    
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator:
+        """流式调用，按首个分片竞速"""
+        yield from self._race(_STREAM, lambda llm: llm.stream(input, config, **kwargs))
+    
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator:
+        """stream 的异步版本"""
+        async for chunk in self._arace(_STREAM, lambda llm: llm.astream(input, config, **kwargs)):
+            yield chunk
+    
+    def stats(self) -> dict:
+        """各后端的延迟与错误率统计"""
+        result = {}
+        for backend in self.backends:
+            p50 = backend.stats.percentile(_INVOKE, 50, min_samples=1)
+            p_hedge = backend.stats.percentile(_INVOKE, Config.AI_ROUTER_HEDGE_PERCENTILE)
+            first_chunk = backend.stats.percentile(_STREAM, 50, min_samples=1)
+            result[backend.name] = {
+                "healthy": backend.healthy,
+                "breaker": backend.breaker.state,
+                "error_rate": round(backend.stats.error_rate(), 4),
+                "p50_seconds": round(p50, 3) if p50 is not None else None,
+                f"p{Config.AI_ROUTER_HEDGE_PERCENTILE:g}_seconds": round(p_hedge, 3) if p_hedge is not None else None,
+                "first_chunk_p50_seconds": round(first_chunk, 3) if first_chunk is not None else None
+            }
+        return result
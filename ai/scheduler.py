@@ -0,0 +1,309 @@
+"""
+AI任务公平调度模块
+所有用户共享有限的LLM并发。调度器按用户分别排队（可选先按应用分组），以赤字轮询（DRR）按权重轮流执行，
+某个用户或脚本集成大量发送消息时只会排长自己的队列，其他用户的等待时间基本不受影响。
+
+同一用户的对话轮次本就由会话锁串行执行，因此每个用户同时只执行一个任务，避免其排队中的任务占满并发名额；
+超出用户限流（令牌桶）或排队上限的任务直接拒绝
+"""
+import asyncio
+import heapq
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+import metrics
+from config import Config
+from ratelimit import KeyedTokenBuckets
+
+
+class SchedulerRejectedError(Exception):
+    """任务超出用户限流或排队上限，被调度器拒绝"""
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """
+    解析调度权重配置
+    
+    Args:
+        spec: 逗号分隔的 key:权重，key 为用户ID或分组（应用ID），如 "bot-sync:0.2,vip:3"
+    
+    Returns:
+        key -> 权重（大于0）
+    """
+    weights = {}
+    for item in spec.split(","):
+        key, sep, weight = item.strip().rpartition(":")
+        if sep and key and float(weight) > 0:
+            weights[key] = float(weight)
+    return weights
+
+
+class _FairQueue:
+    """按key分别排队、以赤字轮询按权重出队的队列，子队列可嵌套（分组 -> 用户）"""
+    
+    def __init__(self, weights: Dict[str, float]):
+        self._weights = weights
+        # key -> [权重, 赤字, 子队列]，子队列为 deque 或嵌套的 _FairQueue
+        self._children: Dict[str, list] = {}
+        # 有任务排队的key，队首为当前轮到的key
+        self._ring: deque = deque()
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def push(self, keys: Tuple[str, ...], item) -> None:
+        """
+        入队
+        
+        Args:
+            keys: 逐级的key，如 (分组, 用户ID)
+            item: 任务
+        """
+        key = keys[0]
+        child = self._children.get(key)
+        if child is None:
+            queue = _FairQueue(self._weights) if len(keys) > 1 else deque()
+            child = self._children[key] = [self._weights.get(key, 1.0), 0.0, queue]
+            self._ring.append(key)
+        if len(keys) > 1:
+            child[2].push(keys[1:], item)
+        else:
+            child[2].append(item)
+        self._size += 1
+    
+    def has_ready(self, ready: Callable[[str], bool]) -> bool:
+        """是否有可出队的任务"""
+        for key, (_, _, queue) in self._children.items():
+            if queue.has_ready(ready) if isinstance(queue, _FairQueue) else ready(key):
+                return True
+        return False
+    
+    def pop(self, ready: Callable[[str], bool]):
+        """
+        按权重轮流出队
+        
+        Args:
+            ready: 判断用户（最内层key）当前能否执行任务
+        
+        Returns:
+            任务，没有可出队的任务时返回None
+        """
+        skipped = 0
+        while skipped < len(self._ring):
+            key = self._ring[0]
+            child = self._children[key]
+            queue = child[2]
+            nested = isinstance(queue, _FairQueue)
+            if not (queue.has_ready(ready) if nested else ready(key)):
+                self._ring.rotate(-1)
+                skipped += 1
+                continue
+            
+            # 轮到时补充额度，权重小于1的需累积多轮才能执行一次
+            if child[1] < 1:
+                child[1] += child[0]
+                if child[1] < 1:
+                    self._ring.rotate(-1)
+                    skipped = 0
+                    continue
+            
+            item = queue.pop(ready) if nested else queue.popleft()
+            child[1] -= 1
+            self._size -= 1
+            if not queue:
+                # 队列已空，下次有任务时重新计算额度
+                del self._children[key]
+                self._ring.popleft()
+            elif child[1] < 1:
+                self._ring.rotate(-1)
+            return item
+        return None
+
+
+class _SchedulerBase:
+    """公平调度的公共部分：排队、限流、统计"""
+    
+    def __init__(self, concurrency: int):
+        """
+        Args:
+            concurrency: 同时执行的任务数上限
+        """
+        self.concurrency = concurrency
+        self.max_queue_per_user = Config.AI_SCHEDULER_MAX_QUEUE_PER_USER
+        self._queue = _FairQueue(parse_weights(Config.AI_SCHEDULER_WEIGHTS))
+        self._rate_limits: Optional[KeyedTokenBuckets] = None
+        if Config.AI_USER_RATE_PER_MINUTE > 0:
+            self._rate_limits = KeyedTokenBuckets(Config.AI_USER_RATE_PER_MINUTE / 60, Config.AI_USER_BURST)
+        # 用户ID -> 排队中的任务数
+        self._queued: Dict[str, int] = {}
+        # 正在执行任务的用户
+        self._running: Set[str] = set()
+    
+    def _is_idle(self, user_id: str) -> bool:
+        """用户当前没有执行中的任务"""
+        return user_id not in self._running
+    
+    def _enqueue(self, user_id: str, group: str, item) -> None:
+        """检查限流和排队上限后入队（需持有锁）"""
+        if self._queued.get(user_id, 0) >= self.max_queue_per_user:
+            metrics.AI_SCHEDULER_REJECTIONS.labels("queue_full").inc()
+            raise SchedulerRejectedError("排队任务过多")
+        if self._rate_limits is not None and not self._rate_limits.try_acquire(user_id):
+            metrics.AI_SCHEDULER_REJECTIONS.labels("rate_limited").inc()
+            raise SchedulerRejectedError("超出用户限流")
+        self._queued[user_id] = self._queued.get(user_id, 0) + 1
+        self._queue.push((group, user_id), item)
+        metrics.AI_QUEUE_DEPTH.inc()
+    
+    def _dequeue(self):
+        """取出下一个可执行的任务并标记用户执行中（需持有锁）"""
+        item = self._queue.pop(self._is_idle)
+        if item is None:
+            return None
+        user_id, queued_at = item[0], item[1]
+        self._queued[user_id] -= 1
+        if self._queued[user_id] == 0:
+            del self._queued[user_id]
+        self._running.add(user_id)
+        metrics.AI_QUEUE_DEPTH.dec()
+        metrics.AI_QUEUE_WAIT_SECONDS.observe(time.monotonic() - queued_at)
+        return item
+    
+    def stats(self) -> dict:
+        """调度状态：执行中、排队中的任务数及排队最多的用户"""
+        busiest = heapq.nlargest(5, self._queued.items(), key=lambda kv: kv[1])
+        return {
+            "running": len(self._running),
+            "queued": len(self._queue),
+            "busiest_users": dict(busiest)
+        }
+
+
+class FairScheduler(_SchedulerBase):
+    """公平调度的线程池（替代 ThreadPoolExecutor）"""
+    
+    def __init__(self, concurrency: int, thread_name_prefix: str = "ai-reply"):
+        super().__init__(concurrency)
+        self.thread_name_prefix = thread_name_prefix
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+    
+    def stats(self) -> dict:
+        with self._cond:
+            return super().stats()
+    
+    def submit(self, user_id: str, group: str, fn: Callable, /, *args, **kwargs) -> Future:
+        """
+        提交任务（立即返回）
+        
+        Args:
+            user_id: 用户ID，同一用户的任务按提交顺序逐个执行
+            group: 分组（如应用ID），各分组之间先按权重轮流，为空表示不分组
+            fn: 任务函数，args、kwargs 为其参数
+        
+        Returns:
+            任务的 Future
+        
+        Raises:
+            SchedulerRejectedError: 超出用户限流或排队上限
+        """
+        future = Future()
+        with self._cond:
+            self._enqueue(user_id, group, (user_id, time.monotonic(), future, fn, args, kwargs))
+            self._cond.notify()
+        self._ensure_workers()
+        return future
+    
+    def _ensure_workers(self) -> None:
+        """启动工作线程（在首次使用时启动，兼容 gunicorn 的 fork 模型）"""
+        if len(self._workers) == self.concurrency and all(t.is_alive() for t in self._workers):
+            return
+        with self._cond:
+            self._workers = [t for t in self._workers if t.is_alive()]
+            while len(self._workers) < self.concurrency:
+                worker = threading.Thread(
+                    target=self._work_loop,
+                    name=f"{self.thread_name_prefix}_{len(self._workers)}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+    
+    def _work_loop(self) -> None:
+        """工作线程：按公平调度取出任务执行"""
+        while True:
+            with self._cond:
+                item = self._dequeue()
+                while item is None:
+                    self._cond.wait()
+                    item = self._dequeue()
+            user_id, _, future, fn, args, kwargs = item
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running.discard(user_id)
+                    # 该用户排队中的任务可以执行了
+                    self._cond.notify_all()
+
+
+class AsyncFairScheduler(_SchedulerBase):
+    """公平调度的异步并发名额（替代 asyncio.Semaphore，只能在同一个事件循环中使用）"""
+    
+    def __init__(self, concurrency: int):
+        super().__init__(concurrency)
+        self._active = 0
+    
+    def _dispatch(self) -> None:
+        """有空闲名额时唤醒下一个排队的任务"""
+        while self._active < self.concurrency:
+            item = self._dequeue()
+            if item is None:
+                return
+            user_id, _, waiter = item
+            if waiter.cancelled():
+                self._running.discard(user_id)
+                continue
+            self._active += 1
+            waiter.set_result(None)
+    
+    def _release(self, user_id: str) -> None:
+        """归还名额"""
+        self._active -= 1
+        self._running.discard(user_id)
+        self._dispatch()
+    
+    @asynccontextmanager
+    async def slot(self, user_id: str, group: str = "") -> AsyncIterator[None]:
+        """
+        按公平调度等待执行名额
+        
+        Args:
+            user_id: 用户ID
+            group: 分组（如应用ID），为空表示不分组
+        
+        Raises:
+            SchedulerRejectedError: 超出用户限流或排队上限
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self._enqueue(user_id, group, (user_id, time.monotonic(), waiter))
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(user_id)
+            raise
+        try:
+            yield
+        finally:
+            self._release(user_id)
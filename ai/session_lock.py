@@ -0,0 +1,349 @@
+"""
+会话锁模块
+保证同一会话的对话轮次按顺序执行（读取历史 → 调用AI → 写入历史），不同会话完全并行
+
+两级加锁：进程内先按会话排队（线程锁 / asyncio锁），队首再抢Redis租约锁，避免同一进程内的
+多个请求轮询Redis。每次抢到Redis锁都会递增该会话的栅栏令牌（fencing token），写入历史时
+校验令牌仍是最新的，租约过期后被他人接管的旧持有者无法再写入。
+持有期间由后台线程定期续租，耗时超过租约时长的对话轮次（如长篇流式回复）不会中途失去锁；
+持有者崩溃后不再续租，租约到期后自动释放。
+等待超时抛出 SessionBusyError，由调用方放弃本轮（回复繁忙提示），不会不加锁继续处理。
+Redis不可用时退化为只有进程内锁
+"""
+import asyncio
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import redis
+
+import metrics
+from breaker import CircuitOpenError
+from config import Config
+from redis_client import get_async_redis_client, get_redis_client
+
+# 抢锁：锁不存在时递增栅栏令牌并以令牌为值加锁，返回令牌；锁已被持有返回0
+_ACQUIRE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], token, 'PX', tonumber(ARGV[1]))
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[2]))
+return token
+"""
+
+# 释放锁（仅当锁仍由自己持有）
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 续租（仅当锁仍由自己持有），返回0表示租约已丢失
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return 0
+"""
+
+# 续租间隔占租约时长的比例
+_RENEW_FRACTION = 1 / 3
+
+# 抢锁失败后的轮询间隔（秒），逐次加倍至上限
+_POLL_MIN_SECONDS = 0.01
+_POLL_MAX_SECONDS = 0.2
+
+
+def get_fence_key(session_id: str) -> str:
+    """会话栅栏令牌的Redis key（ConversationHistory 写入时校验）"""
+    return f"wecom:chat:fence:{session_id}"
+
+
+def _get_lock_key(session_id: str) -> str:
+    """会话锁的Redis key"""
+    return f"wecom:chat:lock:{session_id}"
+
+
+class SessionBusyError(Exception):
+    """等待会话锁超时（同一会话的上一轮对话仍在处理中）"""
+
+
+class _LocalLocks:
+    """按会话分配的进程内锁，无人使用时回收"""
+    
+    def __init__(self, factory):
+        """
+        Args:
+            factory: 创建锁对象的函数（threading.Lock 或 asyncio.Lock）
+        """
+        self._factory = factory
+        # 会话ID -> [锁, 引用数]
+        self._locks: Dict[str, List] = {}
+        self._guard = threading.Lock()
+    
+    def acquire_ref(self, session_id: str):
+        """获取会话锁对象并增加引用"""
+        with self._guard:
+            entry = self._locks.get(session_id)
+            if entry is None:
+                entry = self._locks[session_id] = [self._factory(), 0]
+            entry[1] += 1
+            return entry[0]
+    
+    def release_ref(self, session_id: str) -> None:
+        """减少引用，无人使用时回收"""
+        with self._guard:
+            entry = self._locks[session_id]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+
+class SessionLock:
+    """会话级互斥锁（进程内 + Redis租约锁）"""
+    
+    def __init__(self):
+        self.lease_ms = int(Config.SESSION_LOCK_LEASE_SECONDS * 1000)
+        self.wait_seconds = Config.SESSION_LOCK_WAIT_SECONDS
+        self._redis_client: Optional[redis.Redis] = None
+        self._async_redis_client = None
+        self._scripts: Dict[str, object] = {}
+        self._thread_locks = _LocalLocks(threading.Lock)
+        self._async_locks = _LocalLocks(asyncio.Lock)
+        # 持有中的Redis锁：(会话ID, 栅栏令牌)，由续租线程定期续租
+        self._held: Dict[Tuple[str, int], None] = {}
+        self._held_guard = threading.Lock()
+        self._renewer: Optional[threading.Thread] = None
+    
+    @property
+    def redis_client(self) -> redis.Redis:
+        """懒加载Redis客户端"""
+        if self._redis_client is None:
+            self._redis_client = get_redis_client()
+        return self._redis_client
+    
+    @property
+    def async_redis_client(self):
+        """懒加载异步Redis客户端"""
+        if self._async_redis_client is None:
+            self._async_redis_client = get_async_redis_client()
+        return self._async_redis_client
+    
+    def _script(self, name: str, client, source: str):
+        """注册并缓存Lua脚本（同步、异步客户端分别注册）"""
+        script = self._scripts.get(name)
+        if script is None:
+            script = self._scripts[name] = client.register_script(source)
+        return script
+    
+    def _acquire_args(self, session_id: str) -> dict:
+        """_ACQUIRE_SCRIPT 的参数"""
+        return {
+            "keys": [_get_lock_key(session_id), get_fence_key(session_id)],
+            "args": [self.lease_ms, Config.CONVERSATION_TTL_SECONDS]
+        }
+    
+    @staticmethod
+    def _poll_interval(attempt: int) -> float:
+        """抢锁失败后的等待时间，带随机抖动避免多个进程同时重试"""
+        interval = min(_POLL_MIN_SECONDS * (2 ** attempt), _POLL_MAX_SECONDS)
+        return random.uniform(interval / 2, interval)
+    
+    def _acquire_redis(self, session_id: str, deadline: float) -> Optional[int]:
+        """
+        抢Redis锁，直到成功或超时
+        
+        Returns:
+            栅栏令牌，Redis不可用返回None
+        
+        Raises:
+            SessionBusyError: 等待超时
+        """
+        acquire = self._script("acquire", self.redis_client, _ACQUIRE_SCRIPT)
+        attempt = 0
+        try:
+            while True:
+                token = acquire(**self._acquire_args(session_id))
+                if token:
+                    return token
+                if time.monotonic() >= deadline:
+                    raise self._timeout(session_id)
+                time.sleep(self._poll_interval(attempt))
+                attempt += 1
+        except SessionBusyError:
+            raise
+        except CircuitOpenError:
+            metrics.SESSION_LOCKS.labels("degraded").inc()
+        except Exception as e:
+            metrics.redis_error("session_lock")
+            metrics.SESSION_LOCKS.labels("degraded").inc()
+            print(f"获取会话锁失败，仅使用进程内锁: {e}")
+        return None
+    
+    def _ensure_renewer(self) -> None:
+        """启动续租线程（在首次使用时启动，兼容 gunicorn 的 fork 模型）"""
+        if self._renewer is not None and self._renewer.is_alive():
+            return
+        with self._held_guard:
+            if self._renewer is not None and self._renewer.is_alive():
+                return
+            self._renewer = threading.Thread(target=self._renew_loop, name="session-lock-renewer", daemon=True)
+            self._renewer.start()
+    
+    def _renew_loop(self) -> None:
+        """续租线程：定期为本进程持有的Redis锁续租（同步、异步持有者共用，使用同步客户端）"""
+        interval = self.lease_ms / 1000 * _RENEW_FRACTION
+        while True:
+            time.sleep(interval)
+            with self._held_guard:
+                held = list(self._held)
+            for session_id, token in held:
+                self._renew(session_id, token)
+    
+    def _renew(self, session_id: str, token: int) -> None:
+        """为一个Redis锁续租，租约已丢失时停止续租（之后的写入会被栅栏令牌拒绝）"""
+        try:
+            renew = self._script("renew", self.redis_client, _RENEW_SCRIPT)
+            if renew(keys=[_get_lock_key(session_id)], args=[token, self.lease_ms]):
+                return
+            metrics.SESSION_LOCKS.labels("lost").inc()
+            print(f"会话锁租约已丢失: session={session_id}")
+            self._untrack(session_id, token)
+        except Exception as e:
+            metrics.redis_error("session_lock")
+            print(f"会话锁续租失败: {e}")
+    
+    def _track(self, session_id: str, token: int) -> None:
+        """登记持有中的Redis锁，开始续租"""
+        self._ensure_renewer()
+        with self._held_guard:
+            self._held[(session_id, token)] = None
+    
+    def _untrack(self, session_id: str, token: int) -> None:
+        """停止续租"""
+        with self._held_guard:
+            self._held.pop((session_id, token), None)
+    
+    def _timeout(self, session_id: str) -> SessionBusyError:
+        """记录一次等待超时"""
+        metrics.SESSION_LOCKS.labels("timeout").inc()
+        print(f"等待会话锁超时，放弃本轮对话: session={session_id}")
+        return SessionBusyError(session_id)
+    
+    def _release_redis(self, session_id: str, token: int) -> None:
+        """释放Redis锁"""
+        self._untrack(session_id, token)
+        try:
+            release = self._script("release", self.redis_client, _RELEASE_SCRIPT)
+            release(keys=[_get_lock_key(session_id)], args=[token])
+        except Exception as e:
+            metrics.redis_error("session_lock")
+            print(f"释放会话锁失败: {e}")
+    
+    @contextmanager
+    def hold(self, session_id: str) -> Iterator[Optional[int]]:
+        """
+        持有会话锁执行一轮对话
+        
+        Args:
+            session_id: 会话ID
+        
+        Yields:
+            栅栏令牌，写入历史时传给 ConversationHistory；Redis不可用时为None
+        
+        Raises:
+            SessionBusyError: 等待超过 SESSION_LOCK_WAIT_SECONDS
+        """
+        if not Config.SESSION_LOCK_ENABLED:
+            yield None
+            return
+        
+        started_at = time.monotonic()
+        deadline = started_at + self.wait_seconds
+        local = self._thread_locks.acquire_ref(session_id)
+        try:
+            if not local.acquire(timeout=self.wait_seconds):
+                raise self._timeout(session_id)
+            try:
+                token = self._acquire_redis(session_id, deadline)
+                metrics.SESSION_LOCK_WAIT_SECONDS.observe(time.monotonic() - started_at)
+                if token is not None:
+                    metrics.SESSION_LOCKS.labels("acquired").inc()
+                    self._track(session_id, token)
+                try:
+                    yield token
+                finally:
+                    if token is not None:
+                        self._release_redis(session_id, token)
+            finally:
+                local.release()
+        finally:
+            self._thread_locks.release_ref(session_id)
+    
+    async def _aacquire_redis(self, session_id: str, deadline: float) -> Optional[int]:
+        """_acquire_redis 的异步版本"""
+        acquire = self._script("aacquire", self.async_redis_client, _ACQUIRE_SCRIPT)
+        attempt = 0
+        try:
+            while True:
+                token = await acquire(**self._acquire_args(session_id))
+                if token:
+                    return token
+                if time.monotonic() >= deadline:
+                    raise self._timeout(session_id)
+                await asyncio.sleep(self._poll_interval(attempt))
+                attempt += 1
+        except SessionBusyError:
+            raise
+        except CircuitOpenError:
+            metrics.SESSION_LOCKS.labels("degraded").inc()
+        except Exception as e:
+            metrics.redis_error("session_lock")
+            metrics.SESSION_LOCKS.labels("degraded").inc()
+            print(f"获取会话锁失败，仅使用进程内锁: {e}")
+        return None
+    
+    async def _arelease_redis(self, session_id: str, token: int) -> None:
+        """_release_redis 的异步版本"""
+        self._untrack(session_id, token)
+        try:
+            release = self._script("arelease", self.async_redis_client, _RELEASE_SCRIPT)
+            await release(keys=[_get_lock_key(session_id)], args=[token])
+        except Exception as e:
+            metrics.redis_error("session_lock")
+            print(f"释放会话锁失败: {e}")
+    
+    @asynccontextmanager
+    async def ahold(self, session_id: str) -> AsyncIterator[Optional[int]]:
+        """hold 的异步版本（进程内锁为 asyncio.Lock，只能在同一个事件循环中使用）"""
+        if not Config.SESSION_LOCK_ENABLED:
+            yield None
+            return
+        
+        started_at = time.monotonic()
+        deadline = started_at + self.wait_seconds
+        local = self._async_locks.acquire_ref(session_id)
+        try:
+            try:
+                await asyncio.wait_for(local.acquire(), self.wait_seconds)
+            except asyncio.TimeoutError:
+                raise self._timeout(session_id)
+            try:
+                token = await self._aacquire_redis(session_id, deadline)
+                metrics.SESSION_LOCK_WAIT_SECONDS.observe(time.monotonic() - started_at)
+                if token is not None:
+                    metrics.SESSION_LOCKS.labels("acquired").inc()
+                    self._track(session_id, token)
+                try:
+                    yield token
+                finally:
+                    if token is not None:
+                        await self._arelease_redis(session_id, token)
+            finally:
+                local.release()
+        finally:
+            self._async_locks.release_ref(session_id)
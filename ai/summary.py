@@ -0,0 +1,122 @@
+"""
+对话摘要压缩模块
+会话消息数超过阈值时，在后台线程中用较便宜的模型将最早的若干轮对话
+合并进滚动摘要，保持提示词简短的同时保留早期上下文
+"""
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from config import Config
+from .history import ConversationHistory
+
+
+class HistoryCompactor:
+    """后台对话摘要压缩器，不在请求路径上执行任何LLM调用"""
+    
+    SUMMARY_PROMPT = """请将以下客服对话与已有摘要合并，生成一段简洁的中文摘要。
+要求：保留用户身份信息、核心诉求、已给出的结论和待办事项，不超过300字，只输出摘要内容。
+
+已有摘要：
+{summary}
+
+新的对话：
+{conversation}"""
+    
+    # 压缩任务锁的有效期（秒），防止多个worker同时压缩同一会话
+    LOCK_TTL_SECONDS = 120
+    
+    def __init__(self, history: ConversationHistory):
+        self.history = history
+        self._llm: Optional[BaseChatModel] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-compact")
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+    
+    @property
+    def llm(self) -> BaseChatModel:
+        """懒加载摘要模型"""
+        if self._llm is None:
+            from .chat import create_llm
+            self._llm = create_llm(Config.CONVERSATION_SUMMARY_MODEL)
+        return self._llm
+    
+    def maybe_schedule(self, session_id: str, message_count: int) -> None:
+        """
+        消息数达到阈值时提交后台压缩任务（立即返回）
+        
+        Args:
+            session_id: 会话ID
+            message_count: 当前消息数
+        """
+        if not Config.CONVERSATION_SUMMARY_ENABLED:
+            return
+        if message_count < Config.CONVERSATION_SUMMARY_THRESHOLD:
+            return
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        try:
+            self._executor.submit(self._run, session_id)
+        except RuntimeError:
+            # 进程退出中，线程池已关闭
+            with self._lock:
+                self._pending.discard(session_id)
+    
+    def _run(self, session_id: str) -> None:
+        """执行压缩任务"""
+        try:
+            self.compact(session_id)
+        except Exception as e:
+            print(f"对话摘要压缩失败: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
+    
+    @staticmethod
+    def _format_conversation(messages: List[BaseMessage]) -> str:
+        """格式化对话内容"""
+        lines = []
+        for message in messages:
+            role = "用户" if isinstance(message, HumanMessage) else "客服"
+            lines.append(f"{role}：{message.content}")
+        return "\n".join(lines)
+    
+    def compact(self, session_id: str) -> bool:
+        """
+        将最早的一批消息合并进摘要
+        
+        Args:
+            session_id: 会话ID
+        
+        Returns:
+            是否完成压缩
+        """
+        redis_client = self.history.redis_client
+        lock_key = f"wecom:chat:summary:lock:{session_id}"
+        lock_token = uuid.uuid4().hex
+        if not redis_client.set(lock_key, lock_token, nx=True, ex=self.LOCK_TTL_SECONDS):
+            return False
+        
+        try:
+            items, messages = self.history.get_oldest(session_id, Config.CONVERSATION_SUMMARY_BATCH)
+            if len(items) < Config.CONVERSATION_SUMMARY_BATCH:
+                return False
+            
+            prompt = self.SUMMARY_PROMPT.format(
+                summary=self.history.get_summary(session_id) or "无",
+                conversation=self._format_conversation(messages)
+            )
+            summary = self.llm.invoke(prompt).content.strip()
+            if not summary:
+                return False
+            
+            return self.history.apply_summary(session_id, items, summary)
+        finally:
+            if redis_client.get(lock_key) == lock_token:
+                redis_client.delete(lock_key)
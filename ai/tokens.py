@@ -0,0 +1,30 @@
+"""
+Token计数模块
+在写入历史时估算消息的token数，用于按token预算选取历史窗口
+"""
+import re
+
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 中日韩字符（含全角标点），通义千问/DeepSeek 分词器下约1字1 token
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    估算文本的token数
+    
+    不依赖具体模型的分词器：中日韩字符按1字1 token计，其余字符按约4字符1 token计
+    
+    Args:
+        text: 文本内容
+    
+    Returns:
+        估算的token数
+    """
+    if not text:
+        return MESSAGE_OVERHEAD_TOKENS
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4 + MESSAGE_OVERHEAD_TOKENS
@@ -2,13 +2,24 @@
 企业微信智能机器人 Flask 应用
 处理企业微信回调消息，集成AI对话服务
 """
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Optional
 from flask import Flask, request, make_response
 import logging
+import time
 
+import metrics
 from config import Config
+from redis_client import redis_breaker
 from wecom.crypto import WXBizMsgCrypt
+from wecom.debounce import MessageDebouncer
+from wecom.dedup import MessageDeduplicator
 from wecom.message import MessageHandler, WeChatMessage
+from wecom.sender import OutboundScheduler
+from ai.admission import AdmissionController
 from ai.chat import ChatService
+from ai.reply_queue import ReplyQueue
+from ai.scheduler import FairScheduler, SchedulerRejectedError
 
 # 配置日志
 logging.basicConfig(
@@ -24,11 +35,23 @@ app = Flask(__name__)
 crypto: WXBizMsgCrypt = None
 message_handler: MessageHandler = None
 chat_service: ChatService = None
+ai_scheduler: FairScheduler = None
+admission: AdmissionController = None
+reply_queue: ReplyQueue = None
+deduplicator: MessageDeduplicator = None
+debouncer: MessageDebouncer = None
+outbound: OutboundScheduler = None
+recorder = None
+
+# AI服务异常时的兜底回复
+FALLBACK_REPLY = "抱歉，服务暂时不可用，请稍后再试。"
+# AI任务积压过多、未准入时的回复
+BUSY_REPLY = "当前咨询人数较多，请稍后再试。"
 
 
 def init_app():
     """初始化应用组件"""
-    global crypto, message_handler, chat_service
+    global crypto, message_handler, chat_service, ai_scheduler, admission, reply_queue, deduplicator, debouncer, outbound, recorder
     
     try:
         Config.validate()
@@ -43,11 +66,105 @@ def init_app():
     )
     
     message_handler = MessageHandler()
+    outbound = OutboundScheduler(message_handler)
+    deduplicator = MessageDeduplicator()
     chat_service = ChatService()
     
+    # AI调用线程池，限制单个worker内并发的LLM请求数，按用户公平调度
+    ai_scheduler = FairScheduler(Config.AI_EXECUTOR_MAX_WORKERS, thread_name_prefix="ai-reply")
+    
+    if Config.AI_ADMISSION_ENABLED:
+        admission = AdmissionController(Config.AI_EXECUTOR_MAX_WORKERS)
+    
+    if Config.AI_QUEUE_ENABLED:
+        reply_queue = ReplyQueue()
+    
+    if Config.WECOM_DEBOUNCE_ENABLED:
+        debouncer = MessageDebouncer()
+    
+    if Config.CALLBACK_RECORD_PATH:
+        from loadtest.recorder import CallbackRecorder
+        recorder = CallbackRecorder(Config.CALLBACK_RECORD_PATH)
+    
     logger.info("应用组件初始化完成")
 
 
+def _deliver_reply_later(user_id: str, future: Future) -> None:
+    """
+    AI回复超过被动回复时限后，待生成完成再通过主动消息推送
+    
+    Args:
+        user_id: 接收消息的用户ID
+        future: AI调用任务
+    """
+    try:
+        ai_reply = future.result()
+        logger.info(f"AI延迟回复: {ai_reply[:50]}...")
+    except Exception as e:
+        logger.error(f"AI服务调用失败: {e}")
+        ai_reply = FALLBACK_REPLY
+    
+    outbound.submit(user_id, ai_reply)
+
+
+def _admit(user_id: str) -> str:
+    """AI任务准入判断，未开启准入控制时总是准入"""
+    if admission is None:
+        return AdmissionController.ADMIT
+    return admission.acquire(user_id)
+
+
+def _run_admitted(func, *args, **kwargs):
+    """在线程池中执行已准入的AI任务，开启准入控制时记录耗时并释放名额"""
+    if admission is None:
+        return func(*args, **kwargs)
+    with admission.running():
+        return func(*args, **kwargs)
+
+
+def _submit_ai(msg: WeChatMessage, func, *args, **kwargs) -> Optional[Future]:
+    """
+    提交已准入的AI任务，按用户（可选按应用分组）公平调度
+    
+    Returns:
+        任务的 Future，超出用户限流或排队上限时返回None（调用方回复繁忙提示）
+    """
+    group = msg.agent_id if Config.AI_SCHEDULER_GROUP_BY == "agent" else ""
+    try:
+        return ai_scheduler.submit(msg.from_user_name, group, _run_admitted, func, *args, **kwargs)
+    except SchedulerRejectedError as e:
+        logger.warning(f"AI任务未能排队（{e}），返回繁忙提示: user={msg.from_user_name}")
+        if admission is not None:
+            admission.release()
+        return None
+
+
+def _reply_merged(msg: WeChatMessage) -> None:
+    """
+    处理合并后的消息（由 MessageDebouncer 回调，需尽快返回），回复通过主动消息推送
+    
+    Args:
+        msg: 合并后的消息，content 为窗口期内的各条消息按行拼接
+    """
+    if reply_queue is not None and reply_queue.enqueue(msg):
+        return
+    
+    if _admit(msg.from_user_name) == AdmissionController.REJECT:
+        outbound.submit(msg.from_user_name, BUSY_REPLY)
+        return
+    
+    if Config.AI_STREAM_ENABLED:
+        future = _submit_ai(msg, _stream_reply, msg.from_user_name, msg.content)
+    else:
+        future = _submit_ai(msg, chat_service.chat, session_id=msg.from_user_name, user_input=msg.content)
+        if future is not None:
+            future.add_done_callback(
+                lambda f, user_id=msg.from_user_name: _deliver_reply_later(user_id, f)
+            )
+    if future is None:
+        outbound.submit(msg.from_user_name, BUSY_REPLY)
+
+
 @app.route("/wecom/callback", methods=["GET", "POST"])
 def wecom_callback():
     """
@@ -77,6 +194,7 @@ def wecom_callback():
     
     else:
         # 接收消息
+        started_at = time.monotonic()
         post_data = request.data.decode("utf-8")
         logger.info(f"收到消息回调: timestamp={timestamp}, nonce={nonce}")
         
@@ -94,48 +212,179 @@ def wecom_callback():
             return "解析失败", 400
         
         logger.info(f"收到消息: from={msg.from_user_name}, type={msg.msg_type}, content={msg.content[:50] if msg.content else ''}")
+        if recorder is not None:
+            recorder.record(msg)
         
         # 只处理文本消息
         if msg.msg_type != "text":
             logger.info(f"忽略非文本消息: {msg.msg_type}")
             return "success"
         
-        # 调用AI服务处理消息
-        try:
-            ai_reply = chat_service.chat(
-                session_id=msg.from_user_name,
-                user_input=msg.content
-            )
-            logger.info(f"AI回复: {ai_reply[:50]}...")
-        except Exception as e:
-            logger.error(f"AI服务调用失败: {e}")
-            ai_reply = "抱歉，服务暂时不可用，请稍后再试。"
-        
-        # 构建回复消息
-        reply_xml = message_handler.build_text_reply(
-            to_user=msg.from_user_name,
-            from_user=msg.to_user_name,
-            content=ai_reply
-        )
-        
-        # 加密回复消息
-        ret, encrypted_reply = crypto.encrypt_msg(reply_xml, nonce, timestamp)
+        # 消息去重：企业微信重试推送的同一消息不重复调用AI
+        if msg.msg_id:
+            status, cached_reply = deduplicator.begin(msg.msg_id)
+            if status == MessageDeduplicator.STATUS_IN_FLIGHT:
+                logger.info(f"重复消息正在处理中，直接返回: msg_id={msg.msg_id}")
+                return "success"
+            if status == MessageDeduplicator.STATUS_DONE:
+                logger.info(f"重复消息已处理: msg_id={msg.msg_id}, 重放回复={cached_reply is not None}")
+                if cached_reply is None:
+                    return "success"
+                return _passive_reply(msg, cached_reply, nonce, timestamp)
         
-        if ret != WXBizMsgCrypt.WXBizMsgCrypt_OK:
-            logger.error(f"回复消息加密失败, 错误码: {ret}")
-            # 如果被动回复失败，尝试主动发送
-            message_handler.send_text_message(msg.from_user_name, ai_reply)
+        # 处理过程中出现异常（含 worker 超时被中止）时释放认领，企业微信的重试可以重新处理
+        try:
+            return _reply_message(msg, nonce, timestamp, started_at)
+        except BaseException:
+            _abort_message(msg)
+            raise
+
+
+def _reply_message(msg: WeChatMessage, nonce: str, timestamp: str, started_at: float):
+    """
+    处理已认领的文本消息：调用AI服务，在时限内完成则被动回复，否则转为主动推送
+    
+    Args:
+        msg: 收到的消息
+        nonce: 回调请求的随机数
+        timestamp: 回调请求的时间戳
+        started_at: 开始处理回调的时间（time.monotonic）
+    """
+    # 消息合并模式：立即返回，窗口期内的连续消息合并后只回复一次（主动推送）
+    if debouncer is not None:
+        _finish_message(msg)
+        debouncer.submit(msg, _reply_merged)
+        return "success"
+    
+    # 队列模式：入队后立即返回，由 worker 生成回复并主动推送
+    if reply_queue is not None:
+        if reply_queue.enqueue(msg):
+            _finish_message(msg)
             return "success"
-        
-        response = make_response(encrypted_reply)
-        response.headers["Content-Type"] = "application/xml"
-        return response
+        logger.warning("消息入队失败，改为在当前进程处理")
+    
+    # 准入控制：AI任务积压过多时直接回复繁忙提示，不再调用AI
+    decision = _admit(msg.from_user_name)
+    if decision == AdmissionController.REJECT:
+        logger.warning(f"AI任务积压过多，返回繁忙提示: user={msg.from_user_name}")
+        return _passive_reply(msg, BUSY_REPLY, nonce, timestamp)
+    
+    # 流式模式：立即返回，回复边生成边分段主动推送
+    if Config.AI_STREAM_ENABLED:
+        if _submit_ai(msg, _stream_reply, msg.from_user_name, msg.content) is None:
+            return _passive_reply(msg, BUSY_REPLY, nonce, timestamp)
+        _finish_message(msg)
+        return "success"
+    
+    # 调用AI服务处理消息，在时限内完成则被动回复，否则转为主动推送
+    future = _submit_ai(
+        msg,
+        chat_service.chat,
+        session_id=msg.from_user_name,
+        user_input=msg.content
+    )
+    if future is None:
+        return _passive_reply(msg, BUSY_REPLY, nonce, timestamp)
+    # 预计无法在时限内完成时不再等待，直接转为主动推送
+    remaining = Config.AI_REPLY_DEADLINE_SECONDS - (time.monotonic() - started_at)
+    if decision == AdmissionController.DEFER:
+        remaining = 0
+    try:
+        ai_reply = future.result(timeout=max(remaining, 0))
+        logger.info(f"AI回复: {ai_reply[:50]}...")
+    except FutureTimeoutError:
+        logger.info(f"AI回复超过{Config.AI_REPLY_DEADLINE_SECONDS}秒，转为主动推送: user={msg.from_user_name}")
+        _finish_message(msg)
+        future.add_done_callback(
+            lambda f, user_id=msg.from_user_name: _deliver_reply_later(user_id, f)
+        )
+        return "success"
+    except Exception as e:
+        logger.error(f"AI服务调用失败: {e}")
+        ai_reply = FALLBACK_REPLY
+    
+    return _passive_reply(msg, ai_reply, nonce, timestamp)
+
+
+def _stream_reply(user_id: str, content: str) -> None:
+    """流式生成AI回复，每生成一段即提交主动推送（同一用户的分段按顺序发送）"""
+    try:
+        ai_reply = chat_service.chat_stream(user_id, content, lambda segment: outbound.submit(user_id, segment))
+        logger.info(f"AI流式回复: {ai_reply[:50]}...")
+    except Exception as e:
+        logger.error(f"AI服务调用失败: {e}")
+
+
+def _finish_message(msg: WeChatMessage, passive_reply: str = None) -> None:
+    """标记消息处理完成，passive_reply 为已被动回复的内容，供重试时重放"""
+    if msg.msg_id:
+        deduplicator.finish(msg.msg_id, passive_reply)
+
+
+def _abort_message(msg: WeChatMessage) -> None:
+    """消息处理失败，释放认领（已标记完成的消息不受影响）"""
+    if msg.msg_id:
+        deduplicator.abort(msg.msg_id)
+
+
+def _passive_reply(msg: WeChatMessage, ai_reply: str, nonce: str, timestamp: str):
+    """
+    构建加密的被动回复，加密失败时改为主动推送
+    
+    Args:
+        msg: 收到的消息
+        ai_reply: 回复内容
+        nonce: 回调请求的随机数
+        timestamp: 回调请求的时间戳
+    """
+    # 构建回复消息
+    reply_xml = message_handler.build_text_reply(
+        to_user=msg.from_user_name,
+        from_user=msg.to_user_name,
+        content=ai_reply
+    )
+    
+    # 加密回复消息
+    ret, encrypted_reply = crypto.encrypt_msg(reply_xml, nonce, timestamp)
+    
+    if ret != WXBizMsgCrypt.WXBizMsgCrypt_OK:
+        logger.error(f"回复消息加密失败, 错误码: {ret}")
+        # 如果被动回复失败，尝试主动发送
+        _finish_message(msg)
+        outbound.submit(msg.from_user_name, ai_reply)
+        return "success"
+    
+    _finish_message(msg, ai_reply)
+    response = make_response(encrypted_reply)
+    response.headers["Content-Type"] = "application/xml"
+    return response
 
 
 @app.route("/health", methods=["GET"])
 def health_check():
     """健康检查接口"""
-    return {"status": "ok", "service": "wecom-bot"}
+    result = {"status": "ok", "service": "wecom-bot"}
+    if chat_service is not None and chat_service.cache is not None:
+        result["cache"] = chat_service.cache.stats()
+    if chat_service is not None and chat_service.router is not None:
+        result["router"] = chat_service.router.stats()
+    if ai_scheduler is not None:
+        result["scheduler"] = ai_scheduler.stats()
+    if admission is not None:
+        result["admission"] = admission.stats()
+    result["breakers"] = {"redis": redis_breaker.stats()}
+    if chat_service is not None and chat_service.llm_breaker is not None:
+        result["breakers"]["llm"] = chat_service.llm_breaker.stats()
+    return result
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus 监控指标"""
+    body, content_type = metrics.render()
+    response = make_response(body)
+    response.headers["Content-Type"] = content_type
+    return response
 
 
 @app.route("/session/<user_id>", methods=["GET"])
@@ -0,0 +1,445 @@
+"""
+企业微信智能机器人 ASGI 应用
+与 app.py（Flask/WSGI）功能相同（含 /metrics），基于 asyncio 处理回调：对话历史使用 redis.asyncio，
+AI 调用使用 ainvoke/astream，主动消息使用异步HTTP客户端，单个进程即可同时等待大量 LLM 调用
+
+启动方式: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import nullcontext
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs
+
+import metrics
+from config import Config
+from redis_client import redis_breaker
+from wecom.crypto import WXBizMsgCrypt
+from wecom.debounce import MessageDebouncer
+from wecom.dedup import MessageDeduplicator
+from wecom.message import MessageHandler, WeChatMessage, get_async_api_client
+from wecom.sender import AsyncOutboundScheduler
+from ai.admission import AdmissionController
+from ai.chat import ChatService
+from ai.reply_queue import ReplyQueue
+from ai.scheduler import AsyncFairScheduler, SchedulerRejectedError
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# AI服务异常时的兜底回复
+FALLBACK_REPLY = "抱歉，服务暂时不可用，请稍后再试。"
+# AI任务积压过多、未准入时的回复
+BUSY_REPLY = "当前咨询人数较多，请稍后再试。"
+
+# 响应：(状态码, Content-Type, 响应体)
+Response = Tuple[int, str, bytes]
+
+
+def text_response(body: str, status: int = 200) -> Response:
+    return status, "text/html; charset=utf-8", body.encode("utf-8")
+
+
+def json_response(data: dict, status: int = 200) -> Response:
+    return status, "application/json", json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+class WeComBotApp:
+    """ASGI 应用"""
+    
+    def __init__(self):
+        self.crypto: Optional[WXBizMsgCrypt] = None
+        self.message_handler: Optional[MessageHandler] = None
+        self.chat_service: Optional[ChatService] = None
+        self.reply_queue: Optional[ReplyQueue] = None
+        self.deduplicator: Optional[MessageDeduplicator] = None
+        self.debouncer: Optional[MessageDebouncer] = None
+        # 主动消息按应用/成员限频排队发送，同一成员的消息按提交顺序到达
+        self.outbound: Optional[AsyncOutboundScheduler] = None
+        self.recorder = None
+        # 限制单个进程内并发的LLM请求数，按用户公平调度
+        self.ai_scheduler: Optional[AsyncFairScheduler] = None
+        self.admission: Optional[AdmissionController] = None
+        # 后台任务（超时转主动推送、流式推送），保留引用避免被回收
+        self._tasks: Set[asyncio.Task] = set()
+    
+    def init_app(self) -> None:
+        """初始化应用组件"""
+        try:
+            Config.validate()
+        except ValueError as e:
+            logger.error(f"配置验证失败: {e}")
+            raise
+        
+        self.crypto = WXBizMsgCrypt(
+            token=Config.WECOM_TOKEN,
+            encoding_aes_key=Config.WECOM_ENCODING_AES_KEY,
+            corp_id=Config.WECOM_CORP_ID
+        )
+        
+        self.message_handler = MessageHandler()
+        self.outbound = AsyncOutboundScheduler(self.message_handler)
+        self.deduplicator = MessageDeduplicator()
+        self.chat_service = ChatService()
+        self.ai_scheduler = AsyncFairScheduler(Config.AI_ASYNC_MAX_CONCURRENCY)
+        if Config.AI_ADMISSION_ENABLED:
+            self.admission = AdmissionController(Config.AI_ASYNC_MAX_CONCURRENCY)
+        
+        if Config.AI_QUEUE_ENABLED:
+            self.reply_queue = ReplyQueue()
+        
+        if Config.WECOM_DEBOUNCE_ENABLED:
+            self.debouncer = MessageDebouncer()
+        
+        if Config.CALLBACK_RECORD_PATH:
+            from loadtest.recorder import CallbackRecorder
+            self.recorder = CallbackRecorder(Config.CALLBACK_RECORD_PATH)
+        
+        logger.info("应用组件初始化完成")
+    
+    async def shutdown(self) -> None:
+        """等待后台推送任务完成、已提交的主动消息发送结束后关闭连接"""
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=Config.AI_REPLY_DEADLINE_SECONDS)
+        if self.outbound is not None and not await self.outbound.drain(Config.AI_REPLY_DEADLINE_SECONDS):
+            logger.warning("退出时仍有主动消息未发送完成")
+        await get_async_api_client().aclose()
+    
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        
+        body = await self._read_body(receive)
+        try:
+            status, content_type, payload = await self.dispatch(scope, body)
+        except Exception as e:
+            logger.error(f"请求处理异常: {e}")
+            status, content_type, payload = text_response("服务器内部错误", 500)
+        
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type.encode("latin-1")),
+                (b"content-length", str(len(payload)).encode("latin-1"))
+            ]
+        })
+        await send({"type": "http.response.body", "body": payload})
+    
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    self.init_app()
+                except Exception as e:
+                    logger.warning(f"应用初始化警告（如果是开发环境可忽略）: {e}")
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    
+    @staticmethod
+    async def _read_body(receive: Callable) -> bytes:
+        chunks: List[bytes] = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                return b"".join(chunks)
+    
+    async def dispatch(self, scope: dict, body: bytes) -> Response:
+        """按路径和方法分发请求"""
+        path, method = scope["path"], scope["method"]
+        args = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        
+        if path == "/wecom/callback":
+            if method == "GET":
+                return self.verify_url(args)
+            if method == "POST":
+                return await self.handle_message(args, body)
+        elif path == "/health" and method == "GET":
+            return self.health_check()
+        elif path == "/metrics" and method == "GET":
+            body, content_type = metrics.render()
+            return 200, content_type, body
+        elif path.startswith("/session/"):
+            user_id = path[len("/session/"):]
+            if user_id and "/" not in user_id:
+                if method == "GET":
+                    return await self.get_session_info(user_id)
+                if method == "DELETE":
+                    return await self.clear_session(user_id)
+            else:
+                return text_response("Not Found", 404)
+        else:
+            return text_response("Not Found", 404)
+        return text_response("Method Not Allowed", 405)
+    
+    def verify_url(self, args: dict) -> Response:
+        """URL验证"""
+        timestamp, nonce = args.get("timestamp", ""), args.get("nonce", "")
+        logger.info(f"收到URL验证请求: timestamp={timestamp}, nonce={nonce}")
+        
+        ret, reply_echostr = self.crypto.verify_url(
+            args.get("msg_signature", ""), timestamp, nonce, args.get("echostr", "")
+        )
+        
+        if ret == WXBizMsgCrypt.WXBizMsgCrypt_OK:
+            logger.info("URL验证成功")
+            return text_response(reply_echostr)
+        logger.error(f"URL验证失败, 错误码: {ret}")
+        return text_response("验证失败", 403)
+    
+    async def handle_message(self, args: dict, body: bytes) -> Response:
+        """接收消息，流程与 app.wecom_callback 一致"""
+        started_at = time.monotonic()
+        msg_signature = args.get("msg_signature", "")
+        timestamp, nonce = args.get("timestamp", ""), args.get("nonce", "")
+        logger.info(f"收到消息回调: timestamp={timestamp}, nonce={nonce}")
+        
+        # 解密消息
+        ret, xml_content = self.crypto.decrypt_msg(body.decode("utf-8"), msg_signature, timestamp, nonce)
+        if ret != WXBizMsgCrypt.WXBizMsgCrypt_OK:
+            logger.error(f"消息解密失败, 错误码: {ret}")
+            return text_response("解密失败", 400)
+        
+        # 解析消息
+        msg = self.message_handler.parse_message(xml_content)
+        if msg is None:
+            logger.error("消息解析失败")
+            return text_response("解析失败", 400)
+        
+        logger.info(f"收到消息: from={msg.from_user_name}, type={msg.msg_type}, content={msg.content[:50] if msg.content else ''}")
+        if self.recorder is not None:
+            await asyncio.to_thread(self.recorder.record, msg)
+        
+        # 只处理文本消息
+        if msg.msg_type != "text":
+            logger.info(f"忽略非文本消息: {msg.msg_type}")
+            return text_response("success")
+        
+        # 消息去重：企业微信重试推送的同一消息不重复调用AI
+        if msg.msg_id:
+            status, cached_reply = await asyncio.to_thread(self.deduplicator.begin, msg.msg_id)
+            if status == MessageDeduplicator.STATUS_IN_FLIGHT:
+                logger.info(f"重复消息正在处理中，直接返回: msg_id={msg.msg_id}")
+                return text_response("success")
+            if status == MessageDeduplicator.STATUS_DONE:
+                logger.info(f"重复消息已处理: msg_id={msg.msg_id}, 重放回复={cached_reply is not None}")
+                if cached_reply is None:
+                    return text_response("success")
+                return await self._passive_reply(msg, cached_reply, nonce, timestamp)
+        
+        # 处理过程中出现异常（含请求被取消）时释放认领，企业微信的重试可以重新处理
+        try:
+            return await self._reply_message(msg, nonce, timestamp, started_at)
+        except BaseException:
+            await self._abort_message(msg)
+            raise
+    
+    async def _reply_message(self, msg: WeChatMessage, nonce: str, timestamp: str, started_at: float) -> Response:
+        """处理已认领的文本消息，流程与 app._reply_message 一致"""
+        # 消息合并模式：立即返回，窗口期内的连续消息合并后只回复一次（主动推送）
+        if self.debouncer is not None:
+            await self._finish_message(msg)
+            self._spawn(self._reply_merged(msg))
+            return text_response("success")
+        
+        # 队列模式：入队后立即返回，由 worker 生成回复并主动推送
+        if self.reply_queue is not None:
+            if await asyncio.to_thread(self.reply_queue.enqueue, msg):
+                await self._finish_message(msg)
+                return text_response("success")
+            logger.warning("消息入队失败，改为在当前进程处理")
+        
+        # 准入控制：AI任务积压过多时直接回复繁忙提示，不再调用AI
+        decision = self._admit(msg.from_user_name)
+        if decision == AdmissionController.REJECT:
+            logger.warning(f"AI任务积压过多，返回繁忙提示: user={msg.from_user_name}")
+            return await self._passive_reply(msg, BUSY_REPLY, nonce, timestamp)
+        
+        # 流式模式：立即返回，回复边生成边分段主动推送
+        if Config.AI_STREAM_ENABLED:
+            await self._finish_message(msg)
+            self._spawn(self._stream_reply(msg))
+            return text_response("success")
+        
+        # 调用AI服务处理消息，在时限内完成则被动回复，否则转为主动推送
+        task = self._spawn(self._chat(msg))
+        # 预计无法在时限内完成时不再等待，直接转为主动推送
+        remaining = Config.AI_REPLY_DEADLINE_SECONDS - (time.monotonic() - started_at)
+        if decision == AdmissionController.DEFER:
+            remaining = 0
+        try:
+            ai_reply = await asyncio.wait_for(asyncio.shield(task), timeout=max(remaining, 0))
+            logger.info(f"AI回复: {ai_reply[:50]}...")
+        except asyncio.TimeoutError:
+            logger.info(f"AI回复超过{Config.AI_REPLY_DEADLINE_SECONDS}秒，转为主动推送: user={msg.from_user_name}")
+            await self._finish_message(msg)
+            self._spawn(self._deliver_reply_later(msg.from_user_name, task))
+            return text_response("success")
+        except Exception as e:
+            logger.error(f"AI服务调用失败: {e}")
+            ai_reply = FALLBACK_REPLY
+        
+        return await self._passive_reply(msg, ai_reply, nonce, timestamp)
+    
+    def _spawn(self, coro: Awaitable) -> asyncio.Task:
+        """启动后台任务并保留引用"""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    def _admit(self, user_id: str) -> str:
+        """AI任务准入判断，未开启准入控制时总是准入"""
+        if self.admission is None:
+            return AdmissionController.ADMIT
+        return self.admission.acquire(user_id)
+    
+    def _admitted(self):
+        """执行已准入的AI任务，开启准入控制时记录耗时并释放名额"""
+        return self.admission.running() if self.admission is not None else nullcontext()
+    
+    def _slot(self, msg: WeChatMessage):
+        """按用户（可选按应用分组）公平调度，等待执行名额"""
+        group = msg.agent_id if Config.AI_SCHEDULER_GROUP_BY == "agent" else ""
+        return self.ai_scheduler.slot(msg.from_user_name, group)
+    
+    def _rejected(self, msg: WeChatMessage, e: SchedulerRejectedError) -> None:
+        """AI任务超出用户限流或排队上限，释放准入名额"""
+        logger.warning(f"AI任务未能排队（{e}），返回繁忙提示: user={msg.from_user_name}")
+        if self.admission is not None:
+            self.admission.release()
+    
+    async def _chat(self, msg: WeChatMessage) -> str:
+        try:
+            async with self._slot(msg):
+                with self._admitted():
+                    return await self.chat_service.achat(session_id=msg.from_user_name, user_input=msg.content)
+        except SchedulerRejectedError as e:
+            self._rejected(msg, e)
+            return BUSY_REPLY
+    
+    async def _deliver_reply_later(self, user_id: str, task: asyncio.Task) -> None:
+        """AI回复超过被动回复时限后，待生成完成再通过主动消息推送"""
+        try:
+            ai_reply = await task
+            logger.info(f"AI延迟回复: {ai_reply[:50]}...")
+        except Exception as e:
+            logger.error(f"AI服务调用失败: {e}")
+            ai_reply = FALLBACK_REPLY
+        
+        self.outbound.submit(user_id, ai_reply)
+    
+    async def _reply_merged(self, msg: WeChatMessage) -> None:
+        """等待合并窗口结束，由最后到达的消息回复合并后的内容"""
+        merged = await self.debouncer.asubmit(msg)
+        if merged is None:
+            return
+        
+        if self.reply_queue is not None and await asyncio.to_thread(self.reply_queue.enqueue, merged):
+            return
+        
+        if self._admit(merged.from_user_name) == AdmissionController.REJECT:
+            self.outbound.submit(merged.from_user_name, BUSY_REPLY)
+            return
+        
+        if Config.AI_STREAM_ENABLED:
+            await self._stream_reply(merged)
+            return
+        
+        task = self._spawn(self._chat(merged))
+        await self._deliver_reply_later(merged.from_user_name, task)
+    
+    async def _stream_reply(self, msg: WeChatMessage) -> None:
+        """流式生成AI回复，每生成一段即主动推送给用户"""
+        user_id = msg.from_user_name
+        
+        async def send_segment(segment: str) -> None:
+            self.outbound.submit(user_id, segment)
+        
+        try:
+            async with self._slot(msg):
+                with self._admitted():
+                    ai_reply = await self.chat_service.achat_stream(user_id, msg.content, send_segment)
+            logger.info(f"AI流式回复: {ai_reply[:50]}...")
+        except SchedulerRejectedError as e:
+            self._rejected(msg, e)
+            await send_segment(BUSY_REPLY)
+        except Exception as e:
+            logger.error(f"AI服务调用失败: {e}")
+    
+    async def _finish_message(self, msg: WeChatMessage, passive_reply: str = None) -> None:
+        """标记消息处理完成，passive_reply 为已被动回复的内容，供重试时重放"""
+        if msg.msg_id:
+            await asyncio.to_thread(self.deduplicator.finish, msg.msg_id, passive_reply)
+    
+    async def _abort_message(self, msg: WeChatMessage) -> None:
+        """消息处理失败，释放认领（已标记完成的消息不受影响）"""
+        if msg.msg_id:
+            await asyncio.to_thread(self.deduplicator.abort, msg.msg_id)
+    
+    async def _passive_reply(self, msg: WeChatMessage, ai_reply: str, nonce: str, timestamp: str) -> Response:
+        """构建加密的被动回复，加密失败时改为主动推送"""
+        reply_xml = self.message_handler.build_text_reply(
+            to_user=msg.from_user_name,
+            from_user=msg.to_user_name,
+            content=ai_reply
+        )
+        
+        ret, encrypted_reply = self.crypto.encrypt_msg(reply_xml, nonce, timestamp)
+        
+        if ret != WXBizMsgCrypt.WXBizMsgCrypt_OK:
+            logger.error(f"回复消息加密失败, 错误码: {ret}")
+            # 如果被动回复失败，尝试主动发送
+            await self._finish_message(msg)
+            self.outbound.submit(msg.from_user_name, ai_reply)
+            return text_response("success")
+        
+        await self._finish_message(msg, ai_reply)
+        return 200, "application/xml", encrypted_reply.encode("utf-8")
+    
+    def health_check(self) -> Response:
+        """健康检查接口"""
+        result = {"status": "ok", "service": "wecom-bot"}
+        if self.chat_service is not None and self.chat_service.cache is not None:
+            result["cache"] = self.chat_service.cache.stats()
+        if self.chat_service is not None and self.chat_service.router is not None:
+            result["router"] = self.chat_service.router.stats()
+        if self.ai_scheduler is not None:
+            result["scheduler"] = self.ai_scheduler.stats()
+        if self.admission is not None:
+            result["admission"] = self.admission.stats()
+        result["breakers"] = {"redis": redis_breaker.stats()}
+        if self.chat_service is not None and self.chat_service.llm_breaker is not None:
+            result["breakers"]["llm"] = self.chat_service.llm_breaker.stats()
+        return json_response(result)
+    
+    async def get_session_info(self, user_id: str) -> Response:
+        """获取用户会话信息"""
+        if self.chat_service is None:
+            return json_response({"error": "服务未初始化"}, 500)
+        return json_response(await self.chat_service.history.aget_session_info(user_id))
+    
+    async def clear_session(self, user_id: str) -> Response:
+        """清除用户会话历史"""
+        if self.chat_service is None:
+            return json_response({"error": "服务未初始化"}, 500)
+        
+        await self.chat_service.history.aclear_history(user_id)
+        return json_response({"status": "ok", "message": f"用户 {user_id} 的会话历史已清除"})
+
+
+app = WeComBotApp()
@@ -0,0 +1,7 @@
+"""
+性能基准脚本
+离线运行（fakeredis + 假模型），在项目根目录下以模块方式运行:
+    python -m benchmarks                 # 请求路径各环节的 ops/s、p50/p99、内存分配，支持保存/对比JSON基线
+    python -m benchmarks.crypto_bench    # 加解密新旧实现的兼容性校验与吞吐对比
+    python -m benchmarks.startup         # 冷启动各模块导入耗时、预加载后每个 worker 的独占内存
+"""
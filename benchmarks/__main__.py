@@ -0,0 +1,52 @@
+"""
+运行基准测试
+
+用法:
+    python -m benchmarks                                   # 运行全部套件
+    python -m benchmarks --suite crypto message            # 只运行部分套件
+    python -m benchmarks --save benchmarks/baseline.json   # 保存为基线
+    python -m benchmarks --compare benchmarks/baseline.json --threshold 0.2
+                                                           # 与基线对比，有退化时返回非0
+"""
+import argparse
+import sys
+
+from . import offline
+
+offline.install()
+
+from .runner import compare, load_baseline, print_results, run_case, save_baseline  # noqa: E402
+from .suites import SUITES  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="离线性能基准测试")
+    parser.add_argument("--suite", nargs="+", choices=sorted(SUITES), help="要运行的套件，默认全部")
+    parser.add_argument("--seconds", type=float, default=0.5, help="每个用例的计时时长（秒）")
+    parser.add_argument("--save", metavar="PATH", help="将结果保存为JSON基线")
+    parser.add_argument("--compare", metavar="PATH", help="与JSON基线对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的相对退化比例，默认0.2")
+    args = parser.parse_args()
+    
+    results = []
+    for suite in args.suite or SUITES:
+        for case in SUITES[suite]():
+            results.append(run_case(case, args.seconds))
+    print_results(results)
+    
+    if args.save:
+        save_baseline(results, args.save)
+        print(f"\n基线已保存: {args.save}")
+    
+    if args.compare:
+        regressions = compare(results, load_baseline(args.compare), args.threshold)
+        if regressions:
+            print(f"\n相对基线退化超过 {args.threshold:.0%}:")
+            for item in regressions:
+                print(f"  - {item}")
+            sys.exit(1)
+        print(f"\n未发现超过 {args.threshold:.0%} 的退化")
+
+
+if __name__ == "__main__":
+    main()
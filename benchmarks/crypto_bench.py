@@ -0,0 +1,196 @@
+"""
+消息加解密基准与兼容性校验
+对比重写前的 WXBizMsgCrypt 实现（LegacyCrypt）与当前实现：
+1. 随机生成的语料（ASCII、中文、emoji、块边界长度、篡改/随机密文等）上，加密输出与解密结果逐字节一致
+2. 不同消息长度下的加密/解密吞吐
+
+用法: python -m benchmarks.crypto_bench [--cases 2000] [--seconds 1] [--rounds 3]
+"""
+import argparse
+import base64
+import random
+import socket
+import struct
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+from Crypto.Cipher import AES
+
+from wecom.crypto import WXBizMsgCrypt
+
+TOKEN = "benchmark-token"
+ENCODING_AES_KEY = base64.b64encode(bytes(range(32))).decode("utf-8").rstrip("=")
+
+_ALPHABETS = [
+    "abcdefghijklmnopqrstuvwxyz0123456789 <>&]]>[CDATA\n",
+    "你好企业微信机器人消息加解密测试，。！？",
+    "😀🎉🚀",
+]
+
+
+class LegacyCrypt(WXBizMsgCrypt):
+    """重写前的加解密实现，作为兼容性与性能对照"""
+    
+    def _pkcs7_encode(self, text: bytes) -> bytes:
+        block_size = 32
+        text_length = len(text)
+        amount_to_pad = block_size - (text_length % block_size)
+        if amount_to_pad == 0:
+            amount_to_pad = block_size
+        pad = chr(amount_to_pad).encode()
+        return text + pad * amount_to_pad
+    
+    def _pkcs7_decode(self, decrypted: bytes) -> bytes:
+        pad = decrypted[-1]
+        if pad < 1 or pad > 32:
+            pad = 0
+        return decrypted[:-pad]
+    
+    def _encrypt(self, text: str) -> Tuple[int, Optional[str]]:
+        try:
+            text = text.encode("utf-8")
+            random_str = str(random.randint(1000000000000000, 9999999999999999)).encode("utf-8")
+            text_length = struct.pack("I", socket.htonl(len(text)))
+            text = random_str + text_length + text + self.corp_id.encode("utf-8")
+            text = self._pkcs7_encode(text)
+            cipher = AES.new(self.aes_key, AES.MODE_CBC, self.aes_key[:16])
+            encrypted = cipher.encrypt(text)
+            return self.WXBizMsgCrypt_OK, base64.b64encode(encrypted).decode("utf-8")
+        except Exception:
+            return self.WXBizMsgCrypt_EncryptAES_Error, None
+    
+    def _decrypt(self, text: str) -> Tuple[int, Optional[str]]:
+        try:
+            cipher = AES.new(self.aes_key, AES.MODE_CBC, self.aes_key[:16])
+            decrypted = cipher.decrypt(base64.b64decode(text))
+            decrypted = self._pkcs7_decode(decrypted)
+            content = decrypted[16:]
+            xml_length = socket.ntohl(struct.unpack("I", content[:4])[0])
+            xml_content = content[4:xml_length + 4].decode("utf-8")
+            from_corp_id = content[xml_length + 4:].decode("utf-8")
+            if from_corp_id != self.corp_id:
+                return self.WXBizMsgCrypt_ValidateCorpid_Error, None
+            return self.WXBizMsgCrypt_OK, xml_content
+        except Exception:
+            return self.WXBizMsgCrypt_DecryptAES_Error, None
+
+
+def _random_text(rng: random.Random) -> str:
+    """生成随机明文，长度集中在填充块边界附近"""
+    if rng.random() < 0.3:
+        length = rng.choice([0, 1, 11, 12, 13, 31, 32, 33, 44, 45, 46, 2048])
+    else:
+        length = rng.randint(0, 4096)
+    alphabet = "".join(rng.sample(_ALPHABETS, rng.randint(1, len(_ALPHABETS))))
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def _random_ciphertext(rng: random.Random, legacy: LegacyCrypt, text: str) -> str:
+    """生成异常密文：篡改合法密文、随机字节或非法base64"""
+    kind = rng.randint(0, 3)
+    if kind == 0:
+        _, encrypted = legacy._encrypt(text)
+        raw = bytearray(base64.b64decode(encrypted))
+        raw[rng.randrange(len(raw))] ^= 1 << rng.randrange(8)
+        return base64.b64encode(bytes(raw)).decode("utf-8")
+    if kind == 1:
+        return base64.b64encode(rng.randbytes(16 * rng.randint(0, 8))).decode("utf-8")
+    if kind == 2:
+        # 长度字段被改大（超出实际内容）
+        payload = rng.randbytes(16) + struct.pack(">I", rng.randint(0, 1 << 31)) + text.encode("utf-8")
+        payload = legacy._pkcs7_encode(payload)
+        cipher = AES.new(legacy.aes_key, AES.MODE_CBC, legacy.aes_key[:16])
+        return base64.b64encode(cipher.encrypt(payload)).decode("utf-8")
+    return "!" + text[:8]
+
+
+def check_compat(cases: int, seed: int) -> int:
+    """
+    校验新旧实现逐字节一致
+    
+    Returns:
+        不一致的用例数
+    """
+    rng = random.Random(seed)
+    failures = 0
+    for i in range(cases):
+        corp_id = rng.choice(["ww1234567890abcdef", "corp", "企业", ""])
+        current = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, corp_id)
+        legacy = LegacyCrypt(TOKEN, ENCODING_AES_KEY, corp_id)
+        text = _random_text(rng)
+        
+        # 加密：使用相同的随机数种子，输出应完全一致
+        state = rng.getrandbits(32)
+        random.seed(state)
+        expected = legacy._encrypt(text)
+        random.seed(state)
+        actual = current._encrypt(text)
+        if actual != expected:
+            failures += 1
+            print(f"[{i}] 加密结果不一致: corp_id={corp_id!r}, len={len(text)}")
+            continue
+        
+        # 解密：合法密文、其他企业的密文、异常密文
+        other = LegacyCrypt(TOKEN, ENCODING_AES_KEY, corp_id + "x")
+        ciphertexts = [expected[1], other._encrypt(text)[1], _random_ciphertext(rng, legacy, text)]
+        for ciphertext in ciphertexts:
+            if current._decrypt(ciphertext) != legacy._decrypt(ciphertext):
+                failures += 1
+                print(f"[{i}] 解密结果不一致: corp_id={corp_id!r}, ciphertext={ciphertext[:32]}...")
+    return failures
+
+
+def _throughput(func: Callable[[], object], seconds: float) -> float:
+    """在 seconds 秒内重复调用 func，返回每秒调用次数"""
+    count = 0
+    started_at = time.perf_counter()
+    deadline = started_at + seconds
+    while True:
+        for _ in range(100):
+            func()
+        count += 100
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - started_at)
+
+
+def run_benchmark(sizes: List[int], seconds: float, rounds: int = 3) -> None:
+    """对比新旧实现的加密/解密吞吐"""
+    current = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, "ww1234567890abcdef")
+    legacy = LegacyCrypt(TOKEN, ENCODING_AES_KEY, "ww1234567890abcdef")
+    
+    print(f"{'操作':<8}{'字节数':>8}{'旧实现 ops/s':>16}{'新实现 ops/s':>16}{'提升':>10}")
+    for size in sizes:
+        text = ("企业微信" * size)[:size // 3] if size else ""
+        _, ciphertext = legacy._encrypt(text)
+        for name, old, new in [
+            ("encrypt", lambda: legacy._encrypt(text), lambda: current._encrypt(text)),
+            ("decrypt", lambda: legacy._decrypt(ciphertext), lambda: current._decrypt(ciphertext)),
+        ]:
+            # 新旧实现交替测量多轮，取最好成绩以减小噪声
+            old_ops = new_ops = 0.0
+            for _ in range(rounds):
+                old_ops = max(old_ops, _throughput(old, seconds))
+                new_ops = max(new_ops, _throughput(new, seconds))
+            print(f"{name:<8}{len(text.encode('utf-8')):>8}{old_ops:>16,.0f}{new_ops:>16,.0f}{new_ops / old_ops:>9.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="消息加解密基准与兼容性校验")
+    parser.add_argument("--cases", type=int, default=2000, help="兼容性校验用例数")
+    parser.add_argument("--seed", type=int, default=20240501, help="随机语料种子")
+    parser.add_argument("--seconds", type=float, default=1.0, help="每项吞吐测试时长（秒）")
+    parser.add_argument("--rounds", type=int, default=3, help="每项吞吐测试轮数")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 300, 2048, 16384], help="消息字节数")
+    args = parser.parse_args()
+    
+    failures = check_compat(args.cases, args.seed)
+    print(f"兼容性校验: {args.cases} 个用例, {failures} 个不一致")
+    run_benchmark(args.sizes, args.seconds, args.rounds)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
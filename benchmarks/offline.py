@@ -0,0 +1,55 @@
+"""
+离线运行环境
+用 fakeredis 代替 Redis、用固定回复的假模型代替 LLM，基准测试无需任何外部服务
+须在导入 config 及业务模块之前调用 install()
+"""
+import base64
+import functools
+import os
+
+# 基准测试使用的固定配置（未设置时才生效）
+OFFLINE_ENV = {
+    "WECOM_CORP_ID": "wwbenchmark0000001",
+    "WECOM_AGENT_ID": "1000001",
+    "WECOM_SECRET": "benchmark-secret",
+    "WECOM_TOKEN": "benchmark-token",
+    "WECOM_ENCODING_AES_KEY": base64.b64encode(bytes(range(32))).decode("utf-8").rstrip("="),
+    "DASHSCOPE_API_KEY": "benchmark-key",
+}
+
+_installed = False
+
+
+def install() -> None:
+    """设置环境变量并替换 Redis 客户端与 LLM（可重复调用）"""
+    global _installed
+    if _installed:
+        return
+    
+    for key, value in OFFLINE_ENV.items():
+        os.environ.setdefault(key, value)
+    
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit('基准测试需要 fakeredis: pip install "fakeredis[lua]"')
+    import redis
+    from redis import asyncio as aioredis
+    
+    # 会话历史、去重、会话锁等依赖 Lua 脚本，缺少 lupa 时 fakeredis 拒绝 EVAL/EVALSHA，
+    # 测得的只是异常与降级路径的耗时，不能作为基线
+    server = fakeredis.FakeServer()
+    try:
+        fakeredis.FakeRedis(server=server).eval("return 1", 0)
+    except Exception as e:
+        raise SystemExit(f'基准测试需要 fakeredis 的 Lua 支持（{e}）: pip install "fakeredis[lua]"')
+    redis.Redis = functools.partial(fakeredis.FakeRedis, server=server)
+    aioredis.Redis = functools.partial(fakeredis.FakeAsyncRedis, server=server)
+    
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    import ai.chat
+    
+    ai.chat.create_llm = lambda model_name=None: FakeListChatModel(
+        responses=["您好，这是基准测试的固定回复。请问还有什么可以帮您？"]
+    )
+    _installed = True
@@ -0,0 +1,162 @@
+"""
+基准测试执行与结果对比
+每个用例先预热，再逐次计时统计 ops/s、p50/p99，最后在 tracemalloc 下统计单次调用的内存分配
+"""
+import json
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+
+@dataclass
+class Case:
+    """基准用例"""
+    name: str
+    func: Callable[[], object]
+    # 计时次数（0 表示按 --seconds 时长自动确定）
+    iterations: int = 0
+
+
+@dataclass
+class Result:
+    """基准结果"""
+    name: str
+    iterations: int
+    ops_per_sec: float
+    p50_us: float
+    p99_us: float
+    # 单次调用的内存分配峰值（字节）
+    alloc_bytes: int
+    # 单次调用的内存分配块数（tracemalloc 统计的新增块）
+    alloc_blocks: int
+
+
+def _percentile(sorted_values: List[int], q: float) -> float:
+    index = min(int(len(sorted_values) * q), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _measure_allocations(func: Callable[[], object], calls: int) -> tuple:
+    """
+    统计单次调用的分配峰值与分配块数
+    
+    Returns:
+        (平均分配峰值字节数, 平均分配块数)
+    """
+    tracemalloc.start()
+    try:
+        peak_total = blocks_total = 0
+        for _ in range(calls):
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            peak_total += peak - base
+            blocks_total += sum(
+                max(stat.count_diff, 0) for stat in after.compare_to(before, "traceback")
+            )
+        return peak_total // calls, blocks_total // calls
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(case: Case, seconds: float, alloc_calls: int = 5) -> Result:
+    """
+    执行单个基准用例
+    
+    Args:
+        case: 用例
+        seconds: 未指定计时次数时的目标计时时长（秒）
+        alloc_calls: 统计内存分配的调用次数
+    """
+    func = case.func
+    
+    # 预热，并估算单次耗时以确定计时次数
+    started_at = time.perf_counter()
+    warmup = 0
+    while warmup < 10 or time.perf_counter() - started_at < min(seconds / 10, 0.2):
+        func()
+        warmup += 1
+    per_call = (time.perf_counter() - started_at) / warmup
+    iterations = case.iterations or max(int(seconds / per_call), 20)
+    
+    timings = []
+    perf_counter_ns = time.perf_counter_ns
+    total_started = perf_counter_ns()
+    for _ in range(iterations):
+        call_started = perf_counter_ns()
+        func()
+        timings.append(perf_counter_ns() - call_started)
+    total_ns = perf_counter_ns() - total_started
+    timings.sort()
+    
+    alloc_bytes, alloc_blocks = _measure_allocations(func, alloc_calls)
+    return Result(
+        name=case.name,
+        iterations=iterations,
+        ops_per_sec=round(iterations / (total_ns / 1e9), 1),
+        p50_us=round(_percentile(timings, 0.50) / 1000, 2),
+        p99_us=round(_percentile(timings, 0.99) / 1000, 2),
+        alloc_bytes=alloc_bytes,
+        alloc_blocks=alloc_blocks
+    )
+
+
+def print_results(results: List[Result], out=sys.stdout) -> None:
+    """以表格形式输出结果"""
+    width = max([len(r.name) for r in results] + [4])
+    out.write(f"{'用例':<{width}}{'ops/s':>14}{'p50(us)':>12}{'p99(us)':>12}{'分配(B)':>12}{'分配块':>10}\n")
+    for r in results:
+        out.write(
+            f"{r.name:<{width}}{r.ops_per_sec:>14,.1f}{r.p50_us:>12.2f}{r.p99_us:>12.2f}"
+            f"{r.alloc_bytes:>12}{r.alloc_blocks:>10}\n"
+        )
+
+
+def save_baseline(results: List[Result], path: str) -> None:
+    """保存结果为 JSON 基线"""
+    data = {
+        "python": sys.version.split()[0],
+        "created_at": int(time.time()),
+        "results": {r.name: asdict(r) for r in results}
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load_baseline(path: str) -> Dict[str, dict]:
+    """读取 JSON 基线，返回 用例名 -> 结果"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def compare(results: List[Result], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """
+    与基线对比
+    
+    Args:
+        results: 本次结果
+        baseline: 基线结果
+        threshold: 允许的相对退化比例，如 0.2 表示 20%
+    
+    Returns:
+        退化项描述列表
+    """
+    regressions = []
+    for r in results:
+        base: Optional[dict] = baseline.get(r.name)
+        if base is None:
+            continue
+        if r.ops_per_sec < base["ops_per_sec"] * (1 - threshold):
+            regressions.append(f"{r.name}: ops/s {base['ops_per_sec']:,.1f} -> {r.ops_per_sec:,.1f}")
+        # 微秒级的尾延迟抖动不计为退化
+        if r.p99_us > max(base["p99_us"] * (1 + threshold), base["p99_us"] + 2):
+            regressions.append(f"{r.name}: p99 {base['p99_us']:.2f}us -> {r.p99_us:.2f}us")
+        # 分配量较小时忽略抖动
+        if r.alloc_bytes > max(base["alloc_bytes"] * (1 + threshold), base["alloc_bytes"] + 1024):
+            regressions.append(f"{r.name}: 分配 {base['alloc_bytes']}B -> {r.alloc_bytes}B")
+    return regressions
@@ -0,0 +1,161 @@
+"""
+启动耗时与内存分析
+在全新的子进程中以 -X importtime 导入目标模块（默认 app，导入时执行 init_app 构建各组件），统计：
+1. 冷启动耗时、加载的模块数和进程内存峰值（maxrss）
+2. 按顶层包汇总的导入耗时，以及耗时最多的模块
+3. 指定 --workers 时模拟 gunicorn 预加载：导入后 fork 出若干子进程并执行一次完整GC，
+   统计每个子进程独占（写时复制后不再共享）的内存，可用 --no-freeze 对比不调用 gc.freeze() 的情况
+
+需要与正式运行相同的环境变量（.env），不访问网络。独占内存依赖 /proc/<pid>/smaps_rollup（Linux）
+
+用法: python -m benchmarks.startup [--module app] [--repeat 3] [--top 15] [--workers 4] [--no-freeze]
+"""
+import argparse
+import json
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# 子进程中执行：导入目标模块并输出统计（JSON，最后一行）
+_PROBE = r"""
+import gc, json, os, resource, sys, time
+started = time.perf_counter()
+import {module}
+result = {{
+    "seconds": time.perf_counter() - started,
+    "modules": len(sys.modules),
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "workers": [],
+}}
+
+def smaps():
+    fields = {{}}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields
+
+if {workers}:
+    if {freeze}:
+        gc.freeze()
+    pipes = []
+    for _ in range({workers}):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            gc.collect()
+            try:
+                fields = smaps()
+                data = {{
+                    "rss_kb": fields["Rss"],
+                    "pss_kb": fields["Pss"],
+                    "private_kb": fields["Private_Clean"] + fields["Private_Dirty"],
+                }}
+            except (OSError, KeyError):
+                data = {{}}
+            os.write(write_fd, json.dumps(data).encode())
+            os._exit(0)
+        os.close(write_fd)
+        pipes.append((pid, read_fd))
+    for pid, read_fd in pipes:
+        with os.fdopen(read_fd) as f:
+            data = f.read()
+        os.waitpid(pid, 0)
+        result["workers"].append(json.loads(data))
+
+print(json.dumps(result))
+"""
+
+
+def _parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    解析 -X importtime 的输出
+    
+    Returns:
+        [(模块名, 自身耗时us, 累计耗时us)]
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        entries.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return entries
+
+
+def run_probe(module: str, workers: int = 0, freeze: bool = True) -> Tuple[dict, List[Tuple[str, int, int]]]:
+    """
+    在子进程中导入模块
+    
+    Returns:
+        (统计结果, 各模块导入耗时)
+    """
+    code = _PROBE.format(module=module, workers=workers, freeze=freeze)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        tail = "\n".join(line for line in proc.stderr.splitlines() if not line.startswith("import time:"))
+        raise RuntimeError(f"导入 {module} 失败:\n{tail[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), _parse_importtime(proc.stderr)
+
+
+def summarize_packages(entries: List[Tuple[str, int, int]]) -> Dict[str, int]:
+    """按顶层包汇总导入的自身耗时（us）"""
+    packages: Dict[str, int] = defaultdict(int)
+    for name, self_us, _ in entries:
+        packages[name.split(".")[0]] += self_us
+    return dict(packages)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="启动耗时与内存分析")
+    parser.add_argument("--module", default="app", help="要导入的模块，默认 app")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数，耗时取最小值（首次运行含编译 .pyc）")
+    parser.add_argument("--top", type=int, default=15, help="列出耗时最多的包和模块数")
+    parser.add_argument("--workers", type=int, default=0, help="模拟预加载后 fork 的 worker 数，默认不模拟")
+    parser.add_argument("--no-freeze", action="store_true", help="fork 前不调用 gc.freeze()")
+    args = parser.parse_args()
+    
+    runs = [run_probe(args.module) for _ in range(max(1, args.repeat))]
+    result, entries = min(runs, key=lambda run: run[0]["seconds"])
+    
+    print(f"导入 {args.module}: {result['seconds'] * 1000:.0f} ms（{len(runs)} 次取最小）, "
+          f"模块 {result['modules']} 个, maxrss {result['maxrss_kb'] / 1024:.1f} MB")
+    
+    if args.top > 0:
+        total_us = sum(self_us for _, self_us, _ in entries) or 1
+        print("\n耗时最多的包（自身耗时合计）:")
+        packages = sorted(summarize_packages(entries).items(), key=lambda kv: kv[1], reverse=True)
+        for name, self_us in packages[:args.top]:
+            print(f"  {name:<32} {self_us / 1000:>8.1f} ms  {self_us / total_us:>6.1%}")
+        
+        print("\n耗时最多的模块（累计耗时，含其导入的模块）:")
+        for name, _, cumulative_us in sorted(entries, key=lambda e: e[2], reverse=True)[:args.top]:
+            print(f"  {name:<48} {cumulative_us / 1000:>8.1f} ms")
+    
+    if args.workers > 0:
+        freeze = not args.no_freeze
+        forked, _ = run_probe(args.module, args.workers, freeze)
+        workers = [w for w in forked["workers"] if w]
+        mode = "gc.freeze()" if freeze else "不冻结"
+        if not workers:
+            print("\n无法读取 /proc/self/smaps_rollup，跳过 worker 内存统计")
+            return
+        private = sum(w["private_kb"] for w in workers) / len(workers) / 1024
+        pss = sum(w["pss_kb"] for w in workers) / len(workers) / 1024
+        rss = sum(w["rss_kb"] for w in workers) / len(workers) / 1024
+        print(f"\n预加载后 fork {len(workers)} 个 worker（{mode}，各执行一次完整GC）:")
+        print(f"  每个 worker: RSS {rss:.1f} MB, 独占 {private:.1f} MB, PSS {pss:.1f} MB")
+        print(f"  不预加载时每个 worker 各自导入，独占内存约等于 maxrss {forked['maxrss_kb'] / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
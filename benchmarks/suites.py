@@ -0,0 +1,150 @@
+"""
+基准用例
+覆盖每个回调请求必经的路径：消息加解密、XML解析与回复构建、对话历史读写、提示词渲染
+"""
+import time
+from typing import Callable, Dict, List
+
+from config import Config
+from .runner import Case
+
+# 消息加解密的明文字节数
+PAYLOAD_SIZES = [128, 1024, 4096]
+# 对话历史条数
+HISTORY_LENGTHS = [10, 50, 200]
+
+
+def _text_message(content: str, user: str = "BenchUser") -> str:
+    return f"""<xml>
+<ToUserName><![CDATA[{Config.WECOM_CORP_ID}]]></ToUserName>
+<FromUserName><![CDATA[{user}]]></FromUserName>
+<CreateTime>{int(time.time())}</CreateTime>
+<MsgType><![CDATA[text]]></MsgType>
+<Content><![CDATA[{content}]]></Content>
+<MsgId>1234567890123456</MsgId>
+<AgentID>{Config.WECOM_AGENT_ID}</AgentID>
+</xml>"""
+
+
+def _content(size: int) -> str:
+    """生成约 size 字节（UTF-8）的中英文混合内容"""
+    unit = "企业微信消息 benchmark "
+    unit_bytes = len(unit.encode("utf-8"))
+    return (unit * (size // unit_bytes + 1))[:size // 2]
+
+
+def crypto_cases() -> List[Case]:
+    """WXBizMsgCrypt.encrypt_msg / decrypt_msg"""
+    from wecom.crypto import WXBizMsgCrypt
+    
+    crypto = WXBizMsgCrypt(Config.WECOM_TOKEN, Config.WECOM_ENCODING_AES_KEY, Config.WECOM_CORP_ID)
+    timestamp, nonce = "1700000000", "1234567890"
+    cases = []
+    for size in PAYLOAD_SIZES:
+        xml = _text_message(_content(size))
+        _, encrypted = crypto._encrypt(xml)
+        signature = crypto._get_signature(timestamp, nonce, encrypted)
+        post_data = f"<xml><ToUserName><![CDATA[{Config.WECOM_CORP_ID}]]></ToUserName><Encrypt><![CDATA[{encrypted}]]></Encrypt></xml>"
+        cases.append(Case(
+            f"crypto.encrypt_msg[{size}B]",
+            lambda xml=xml: crypto.encrypt_msg(xml, nonce, timestamp)
+        ))
+        cases.append(Case(
+            f"crypto.decrypt_msg[{size}B]",
+            lambda post_data=post_data, signature=signature: crypto.decrypt_msg(post_data, signature, timestamp, nonce)
+        ))
+    return cases
+
+
+def message_cases() -> List[Case]:
+    """MessageHandler.parse_message / build_text_reply"""
+    from wecom.message import MessageHandler
+    
+    xml = _text_message("你好，请问报销流程是怎样的？")
+    reply = _content(1024)
+    return [
+        Case("message.parse_message", lambda: MessageHandler.parse_message(xml)),
+        Case("message.build_text_reply", lambda: MessageHandler.build_text_reply("BenchUser", Config.WECOM_CORP_ID, reply)),
+    ]
+
+
+def _fill_history(history, session_id: str, length: int) -> None:
+    history.clear_history(session_id)
+    for i in range(length // 2):
+        history.add_turn(session_id, f"第{i}个问题：{_content(60)}", f"第{i}个回答：{_content(200)}")
+
+
+def history_cases() -> List[Case]:
+    """ConversationHistory 在不同历史长度下的读写"""
+    from ai.history import ConversationHistory
+    
+    history = ConversationHistory()
+    # 不使用进程内会话缓存，每次读取都反序列化整段历史
+    cold_history = ConversationHistory()
+    cold_history._local = None
+    cases = []
+    for length in HISTORY_LENGTHS:
+        session_id = f"bench-history-{length}"
+        
+        def with_window(func: Callable[[], object], length: int = length) -> Callable[[], object]:
+            """用例执行期间将历史窗口调整为 length 条"""
+            def run():
+                saved = Config.CONVERSATION_MAX_HISTORY
+                Config.CONVERSATION_MAX_HISTORY = length
+                try:
+                    return func()
+                finally:
+                    Config.CONVERSATION_MAX_HISTORY = saved
+            return run
+        
+        saved = Config.CONVERSATION_MAX_HISTORY
+        Config.CONVERSATION_MAX_HISTORY = length
+        try:
+            _fill_history(history, session_id, length)
+        finally:
+            Config.CONVERSATION_MAX_HISTORY = saved
+        
+        cases.append(Case(
+            f"history.get_context[{length}]",
+            with_window(lambda session_id=session_id: history.get_context(session_id, Config.CONVERSATION_MAX_TOKENS))
+        ))
+        cases.append(Case(
+            f"history.get_context_cold[{length}]",
+            with_window(lambda session_id=session_id: cold_history.get_context(session_id, Config.CONVERSATION_MAX_TOKENS))
+        ))
+        cases.append(Case(
+            f"history.add_turn[{length}]",
+            with_window(lambda session_id=session_id: history.add_turn(session_id, "新的问题", "新的回答"))
+        ))
+    return cases
+
+
+def chat_cases() -> List[Case]:
+    """ChatService 提示词准备与渲染（不含模型调用）"""
+    from ai.chat import ChatService
+    
+    chat_service = ChatService()
+    cases = []
+    for length in HISTORY_LENGTHS:
+        session_id = f"bench-chat-{length}"
+        saved = Config.CONVERSATION_MAX_HISTORY
+        Config.CONVERSATION_MAX_HISTORY = length
+        try:
+            _fill_history(chat_service.history, session_id, length)
+            _, inputs, _ = chat_service._prepare(session_id, "请问报销流程是怎样的？")
+        finally:
+            Config.CONVERSATION_MAX_HISTORY = saved
+        cases.append(Case(
+            f"chat.render_prompt[{length}]",
+            lambda inputs=inputs: chat_service.prompt.invoke(inputs).to_messages()
+        ))
+    return cases
+
+
+# 套件名 -> 用例构建函数
+SUITES: Dict[str, Callable[[], List[Case]]] = {
+    "crypto": crypto_cases,
+    "message": message_cases,
+    "history": history_cases,
+    "chat": chat_cases,
+}
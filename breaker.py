@@ -0,0 +1,108 @@
+"""
+熔断器模块
+依赖（Redis、LLM）连续失败达到阈值后熔断，熔断期间调用直接失败而不再等待超时；
+冷却时间过后放行一个探测请求（半开），成功则恢复，失败则继续熔断
+"""
+import threading
+import time
+
+import metrics
+
+
+class CircuitOpenError(Exception):
+    """依赖处于熔断状态，调用被直接拒绝"""
+
+
+class CircuitBreaker:
+    """线程安全的熔断器"""
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        """
+        Args:
+            name: 依赖名称，用于日志和监控指标
+            failure_threshold: 连续失败多少次后熔断
+            reset_seconds: 熔断后等待多久放行探测请求
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        """当前状态"""
+        return self._state
+    
+    def _transition(self, state: str) -> None:
+        """切换状态（需持有锁）"""
+        if state != self._state:
+            self._state = state
+            metrics.CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+            print(f"熔断器 {self.name} 状态切换为 {state}")
+    
+    def allow(self) -> bool:
+        """
+        是否放行本次调用，放行后需调用 record_success 或 record_failure
+        
+        Returns:
+            是否放行（熔断期间返回False）
+        """
+        # 正常状态只读一次属性，不加锁
+        if self._state == self.CLOSED:
+            return True
+        
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and now - self._opened_at >= self.reset_seconds:
+                self._transition(self.HALF_OPEN)
+                self._probe_at = now
+                return True
+            # 半开状态同时只放行一个探测请求；探测请求未上报结果时，冷却时间过后再放行一个
+            if self._state == self.HALF_OPEN and now - self._probe_at >= self.reset_seconds:
+                self._probe_at = now
+                return True
+        metrics.CIRCUIT_REJECTIONS.labels(self.name).inc()
+        return False
+    
+    def check(self) -> None:
+        """
+        放行检查，熔断期间抛出异常
+        
+        Raises:
+            CircuitOpenError: 依赖处于熔断状态
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} 已熔断")
+    
+    def record_success(self) -> None:
+        """记录一次成功调用"""
+        if self._state == self.CLOSED and self._failures == 0:
+            return
+        with self._lock:
+            self._failures = 0
+            self._transition(self.CLOSED)
+    
+    def record_failure(self) -> None:
+        """记录一次失败调用"""
+        with self._lock:
+            self._failures += 1
+            # 已熔断时不再重置冷却时间（熔断前发出的请求陆续失败）
+            if self._state == self.OPEN:
+                return
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+    
+    def stats(self) -> dict:
+        """熔断器状态"""
+        return {"state": self._state, "consecutive_failures": self._failures}
@@ -14,15 +14,49 @@ class Config:
     WECOM_SECRET = os.getenv("WECOM_SECRET", "")
     WECOM_TOKEN = os.getenv("WECOM_TOKEN", "")
     WECOM_ENCODING_AES_KEY = os.getenv("WECOM_ENCODING_AES_KEY", "")
+    # 企业微信 API HTTP 客户端配置
+    WECOM_API_BASE_URL = os.getenv("WECOM_API_BASE_URL", "https://qyapi.weixin.qq.com")
+    WECOM_HTTP_POOL_SIZE = int(os.getenv("WECOM_HTTP_POOL_SIZE", 10))
+    WECOM_HTTP_TIMEOUT_SECONDS = float(os.getenv("WECOM_HTTP_TIMEOUT_SECONDS", 5))
+    WECOM_HTTP_MAX_RETRIES = int(os.getenv("WECOM_HTTP_MAX_RETRIES", 2))
+    WECOM_HTTP_BACKOFF_SECONDS = float(os.getenv("WECOM_HTTP_BACKOFF_SECONDS", 0.2))
+    # 主动消息发送调度配置（限频、合并发送，同一成员按提交顺序发送）
+    WECOM_SEND_CONCURRENCY = int(os.getenv("WECOM_SEND_CONCURRENCY", 4))
+    WECOM_SEND_APP_RATE = float(os.getenv("WECOM_SEND_APP_RATE", 20))
+    WECOM_SEND_USER_RATE_PER_MINUTE = float(os.getenv("WECOM_SEND_USER_RATE_PER_MINUTE", 30))
+    WECOM_SEND_USER_BURST = int(os.getenv("WECOM_SEND_USER_BURST", 5))
+    WECOM_SEND_BATCH_WINDOW_MS = int(os.getenv("WECOM_SEND_BATCH_WINDOW_MS", 50))
+    # access_token 剩余有效期不足该值时由后台线程提前刷新（秒）
+    WECOM_TOKEN_REFRESH_AHEAD_SECONDS = int(os.getenv("WECOM_TOKEN_REFRESH_AHEAD_SECONDS", 600))
+    # 回调消息去重记录保留时长（企业微信对同一消息最多重试3次）
+    WECOM_DEDUP_TTL_SECONDS = int(os.getenv("WECOM_DEDUP_TTL_SECONDS", 300))
+    # 消息合并：同一成员在窗口期内连续发送的消息合并为一轮对话，只调用一次AI，回复改为主动推送
+    WECOM_DEBOUNCE_ENABLED = os.getenv("WECOM_DEBOUNCE_ENABLED", "false").lower() == "true"
+    # 合并窗口（秒），每条新消息重新计时
+    WECOM_DEBOUNCE_SECONDS = float(os.getenv("WECOM_DEBOUNCE_SECONDS", 2))
+    # 最多合并的消息数，达到后立即回复
+    WECOM_DEBOUNCE_MAX_MESSAGES = int(os.getenv("WECOM_DEBOUNCE_MAX_MESSAGES", 5))
+    # 回调流量录制文件（JSON Lines，仅记录脱敏后的元数据），为空则不录制，用于 loadtest replay
+    CALLBACK_RECORD_PATH = os.getenv("CALLBACK_RECORD_PATH", "")
+    # 回调XML报文大小上限（字节），超出直接拒绝
+    WECOM_MAX_XML_BYTES = int(os.getenv("WECOM_MAX_XML_BYTES", 65536))
     
     # DashScope 配置
     DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY", "")
+    # DeepSeek API Key（可选），未设置时 DeepSeek 模型沿用 DASHSCOPE_API_KEY
+    DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
+    # OpenAI 兼容接口地址（可选），设置后所有模型都通过该地址调用，如压测时指向 loadtest 的模拟LLM
+    AI_BASE_URL = os.getenv("AI_BASE_URL", "")
     
     # Redis 配置
     REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
     REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
     REDIS_DB = int(os.getenv("REDIS_DB", 0))
+    REDIS_CONNECT_TIMEOUT_SECONDS = float(os.getenv("REDIS_CONNECT_TIMEOUT_SECONDS", 2))
+    # Redis熔断：连续连接失败达到阈值后熔断，冷却后放行探测请求
+    REDIS_BREAKER_FAILURE_THRESHOLD = int(os.getenv("REDIS_BREAKER_FAILURE_THRESHOLD", 5))
+    REDIS_BREAKER_RESET_SECONDS = float(os.getenv("REDIS_BREAKER_RESET_SECONDS", 5))
     
     # Flask 配置
     FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
@@ -34,9 +68,96 @@ class Config:
     AI_MAX_TOKENS = int(os.getenv("AI_MAX_TOKENS", 2048))
     AI_TEMPERATURE = float(os.getenv("AI_TEMPERATURE", 0.7))
     
+    # LLM熔断：连续失败（或耗时超过 AI_BREAKER_SLOW_SECONDS）达到阈值后熔断，熔断期间直接返回固定回复
+    AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("AI_BREAKER_FAILURE_THRESHOLD", 5))
+    AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", 30))
+    AI_BREAKER_SLOW_SECONDS = float(os.getenv("AI_BREAKER_SLOW_SECONDS", 15))
+    
+    # 多模型路由配置（逗号分隔的模型列表，为空则只使用 AI_MODEL）
+    AI_ROUTER_MODELS = [m.strip() for m in os.getenv("AI_ROUTER_MODELS", "").split(",") if m.strip()]
+    # 主模型耗时超过其近期该分位数（且不少于下限秒数）时向次优模型发出对冲请求
+    AI_ROUTER_HEDGE_PERCENTILE = float(os.getenv("AI_ROUTER_HEDGE_PERCENTILE", 95))
+    AI_ROUTER_HEDGE_MIN_SECONDS = float(os.getenv("AI_ROUTER_HEDGE_MIN_SECONDS", 1))
+    # 延迟和错误率的统计窗口（样本数、秒数）
+    AI_ROUTER_WINDOW_SIZE = int(os.getenv("AI_ROUTER_WINDOW_SIZE", 100))
+    AI_ROUTER_WINDOW_SECONDS = float(os.getenv("AI_ROUTER_WINDOW_SECONDS", 300))
+    # 错误率超过该值的模型视为不健康，排在最后
+    AI_ROUTER_MAX_ERROR_RATE = float(os.getenv("AI_ROUTER_MAX_ERROR_RATE", 0.5))
+    
+    # AI 回复缓存配置（仅缓存历史消息数不超过 AI_CACHE_MAX_HISTORY 的问题）
+    AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "false").lower() == "true"
+    AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", 3600))
+    AI_CACHE_LOCAL_SIZE = int(os.getenv("AI_CACHE_LOCAL_SIZE", 1000))
+    AI_CACHE_MAX_HISTORY = int(os.getenv("AI_CACHE_MAX_HISTORY", 0))
+    
+    # AI 流式回复配置（开启后回调立即返回，回复边生成边分段主动推送）
+    AI_STREAM_ENABLED = os.getenv("AI_STREAM_ENABLED", "false").lower() == "true"
+    AI_STREAM_FIRST_SEGMENT_CHARS = int(os.getenv("AI_STREAM_FIRST_SEGMENT_CHARS", 20))
+    AI_STREAM_SEGMENT_CHARS = int(os.getenv("AI_STREAM_SEGMENT_CHARS", 200))
+    
+    # AI 回复时限配置（企业微信约5秒未响应即重试）
+    AI_REPLY_DEADLINE_SECONDS = float(os.getenv("AI_REPLY_DEADLINE_SECONDS", 4))
+    AI_EXECUTOR_MAX_WORKERS = int(os.getenv("AI_EXECUTOR_MAX_WORKERS", 8))
+    # ASGI 模式下单个进程并发的 AI 调用数上限
+    AI_ASYNC_MAX_CONCURRENCY = int(os.getenv("AI_ASYNC_MAX_CONCURRENCY", 256))
+    
+    # AI 任务公平调度（按用户排队，赤字轮询按权重轮流执行，每个用户同时只执行一个任务）
+    # 调度权重：逗号分隔的 用户ID或应用ID:权重，默认权重为1
+    AI_SCHEDULER_WEIGHTS = os.getenv("AI_SCHEDULER_WEIGHTS", "")
+    # 分组方式：为空表示只按用户排队，agent 表示先按应用（AgentID）分组轮流
+    AI_SCHEDULER_GROUP_BY = os.getenv("AI_SCHEDULER_GROUP_BY", "")
+    # 每个用户排队中的任务数上限，超出后直接回复繁忙提示
+    AI_SCHEDULER_MAX_QUEUE_PER_USER = int(os.getenv("AI_SCHEDULER_MAX_QUEUE_PER_USER", 5))
+    # 每个用户每分钟最多触发的AI任务数（令牌桶，突发量 AI_USER_BURST），0表示不限制
+    AI_USER_RATE_PER_MINUTE = float(os.getenv("AI_USER_RATE_PER_MINUTE", 0))
+    AI_USER_BURST = int(os.getenv("AI_USER_BURST", 5))
+    
+    # AI 任务准入控制（按积压任务数和近期耗时估算等待时间，超限时返回繁忙提示）
+    AI_ADMISSION_ENABLED = os.getenv("AI_ADMISSION_ENABLED", "false").lower() == "true"
+    # 单个进程已准入尚未完成（执行中 + 排队中）的AI任务数上限
+    AI_ADMISSION_MAX_BACKLOG = int(os.getenv("AI_ADMISSION_MAX_BACKLOG", 64))
+    # 预计等待时间上限（秒），按近期耗时估算，积压任务超出该时间内能完成的数量时拒绝
+    AI_ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("AI_ADMISSION_MAX_WAIT_SECONDS", 30))
+    # 新会话可使用的名额比例，其余名额留给近期有过对话的会话
+    AI_ADMISSION_NEW_SESSION_SHARE = float(os.getenv("AI_ADMISSION_NEW_SESSION_SHARE", 0.8))
+    # 多久内有过对话的会话视为进行中（秒）
+    AI_ADMISSION_ACTIVE_SECONDS = int(os.getenv("AI_ADMISSION_ACTIVE_SECONDS", 600))
+    
+    # AI 回复队列配置（Redis Streams，由 worker.py 消费）
+    AI_QUEUE_ENABLED = os.getenv("AI_QUEUE_ENABLED", "false").lower() == "true"
+    AI_QUEUE_STREAM = os.getenv("AI_QUEUE_STREAM", "wecom:ai:replies")
+    AI_QUEUE_GROUP = os.getenv("AI_QUEUE_GROUP", "ai-workers")
+    AI_QUEUE_MAXLEN = int(os.getenv("AI_QUEUE_MAXLEN", 10000))
+    AI_QUEUE_BLOCK_MS = int(os.getenv("AI_QUEUE_BLOCK_MS", 5000))
+    AI_QUEUE_CLAIM_IDLE_MS = int(os.getenv("AI_QUEUE_CLAIM_IDLE_MS", 60000))
+    AI_QUEUE_MAX_DELIVERIES = int(os.getenv("AI_QUEUE_MAX_DELIVERIES", 3))
+    AI_WORKER_CONCURRENCY = int(os.getenv("AI_WORKER_CONCURRENCY", 8))
+    
     # 对话历史配置
     CONVERSATION_MAX_HISTORY = int(os.getenv("CONVERSATION_MAX_HISTORY", 20))
+    # 每次对话带入的历史消息token预算，0表示不限制
+    CONVERSATION_MAX_TOKENS = int(os.getenv("CONVERSATION_MAX_TOKENS", 2000))
     CONVERSATION_TTL_SECONDS = int(os.getenv("CONVERSATION_TTL_SECONDS", 86400))
+    # 进程内最近会话缓存：按内存占用（估算字节数）淘汰，每次读取用Redis中的会话版本号校验
+    CONVERSATION_LOCAL_CACHE_ENABLED = os.getenv("CONVERSATION_LOCAL_CACHE_ENABLED", "true").lower() == "true"
+    CONVERSATION_LOCAL_CACHE_MAX_BYTES = int(os.getenv("CONVERSATION_LOCAL_CACHE_MAX_BYTES", 33554432))
+    # 缓存条目最长保留时间，应小于 CONVERSATION_TTL_SECONDS
+    CONVERSATION_LOCAL_CACHE_TTL_SECONDS = int(os.getenv("CONVERSATION_LOCAL_CACHE_TTL_SECONDS", 300))
+    # Redis不可用时对话历史降级到进程内存储，最多保留的会话数
+    CONVERSATION_FALLBACK_MAX_SESSIONS = int(os.getenv("CONVERSATION_FALLBACK_MAX_SESSIONS", 1000))
+    
+    # 会话锁：同一会话的对话轮次按顺序执行（进程内锁 + Redis租约锁），不同会话并行
+    SESSION_LOCK_ENABLED = os.getenv("SESSION_LOCK_ENABLED", "true").lower() == "true"
+    # 租约时长，持有期间每隔 1/3 租约自动续租；持有者崩溃时租约到期后自动释放
+    SESSION_LOCK_LEASE_SECONDS = float(os.getenv("SESSION_LOCK_LEASE_SECONDS", 60))
+    # 最长等待时间，超时后放弃本轮对话并回复繁忙提示
+    SESSION_LOCK_WAIT_SECONDS = float(os.getenv("SESSION_LOCK_WAIT_SECONDS", 30))
+    
+    # 对话摘要压缩配置（消息数达到阈值时，后台将最早的若干条消息合并为摘要）
+    CONVERSATION_SUMMARY_ENABLED = os.getenv("CONVERSATION_SUMMARY_ENABLED", "false").lower() == "true"
+    CONVERSATION_SUMMARY_MODEL = os.getenv("CONVERSATION_SUMMARY_MODEL", "qwen-turbo")
+    CONVERSATION_SUMMARY_THRESHOLD = int(os.getenv("CONVERSATION_SUMMARY_THRESHOLD", 16))
+    CONVERSATION_SUMMARY_BATCH = int(os.getenv("CONVERSATION_SUMMARY_BATCH", 8))
     
     @classmethod
     def validate(cls):
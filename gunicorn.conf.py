@@ -0,0 +1,63 @@
+"""
+gunicorn 配置（gunicorn 启动时自动加载当前目录下的 gunicorn.conf.py，命令行参数优先）
+设置了 PROMETHEUS_MULTIPROC_DIR 时负责多进程指标目录的初始化与清理。
+目录在加载本文件时准备：预加载模式下主进程随后即导入 metrics，模块级的 livesum Gauge
+会立即在该目录下创建 mmap 文件，早于 on_starting 等钩子
+
+GUNICORN_PRELOAD=true 时开启预加载：主进程导入应用并执行 init_app（导入 langchain 等依赖，
+构建提示词模板、LLM客户端、加解密密钥等），worker 由 fork 得到，以写时复制方式共享这部分内存，
+不再各自导入一遍。应用组件的线程、Redis连接、HTTP连接池均在首次使用时才创建，因此可以安全地在 fork 前构建
+"""
+import gc
+import os
+import shutil
+from dotenv import load_dotenv
+
+# 与 config.py 一致，支持在 .env 中配置 GUNICORN_PRELOAD
+load_dotenv()
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "false").lower() == "true"
+
+
+def _prepare_multiproc_dir() -> None:
+    """
+    清空上次运行遗留的指标文件并创建目录
+    
+    HUP 重载时会再次加载本文件，此时目录中是运行中 worker 的指标文件，不能清空：
+    以环境变量标记主进程已准备过（USR2 重新执行时新主进程继承该标记，同样跳过）
+    """
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not directory or os.environ.get("_WECOM_MULTIPROC_DIR_READY") == directory:
+        return
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    os.environ["_WECOM_MULTIPROC_DIR_READY"] = directory
+
+
+_prepare_multiproc_dir()
+
+if preload_app:
+    # 导入应用期间关闭自动GC，避免回收在已分配的内存页中留下空洞，主进程就绪后恢复
+    gc.disable()
+
+
+def when_ready(server):
+    """主进程就绪（预加载已完成）：恢复自动GC"""
+    if preload_app:
+        gc.enable()
+
+
+def pre_fork(server, worker):
+    """
+    fork worker 前冻结主进程中的现有对象：移入永久代后 worker 中的GC不再遍历它们，
+    不会因写入GC头部而复制整页内存，预加载的组件在各 worker 间保持共享
+    """
+    if preload_app:
+        gc.freeze()
+
+
+def child_exit(server, worker):
+    """worker 退出：清理其 livesum 类指标（如进行中的 LLM 调用数），避免残留"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,8 @@
+"""
+压测工具
+- 模拟LLM（OpenAI兼容接口，延迟分布可调）与模拟企业微信API（记录主动发送）
+- 按用户数、消息速率和对话轮数生成正确签名加密的回调请求
+- 录制线上回调流量（脱敏）并按倍速回放
+
+用法见 python -m loadtest --help
+"""
@@ -0,0 +1,151 @@
+"""
+压测命令行
+    
+    # 1. 启动模拟服务（各占一个终端）
+    python -m loadtest mock-llm --port 8900 --latency lognormal:0,0.5
+    python -m loadtest mock-qyapi --port 8901 --log sends.jsonl
+    
+    # 2. 被测服务指向模拟服务
+    AI_BASE_URL=http://127.0.0.1:8900/v1 WECOM_API_BASE_URL=http://127.0.0.1:8901 \\
+        gunicorn -w 4 -b 0.0.0.0:5000 app:app
+    
+    # 3. 合成负载 / 录制回放
+    python -m loadtest run --url http://127.0.0.1:5000 --users 200 --depth 5 --rate 50
+    python -m loadtest replay callbacks.jsonl --url http://127.0.0.1:5000 --speed 10
+"""
+import argparse
+import asyncio
+import json
+
+import httpx
+
+from .callbacks import WECOM_MAX_RETRIES, WECOM_TIMEOUT_SECONDS, CallbackClient, CallbackStats
+from .generator import run_load
+from .mock_servers import serve_mock_llm, serve_mock_qyapi
+from .replay import load_recording, replay
+
+
+def _add_target_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="被测服务地址")
+    parser.add_argument("--timeout", type=float, default=WECOM_TIMEOUT_SECONDS, help="单次请求超时（秒）")
+    parser.add_argument("--max-connections", type=int, default=1000, help="最大并发连接数")
+    parser.add_argument("--qyapi-url", help="模拟企业微信API地址，结束后汇总主动发送统计")
+    parser.add_argument("--drain", type=float, default=0.0, help="结束后等待主动推送完成的时长（秒）")
+    parser.add_argument("--output", help="将结果写入JSON文件")
+
+
+async def _collect(args: argparse.Namespace, stats: CallbackStats) -> dict:
+    result = stats.summary()
+    if args.qyapi_url:
+        if args.drain:
+            await asyncio.sleep(args.drain)
+        async with httpx.AsyncClient() as client:
+            resp = await client.get(args.qyapi_url.rstrip("/") + "/stats")
+            result["proactive_sends"] = resp.json()
+    return result
+
+
+def _report(args: argparse.Namespace, result: dict) -> None:
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+async def _run(args: argparse.Namespace) -> None:
+    stats = CallbackStats()
+    client = CallbackClient(
+        args.url, stats,
+        timeout=args.timeout,
+        max_retries=args.max_retries,
+        max_connections=args.max_connections
+    )
+    try:
+        await run_load(
+            client,
+            users=args.users,
+            depth=args.depth,
+            rate=args.rate,
+            think_seconds=args.think,
+            duration=args.duration
+        )
+    finally:
+        await client.aclose()
+    _report(args, await _collect(args, stats))
+
+
+async def _replay(args: argparse.Namespace) -> None:
+    records = load_recording(args.recording)
+    stats = CallbackStats()
+    client = CallbackClient(
+        args.url, stats,
+        timeout=args.timeout,
+        max_retries=args.max_retries,
+        max_connections=args.max_connections
+    )
+    try:
+        await replay(client, records, speed=args.speed)
+    finally:
+        await client.aclose()
+    _report(args, await _collect(args, stats))
+
+
+def _serve(server, name: str) -> None:
+    host, port = server.server_address[:2]
+    print(f"{name} 已启动: http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m loadtest", description="企业微信机器人压测工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    run_parser = subparsers.add_parser("run", help="合成负载")
+    _add_target_arguments(run_parser)
+    run_parser.add_argument("--users", type=int, default=50, help="虚拟用户数（并发对话数）")
+    run_parser.add_argument("--depth", type=int, default=3, help="每个用户的对话轮数")
+    run_parser.add_argument("--rate", type=float, help="全局消息速率（条/秒），默认不限")
+    run_parser.add_argument("--think", type=float, default=0.0, help="两轮之间的平均思考时间（秒）")
+    run_parser.add_argument("--duration", type=float, help="最长运行时间（秒）")
+    run_parser.add_argument("--max-retries", type=int, default=WECOM_MAX_RETRIES, help="超时/5xx后的重试次数")
+    
+    replay_parser = subparsers.add_parser("replay", help="回放录制的回调流量")
+    replay_parser.add_argument("recording", help="录制文件（CALLBACK_RECORD_PATH 生成的 JSON Lines）")
+    _add_target_arguments(replay_parser)
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="回放倍速")
+    # 录制文件已包含企业微信的重试，默认不再额外重试
+    replay_parser.add_argument("--max-retries", type=int, default=0, help="超时/5xx后的重试次数")
+    
+    llm_parser = subparsers.add_parser("mock-llm", help="启动模拟LLM（OpenAI兼容接口）")
+    llm_parser.add_argument("--host", default="127.0.0.1")
+    llm_parser.add_argument("--port", type=int, default=8900)
+    llm_parser.add_argument("--latency", default="fixed:0.5", help="响应延迟分布，如 uniform:0.2,2、lognormal:0,0.5")
+    llm_parser.add_argument("--chunk-interval", type=float, default=0.05, help="流式输出的分块间隔（秒）")
+    llm_parser.add_argument("--reply", help="固定回复内容")
+    
+    qyapi_parser = subparsers.add_parser("mock-qyapi", help="启动模拟企业微信API")
+    qyapi_parser.add_argument("--host", default="127.0.0.1")
+    qyapi_parser.add_argument("--port", type=int, default=8901)
+    qyapi_parser.add_argument("--latency", default="fixed:0", help="响应延迟分布")
+    qyapi_parser.add_argument("--error-rate", type=float, default=0.0, help="返回限频错误(45009)的比例")
+    qyapi_parser.add_argument("--log", help="主动发送记录文件（JSON Lines）")
+    
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(_run(args))
+    elif args.command == "replay":
+        asyncio.run(_replay(args))
+    elif args.command == "mock-llm":
+        _serve(serve_mock_llm(args.host, args.port, args.latency, args.chunk_interval, args.reply), "模拟LLM")
+    elif args.command == "mock-qyapi":
+        _serve(serve_mock_qyapi(args.host, args.port, args.latency, args.error_rate, args.log), "模拟企业微信API")
+
+
+if __name__ == "__main__":
+    main()
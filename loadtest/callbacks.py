@@ -0,0 +1,200 @@
+"""
+回调请求构造与压测统计
+使用 WXBizMsgCrypt 生成与企业微信一致的签名加密回调，按企业微信的重试策略发送
+"""
+import asyncio
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Optional
+from xml.sax.saxutils import escape
+
+import httpx
+
+from config import Config
+from wecom.crypto import WXBizMsgCrypt
+from wecom.parser import escape_cdata
+
+# 企业微信等待响应的时长（秒），超时后重试
+WECOM_TIMEOUT_SECONDS = 5
+# 企业微信对同一消息最多重试次数
+WECOM_MAX_RETRIES = 3
+
+
+@dataclass
+class CallbackStats:
+    """压测统计"""
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+    # 消息数（不含重试）
+    messages: int = 0
+    # 请求数（含重试）
+    requests: int = 0
+    # 重试次数（同一 MsgId 重复推送）
+    retries: int = 0
+    # 重试用尽仍未成功的消息数
+    failures: int = 0
+    # 超时请求数
+    timeouts: int = 0
+    # 网络异常请求数
+    errors: int = 0
+    # 被动回复（响应体为加密XML）的消息数
+    passive_replies: int = 0
+    status_codes: Counter = field(default_factory=Counter)
+    # 每个请求的响应耗时（秒）
+    latencies: List[float] = field(default_factory=list)
+    
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+    
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> float:
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[min(int(len(values) * q), len(values) - 1)]
+    
+    def summary(self) -> dict:
+        """汇总结果"""
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        error_requests = self.timeouts + self.errors + sum(
+            count for status, count in self.status_codes.items() if status >= 400
+        )
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "messages": self.messages,
+            "requests": self.requests,
+            "throughput_rps": round(self.requests / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {
+                name: round(self._percentile(self.latencies, q) * 1000, 1)
+                for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))
+            },
+            "retries": self.retries,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "error_rate": round(error_requests / self.requests, 4) if self.requests else 0.0,
+            "passive_replies": self.passive_replies,
+            "status_codes": dict(self.status_codes),
+        }
+
+
+class CallbackClient:
+    """向被测服务发送签名加密的消息回调"""
+    
+    def __init__(
+        self,
+        base_url: str,
+        stats: CallbackStats,
+        token: Optional[str] = None,
+        encoding_aes_key: Optional[str] = None,
+        corp_id: Optional[str] = None,
+        agent_id: Optional[str] = None,
+        timeout: float = WECOM_TIMEOUT_SECONDS,
+        max_retries: int = WECOM_MAX_RETRIES,
+        max_connections: int = 1000
+    ):
+        """
+        Args:
+            base_url: 被测服务地址，如 http://127.0.0.1:5000
+            stats: 统计对象
+            token/encoding_aes_key/corp_id/agent_id: 回调配置，默认读取 Config
+            timeout: 单次请求超时（秒），超时后按企业微信策略重试
+            max_retries: 最多重试次数
+            max_connections: 最大并发连接数
+        """
+        self.url = base_url.rstrip("/") + "/wecom/callback"
+        self.stats = stats
+        self.corp_id = corp_id or Config.WECOM_CORP_ID
+        self.agent_id = agent_id or Config.WECOM_AGENT_ID or "1000001"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.crypto = WXBizMsgCrypt(
+            token=token or Config.WECOM_TOKEN,
+            encoding_aes_key=encoding_aes_key or Config.WECOM_ENCODING_AES_KEY,
+            corp_id=self.corp_id
+        )
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+    
+    def build_message(self, user_id: str, content: str, msg_id: str, msg_type: str = "text") -> str:
+        """构造明文消息XML"""
+        return f"""<xml>
+<ToUserName><![CDATA[{escape_cdata(self.corp_id)}]]></ToUserName>
+<FromUserName><![CDATA[{escape_cdata(user_id)}]]></FromUserName>
+<CreateTime>{int(time.time())}</CreateTime>
+<MsgType><![CDATA[{escape_cdata(msg_type)}]]></MsgType>
+<Content><![CDATA[{escape_cdata(content)}]]></Content>
+<MsgId>{escape(msg_id)}</MsgId>
+<AgentID>{escape(str(self.agent_id))}</AgentID>
+</xml>"""
+    
+    def build_request(self, message_xml: str, nonce: str) -> tuple:
+        """
+        加密并签名消息
+        
+        Returns:
+            (查询参数, 请求体)
+        """
+        timestamp = str(int(time.time()))
+        _, encrypted = self.crypto._encrypt(message_xml)
+        signature = self.crypto._get_signature(timestamp, nonce, encrypted)
+        body = f"""<xml>
+<ToUserName><![CDATA[{escape_cdata(self.corp_id)}]]></ToUserName>
+<Encrypt><![CDATA[{encrypted}]]></Encrypt>
+<AgentID><![CDATA[{escape_cdata(str(self.agent_id))}]]></AgentID>
+</xml>"""
+        params = {"msg_signature": signature, "timestamp": timestamp, "nonce": nonce}
+        return params, body.encode("utf-8")
+    
+    async def send(
+        self,
+        user_id: str,
+        content: str,
+        msg_id: str,
+        msg_type: str = "text",
+        is_retry: bool = False
+    ) -> bool:
+        """
+        发送一条消息回调，超时或5xx时以相同 MsgId 重试
+        
+        Args:
+            is_retry: 是否为录制流量中的重复推送（计入重试而非消息数）
+        
+        Returns:
+            是否成功（收到2xx响应）
+        """
+        if is_retry:
+            self.stats.retries += 1
+        else:
+            self.stats.messages += 1
+        message_xml = self.build_message(user_id, content, msg_id, msg_type)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats.retries += 1
+            params, body = self.build_request(message_xml, nonce=f"{msg_id}{attempt}")
+            self.stats.requests += 1
+            started_at = time.monotonic()
+            try:
+                resp = await self.client.post(self.url, params=params, content=body)
+            except httpx.TimeoutException:
+                self.stats.timeouts += 1
+                continue
+            except httpx.HTTPError:
+                self.stats.errors += 1
+                await asyncio.sleep(0.1)
+                continue
+            
+            self.stats.latencies.append(time.monotonic() - started_at)
+            self.stats.status_codes[resp.status_code] += 1
+            if resp.status_code < 500:
+                if resp.status_code < 300 and resp.content.startswith(b"<xml>"):
+                    self.stats.passive_replies += 1
+                return resp.status_code < 300
+        self.stats.failures += 1
+        return False
+    
+    async def aclose(self) -> None:
+        await self.client.aclose()
@@ -0,0 +1,88 @@
+"""
+合成负载
+多个虚拟用户各自进行多轮对话，所有用户共享一个全局发送速率（开环，按固定间隔分配发送时刻）
+"""
+import asyncio
+import random
+import time
+import uuid
+from typing import Optional
+
+from .callbacks import CallbackClient
+
+# 生成消息内容用的问题模板
+QUESTIONS = [
+    "你好",
+    "请问报销流程是怎样的？",
+    "年假怎么申请，需要提前多久？",
+    "公司的上班时间是几点到几点？",
+    "帮我写一段产品介绍，突出性价比和售后服务。",
+    "上一个问题能再详细说明一下吗？",
+]
+
+
+class RatePacer:
+    """全局发送速率控制：按 1/rate 的间隔依次分配发送时刻"""
+    
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+
+async def _virtual_user(
+    client: CallbackClient,
+    pacer: RatePacer,
+    user_id: str,
+    depth: int,
+    think_seconds: float,
+    deadline: float
+) -> None:
+    """一个虚拟用户：依次发送 depth 轮消息，每轮等待回调响应后再思考 think_seconds 秒"""
+    for turn in range(depth):
+        if time.monotonic() >= deadline:
+            return
+        await pacer.wait()
+        content = f"{random.choice(QUESTIONS)}（第{turn + 1}轮）"
+        await client.send(user_id, content, msg_id=str(uuid.uuid4().int >> 64))
+        if think_seconds:
+            await asyncio.sleep(random.uniform(0, 2 * think_seconds))
+
+
+async def run_load(
+    client: CallbackClient,
+    users: int,
+    depth: int,
+    rate: Optional[float] = None,
+    think_seconds: float = 0.0,
+    duration: Optional[float] = None,
+    user_prefix: str = "loadtest"
+) -> None:
+    """
+    运行合成负载
+    
+    Args:
+        client: 回调客户端
+        users: 虚拟用户数（并发对话数）
+        depth: 每个用户的对话轮数
+        rate: 全局消息速率（条/秒），None表示不限
+        think_seconds: 两轮之间的平均思考时间（秒）
+        duration: 最长运行时间（秒），None表示直到所有对话结束
+        user_prefix: 虚拟用户ID前缀
+    """
+    pacer = RatePacer(rate)
+    deadline = time.monotonic() + duration if duration else float("inf")
+    await asyncio.gather(*[
+        _virtual_user(client, pacer, f"{user_prefix}-{i}", depth, think_seconds, deadline)
+        for i in range(users)
+    ])
+    client.stats.finish()
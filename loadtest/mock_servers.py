@@ -0,0 +1,235 @@
+"""
+模拟服务（仅依赖标准库）
+- MockLLMHandler: OpenAI 兼容的 /v1/chat/completions，支持流式输出，响应延迟按指定分布抽样
+- MockQyapiHandler: 企业微信 /cgi-bin/gettoken 与 /cgi-bin/message/send，记录主动发送，可注入限频错误
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    解析延迟分布
+    
+    Args:
+        spec: 分布描述（单位秒）：
+            fixed:0.5            固定延迟
+            uniform:0.2,2        均匀分布
+            normal:1,0.3         正态分布（截断为非负）
+            lognormal:0,0.5      对数正态分布（参数为底层正态分布的 mu,sigma）
+            exponential:1        指数分布（参数为均值）
+    
+    Returns:
+        每次调用返回一个延迟样本的函数
+    """
+    kind, _, params = spec.partition(":")
+    args = [float(x) for x in params.split(",") if x]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "normal":
+        return lambda: max(random.gauss(args[0], args[1]), 0.0)
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(args[0], args[1])
+    if kind == "exponential":
+        return lambda: random.expovariate(1 / args[0])
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    """JSON 请求/响应的公共处理"""
+    
+    protocol_version = "HTTP/1.1"
+    
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+    
+    def _send_json(self, data: dict, status: int = 200) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args) -> None:
+        # 压测时不逐条打印访问日志
+        pass
+
+
+class MockLLMHandler(_JsonHandler):
+    """模拟 OpenAI 兼容的对话接口"""
+    
+    # 由 serve_mock_llm 设置
+    latency: Callable[[], float] = staticmethod(lambda: 0.0)
+    # 流式输出时相邻分块的间隔（秒）
+    chunk_interval: float = 0.0
+    reply: str = "您好，我是模拟的AI助手。这是一条用于压测的固定回复，请问还有什么可以帮您？"
+    
+    def do_POST(self) -> None:
+        if not urlparse(self.path).path.endswith("/chat/completions"):
+            self._send_json({"error": {"message": "not found"}}, 404)
+            return
+        request = self._read_json()
+        model = request.get("model", "mock")
+        time.sleep(self.latency())
+        if request.get("stream"):
+            self._stream(model)
+        else:
+            self._send_json({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(self.reply), "total_tokens": len(self.reply)}
+            })
+    
+    def _stream(self, model: str) -> None:
+        """以 SSE 分块输出回复（首块延迟即为抽样延迟，之后每块间隔 chunk_interval）"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        
+        def write_event(payload: str) -> None:
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        
+        pieces = [self.reply[i:i + 8] for i in range(0, len(self.reply), 8)]
+        for index, piece in enumerate(pieces):
+            if index and self.chunk_interval:
+                time.sleep(self.chunk_interval)
+            write_event(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece},
+                    "finish_reason": "stop" if index == len(pieces) - 1 else None
+                }]
+            }, ensure_ascii=False))
+        write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class SendRecorder:
+    """主动发送记录（线程安全）"""
+    
+    def __init__(self, log_path: Optional[str] = None):
+        self.sends = 0
+        self.recipients = 0
+        self.injected_errors = 0
+        self.token_requests = 0
+        self._log = open(log_path, "a", encoding="utf-8", buffering=1) if log_path else None
+        self._lock = threading.Lock()
+    
+    def record(self, payload: dict) -> None:
+        touser = payload.get("touser", "")
+        with self._lock:
+            self.sends += 1
+            self.recipients += len(touser.split("|")) if touser else 0
+            if self._log is not None:
+                self._log.write(json.dumps({
+                    "t": round(time.time(), 3),
+                    "touser": touser,
+                    "content_chars": len((payload.get("text") or {}).get("content", ""))
+                }, ensure_ascii=False) + "\n")
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sends": self.sends,
+                "recipients": self.recipients,
+                "injected_errors": self.injected_errors,
+                "token_requests": self.token_requests
+            }
+
+
+class MockQyapiHandler(_JsonHandler):
+    """模拟企业微信API"""
+    
+    # 由 serve_mock_qyapi 设置
+    recorder: SendRecorder = None
+    latency: Callable[[], float] = staticmethod(lambda: 0.0)
+    # 按比例返回 45009（接口调用频率超限）
+    error_rate: float = 0.0
+    
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path
+        if path == "/cgi-bin/gettoken":
+            with self.recorder._lock:
+                self.recorder.token_requests += 1
+            self._send_json({"errcode": 0, "errmsg": "ok", "access_token": "mock-access-token", "expires_in": 7200})
+        elif path == "/stats":
+            self._send_json(self.recorder.stats())
+        else:
+            self._send_json({"errcode": 404, "errmsg": "not found"}, 404)
+    
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path
+        if path != "/cgi-bin/message/send":
+            self._send_json({"errcode": 404, "errmsg": "not found"}, 404)
+            return
+        payload = self._read_json()
+        time.sleep(self.latency())
+        if self.error_rate and random.random() < self.error_rate:
+            with self.recorder._lock:
+                self.recorder.injected_errors += 1
+            self._send_json({"errcode": 45009, "errmsg": "api freq out of limit"})
+            return
+        self.recorder.record(payload)
+        self._send_json({"errcode": 0, "errmsg": "ok", "invaliduser": ""})
+
+
+def serve_mock_llm(
+    host: str,
+    port: int,
+    latency: str = "fixed:0.5",
+    chunk_interval: float = 0.0,
+    reply: Optional[str] = None
+) -> ThreadingHTTPServer:
+    """创建模拟LLM服务（调用方负责 serve_forever）"""
+    handler = type("ConfiguredMockLLMHandler", (MockLLMHandler,), {
+        "latency": staticmethod(parse_latency(latency)),
+        "chunk_interval": chunk_interval,
+        "reply": reply or MockLLMHandler.reply,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_mock_qyapi(
+    host: str,
+    port: int,
+    latency: str = "fixed:0",
+    error_rate: float = 0.0,
+    log_path: Optional[str] = None
+) -> ThreadingHTTPServer:
+    """创建模拟企业微信API服务（调用方负责 serve_forever）"""
+    handler = type("ConfiguredMockQyapiHandler", (MockQyapiHandler,), {
+        "recorder": SendRecorder(log_path),
+        "latency": staticmethod(parse_latency(latency)),
+        "error_rate": error_rate,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,54 @@
+"""
+回调流量录制
+只记录时间、消息类型、内容长度和脱敏后的用户/消息标识（不记录消息内容），
+输出 JSON Lines，供 loadtest replay 按原始节奏回放
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Optional
+
+from wecom.message import WeChatMessage
+
+
+def _redact(value: str) -> str:
+    """不可逆脱敏：同一原值映射到同一标识，以便回放时保留用户分布与重试关系"""
+    if not value:
+        return ""
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+class CallbackRecorder:
+    """回调流量录制器（线程安全，追加写入）"""
+    
+    def __init__(self, path: str):
+        """
+        Args:
+            path: 录制文件路径（JSON Lines，追加写入）
+        """
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+    
+    def record(self, msg: WeChatMessage, received_at: Optional[float] = None) -> None:
+        """
+        记录一条已解密的回调消息
+        
+        Args:
+            msg: 回调消息
+            received_at: 收到时间（Unix时间戳），默认当前时间
+        """
+        line = json.dumps({
+            "t": round(received_at or time.time(), 3),
+            "user": _redact(msg.from_user_name),
+            "msg_id": _redact(msg.msg_id),
+            "msg_type": msg.msg_type,
+            "event": msg.event,
+            "content_chars": len(msg.content or ""),
+        })
+        try:
+            with self._lock:
+                self._file.write(line + "\n")
+        except Exception as e:
+            print(f"录制回调流量失败: {e}")
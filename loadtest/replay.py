@@ -0,0 +1,69 @@
+"""
+录制流量回放
+按录制文件中的到达间隔（除以倍速）重新发送回调：用户映射为虚拟用户，消息内容用等长的合成文本代替，
+同一脱敏 MsgId 再次出现时以相同 MsgId 发送，保留企业微信的重试行为
+"""
+import asyncio
+import json
+import time
+from typing import List
+
+from .callbacks import CallbackClient
+
+# 合成内容的填充文本
+_FILLER = "这是一条回放的测试消息，内容长度与录制时一致。"
+
+
+def load_recording(path: str) -> List[dict]:
+    """读取录制文件，按时间排序"""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def _synthetic_content(chars: int) -> str:
+    return (_FILLER * (chars // len(_FILLER) + 1))[:max(chars, 1)]
+
+
+async def replay(client: CallbackClient, records: List[dict], speed: float = 1.0) -> None:
+    """
+    回放录制流量
+    
+    Args:
+        client: 回调客户端
+        records: 录制记录（已按时间排序）
+        speed: 回放倍速，如 10 表示以10倍速率回放
+    """
+    if not records:
+        client.stats.finish()
+        return
+    
+    origin = records[0]["t"]
+    started_at = time.monotonic()
+    seen_msg_ids = set()
+    tasks = []
+    for record in records:
+        delay = (record["t"] - origin) / speed - (time.monotonic() - started_at)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        
+        # 脱敏后的 MsgId 为16位十六进制，还原为数字形式的 MsgId
+        redacted_msg_id = record.get("msg_id")
+        msg_id = str(int(redacted_msg_id, 16)) if redacted_msg_id else str(time.time_ns())
+        is_retry = bool(redacted_msg_id) and redacted_msg_id in seen_msg_ids
+        seen_msg_ids.add(redacted_msg_id)
+        
+        tasks.append(asyncio.ensure_future(client.send(
+            user_id=f"replay-{record['user']}",
+            content=_synthetic_content(record.get("content_chars", 0)),
+            msg_id=msg_id,
+            msg_type=record.get("msg_type") or "text",
+            is_retry=is_retry
+        )))
+    await asyncio.gather(*tasks)
+    client.stats.finish()
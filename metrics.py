@@ -0,0 +1,210 @@
+"""
+Prometheus 监控指标
+gunicorn 多 worker 部署时需设置 PROMETHEUS_MULTIPROC_DIR（见 gunicorn.conf.py、Dockerfile），
+各进程将指标写入该目录下的 mmap 文件，/metrics 汇总所有进程；未设置时只统计当前进程
+
+热路径上只调用预先绑定标签的 observe/inc，单次开销为微秒级
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+# 各处理阶段耗时分布（秒），覆盖亚毫秒级的加解密到秒级的主动发送
+_STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+# LLM 调用耗时分布（秒）
+_LLM_BUCKETS = (0.25, 0.5, 1, 2, 3, 4, 5, 7.5, 10, 15, 20, 30, 60)
+# 等待时间分布（秒）：会话锁、AI任务排队，无竞争时为毫秒级，排队时为前面任务的耗时
+_WAIT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    "wecom_stage_seconds",
+    "回调处理各阶段耗时",
+    ["stage"],
+    buckets=_STAGE_BUCKETS
+)
+SIGNATURE_SECONDS = STAGE_SECONDS.labels("signature")
+DECRYPT_SECONDS = STAGE_SECONDS.labels("decrypt")
+PARSE_SECONDS = STAGE_SECONDS.labels("parse")
+HISTORY_READ_SECONDS = STAGE_SECONDS.labels("history_read")
+HISTORY_WRITE_SECONDS = STAGE_SECONDS.labels("history_write")
+ENCRYPT_SECONDS = STAGE_SECONDS.labels("encrypt")
+SEND_SECONDS = STAGE_SECONDS.labels("send")
+
+LLM_SECONDS = Histogram(
+    "wecom_llm_seconds",
+    "LLM 调用耗时（流式为完整生成耗时，不含分段推送；多模型路由时 router 为端到端耗时，各模型名下为完整返回的后端自身的耗时）",
+    ["model"],
+    buckets=_LLM_BUCKETS
+)
+LLM_IN_FLIGHT = Gauge(
+    "wecom_llm_in_flight",
+    "进行中的 LLM 调用数",
+    multiprocess_mode="livesum"
+)
+
+AI_BACKLOG = Gauge(
+    "wecom_ai_backlog",
+    "已准入尚未完成的 AI 任务数（含排队）",
+    multiprocess_mode="livesum"
+)
+ADMISSION_DECISIONS = Counter(
+    "wecom_admission_decisions_total",
+    "AI 任务准入结果：admit、defer（转为主动推送）、reject（返回繁忙提示）",
+    ["result", "session"]
+)
+AI_QUEUE_DEPTH = Gauge(
+    "wecom_ai_queue_depth",
+    "公平调度器中排队等待执行的 AI 任务数",
+    multiprocess_mode="livesum"
+)
+AI_QUEUE_WAIT_SECONDS = Histogram(
+    "wecom_ai_queue_wait_seconds",
+    "AI 任务在公平调度器中的排队时间",
+    buckets=_WAIT_BUCKETS
+)
+AI_SCHEDULER_REJECTIONS = Counter(
+    "wecom_ai_scheduler_rejections_total",
+    "公平调度器拒绝的 AI 任务：rate_limited（超出用户限流）、queue_full（排队过多）",
+    ["reason"]
+)
+
+LLM_BACKEND_REQUESTS = Counter(
+    "wecom_llm_backend_requests_total",
+    "多模型路由发往各模型的请求（cancelled 为对冲落败）",
+    ["model", "result"]
+)
+LLM_HEDGES = Counter(
+    "wecom_llm_hedges_total",
+    "多模型路由发出的对冲请求及其是否胜出（skipped 为线程池已满、未发出的对冲）",
+    ["result"]
+)
+
+CRYPTO_ERRORS = Counter(
+    "wecom_crypto_errors_total",
+    "WXBizMsgCrypt 返回的错误码",
+    ["code"]
+)
+CACHE_REQUESTS = Counter(
+    "wecom_cache_requests_total",
+    "AI 回复缓存查询结果",
+    ["result"]
+)
+CACHE_LOCAL_HITS = CACHE_REQUESTS.labels("local_hit")
+CACHE_REDIS_HITS = CACHE_REQUESTS.labels("redis_hit")
+CACHE_MISSES = CACHE_REQUESTS.labels("miss")
+HISTORY_CACHE_REQUESTS = Counter(
+    "wecom_history_cache_requests_total",
+    "进程内会话缓存查询结果（stale 为版本号已变化）",
+    ["result"]
+)
+HISTORY_CACHE_HITS = HISTORY_CACHE_REQUESTS.labels("hit")
+HISTORY_CACHE_STALE = HISTORY_CACHE_REQUESTS.labels("stale")
+HISTORY_CACHE_MISSES = HISTORY_CACHE_REQUESTS.labels("miss")
+DEDUP_HITS = Counter(
+    "wecom_dedup_hits_total",
+    "重复推送的回调消息",
+    ["status"]
+)
+DEBOUNCED_MESSAGES = Counter(
+    "wecom_debounced_messages_total",
+    "合并到后续消息中一并回复的消息数"
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "wecom_circuit_transitions_total",
+    "熔断器状态切换",
+    ["name", "state"]
+)
+CIRCUIT_REJECTIONS = Counter(
+    "wecom_circuit_rejections_total",
+    "熔断期间被直接拒绝的调用",
+    ["name"]
+)
+SESSION_LOCK_WAIT_SECONDS = Histogram(
+    "wecom_session_lock_wait_seconds",
+    "获取会话锁的等待时间",
+    buckets=_WAIT_BUCKETS
+)
+SESSION_LOCKS = Counter(
+    "wecom_session_locks_total",
+    "会话锁结果：acquired、timeout（等待超时，本轮放弃）、degraded（Redis不可用）、lost（续租时发现租约已丢失）、fenced（租约被接管后放弃写入）",
+    ["result"]
+)
+REDIS_ERRORS = Counter(
+    "wecom_redis_errors_total",
+    "Redis 操作异常",
+    ["component"]
+)
+TOKEN_REFRESHES = Counter(
+    "wecom_token_refreshes_total",
+    "调用企业微信接口刷新 access_token 的次数"
+)
+
+
+def redis_error(component: str) -> None:
+    """记录一次 Redis 操作异常"""
+    REDIS_ERRORS.labels(component).inc()
+
+
+def crypto_error(code: int) -> None:
+    """记录 WXBizMsgCrypt 返回的错误码"""
+    CRYPTO_ERRORS.labels(str(code)).inc()
+
+
+class LLMCallTimer:
+    """LLM 调用计时，可扣除调用期间不属于 LLM 的耗时（如流式回调中推送分段）"""
+    
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.excluded = 0.0
+    
+    @contextmanager
+    def exclude(self) -> Iterator[None]:
+        """其中的耗时不计入 LLM 调用耗时"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.excluded += time.perf_counter() - started_at
+    
+    def elapsed(self) -> float:
+        """LLM 调用耗时（秒）"""
+        return time.perf_counter() - self.started_at - self.excluded
+
+
+@contextmanager
+def llm_call(model: str) -> Iterator[LLMCallTimer]:
+    """统计一次 LLM 调用的耗时与并发数"""
+    LLM_IN_FLIGHT.inc()
+    timer = LLMCallTimer()
+    try:
+        yield timer
+    finally:
+        LLM_SECONDS.labels(model).observe(timer.elapsed())
+        LLM_IN_FLIGHT.dec()
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    生成 /metrics 响应
+    
+    Returns:
+        (响应体, Content-Type)
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
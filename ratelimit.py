@@ -0,0 +1,94 @@
+"""
+限流模块
+令牌桶限流器，支持按key（如用户ID）分别限流
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """线程安全的令牌桶"""
+    
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发量）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        """补充令牌（需持有锁）"""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        尝试获取令牌，不等待
+        
+        Returns:
+            是否获取成功
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+    
+    def wait_time(self, tokens: float = 1) -> float:
+        """距离可获取 tokens 个令牌还需等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+    
+    def acquire(self, tokens: float = 1) -> None:
+        """获取令牌，不足时阻塞等待"""
+        while not self.try_acquire(tokens):
+            time.sleep(max(self.wait_time(tokens), 0.001))
+
+
+class KeyedTokenBuckets:
+    """按key分别限流的令牌桶集合，长时间未使用的桶按LRU淘汰"""
+    
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        """
+        Args:
+            rate: 每个key每秒补充的令牌数
+            capacity: 每个key的桶容量
+            max_keys: 最多保留的桶数量
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> TokenBucket:
+        """获取key对应的令牌桶"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets[key] = bucket
+                # 被淘汰的桶已长时间未使用，令牌早已补满，重建不影响限流效果
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+    
+    def try_acquire(self, key: str, tokens: float = 1) -> bool:
+        """尝试为key获取令牌，不等待"""
+        return self.get(key).try_acquire(tokens)
+    
+    def wait_time(self, key: str, tokens: float = 1) -> float:
+        """key距离可获取令牌还需等待的秒数"""
+        return self.get(key).wait_time(tokens)
@@ -0,0 +1,122 @@
+"""
+Redis连接管理模块
+进程内各组件共享同一个Redis客户端（连接池）
+
+客户端外包一层熔断：连接类错误连续达到阈值后熔断，熔断期间命令直接抛出 CircuitOpenError，
+各组件按原有的异常处理进入降级逻辑（进程内去重、进程内刷新token、对话历史进程内存储等），
+不再每个请求都等待连接超时
+"""
+import inspect
+from typing import Any, Optional
+import redis
+from redis import asyncio as aioredis
+
+from breaker import CircuitBreaker
+from config import Config
+
+_redis_client: Optional[redis.Redis] = None
+_async_redis_client: Optional[aioredis.Redis] = None
+
+# 同步与异步客户端连接同一个Redis，共用熔断状态
+redis_breaker = CircuitBreaker(
+    "redis",
+    Config.REDIS_BREAKER_FAILURE_THRESHOLD,
+    Config.REDIS_BREAKER_RESET_SECONDS
+)
+
+# 计为失败的异常：连接失败、超时（命令错误说明连接正常）
+_FAILURES = (redis.ConnectionError, redis.TimeoutError)
+
+
+async def _guard_awaitable(awaitable) -> Any:
+    """等待异步命令结果并记录熔断状态"""
+    try:
+        result = await awaitable
+    except _FAILURES:
+        redis_breaker.record_failure()
+        raise
+    redis_breaker.record_success()
+    return result
+
+
+def _guard(func):
+    """包装客户端方法：熔断期间直接拒绝，连接类错误计入失败"""
+    def call(*args, **kwargs):
+        redis_breaker.check()
+        try:
+            result = func(*args, **kwargs)
+        except _FAILURES:
+            redis_breaker.record_failure()
+            raise
+        if inspect.isawaitable(result):
+            return _guard_awaitable(result)
+        redis_breaker.record_success()
+        return result
+    return call
+
+
+class _GuardedPipeline:
+    """带熔断的pipeline，排队命令不访问网络，只在 execute 时检查"""
+    
+    def __init__(self, pipeline):
+        self._pipeline = pipeline
+        self.execute = _guard(pipeline.execute)
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pipeline, name)
+
+
+class GuardedRedis:
+    """带熔断的Redis客户端代理，接口与被包装的客户端一致（同步、异步均可）"""
+    
+    def __init__(self, client):
+        self._client = client
+    
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        guarded = _guard(attr)
+        # 缓存包装后的方法，之后的访问不再经过 __getattr__
+        setattr(self, name, guarded)
+        return guarded
+    
+    def pipeline(self, *args, **kwargs) -> _GuardedPipeline:
+        """创建带熔断的pipeline"""
+        return _GuardedPipeline(self._client.pipeline(*args, **kwargs))
+    
+    def register_script(self, script: str):
+        """注册Lua脚本，脚本调用同样经过熔断检查"""
+        registered = self._client.register_script(script)
+        registered.registered_client = self
+        return registered
+
+
+def get_redis_client() -> redis.Redis:
+    """获取共享的Redis客户端（懒加载）"""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = GuardedRedis(redis.Redis(
+            host=Config.REDIS_HOST,
+            port=Config.REDIS_PORT,
+            password=Config.REDIS_PASSWORD or None,
+            db=Config.REDIS_DB,
+            socket_connect_timeout=Config.REDIS_CONNECT_TIMEOUT_SECONDS,
+            decode_responses=True
+        ))
+    return _redis_client
+
+
+def get_async_redis_client() -> aioredis.Redis:
+    """获取共享的异步Redis客户端（懒加载，ASGI模式使用）"""
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = GuardedRedis(aioredis.Redis(
+            host=Config.REDIS_HOST,
+            port=Config.REDIS_PORT,
+            password=Config.REDIS_PASSWORD or None,
+            db=Config.REDIS_DB,
+            socket_connect_timeout=Config.REDIS_CONNECT_TIMEOUT_SECONDS,
+            decode_responses=True
+        ))
+    return _async_redis_client
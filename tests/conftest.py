@@ -0,0 +1,35 @@
+"""
+单元测试公共夹具
+用 fakeredis 代替 Redis（会话历史、去重、会话锁等依赖 Lua 脚本，需 lupa），每个测试使用独立的 FakeServer
+须在导入 config 及业务模块之前设置环境变量
+"""
+import os
+
+from benchmarks.offline import OFFLINE_ENV
+
+for _key, _value in OFFLINE_ENV.items():
+    os.environ.setdefault(_key, _value)
+
+import fakeredis
+import pytest
+
+import redis_client
+from redis_client import GuardedRedis
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """替换进程内共享的Redis客户端（同步、异步连接同一个 FakeServer），返回同步客户端"""
+    server = fakeredis.FakeServer()
+    client = GuardedRedis(fakeredis.FakeRedis(server=server, decode_responses=True))
+    try:
+        client.eval("return 1", 0)
+    except Exception as e:
+        pytest.fail(f'测试需要 fakeredis 的 Lua 支持（{e}）: pip install "fakeredis[lua]"')
+    monkeypatch.setattr(redis_client, "_redis_client", client)
+    monkeypatch.setattr(
+        redis_client,
+        "_async_redis_client",
+        GuardedRedis(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    )
+    return client
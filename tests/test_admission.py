@@ -0,0 +1,71 @@
+"""AI任务准入：积压上限、新会话份额、按近期耗时转为主动推送"""
+import pytest
+
+from ai.admission import AdmissionController
+from config import Config
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(Config, "AI_REPLY_DEADLINE_SECONDS", 4)
+    admission = AdmissionController(capacity=2)
+    admission.max_backlog = 10
+    admission.max_wait_seconds = 30
+    admission.new_session_share = 0.5
+    return admission
+
+
+def test_new_sessions_get_a_share_of_the_backlog(controller):
+    decisions = [controller.acquire(f"new-{i}") for i in range(6)]
+    assert decisions == [AdmissionController.ADMIT] * 5 + [AdmissionController.REJECT]
+
+
+def test_active_sessions_use_the_full_backlog(controller):
+    controller.acquire("alice")
+    controller.release()
+    for i in range(5):
+        controller.acquire(f"new-{i}")
+    
+    # 新会话已用满份额，近期有过对话的会话仍可准入
+    assert controller.acquire("bob") == AdmissionController.REJECT
+    assert [controller.acquire("alice") for _ in range(6)] == [AdmissionController.ADMIT] * 5 + [AdmissionController.REJECT]
+
+
+def test_release_frees_a_slot(controller):
+    for i in range(5):
+        controller.acquire(f"new-{i}")
+    assert controller.acquire("late") == AdmissionController.REJECT
+    
+    controller.release()
+    assert controller.acquire("late") == AdmissionController.ADMIT
+
+
+def test_slow_backlog_defers_to_active_push(controller):
+    controller.acquire("alice")
+    controller.release(elapsed=3)
+    
+    # 满并发前预计 3 秒完成，之后需等待一轮，预计 6 秒超出被动回复时限
+    decisions = [controller.acquire("alice") for _ in range(4)]
+    assert decisions == [AdmissionController.ADMIT] * 2 + [AdmissionController.DEFER] * 2
+
+
+def test_limit_follows_recent_latency(controller):
+    controller.max_wait_seconds = 6
+    controller.acquire("alice")
+    controller.release(elapsed=3)
+    
+    # 6 秒内 2 个并发只能完成 4 个任务
+    assert controller.stats()["limit"] == 4
+    decisions = [controller.acquire("alice") for _ in range(5)]
+    assert decisions[-1] == AdmissionController.REJECT
+    assert AdmissionController.REJECT not in decisions[:-1]
+
+
+def test_running_records_latency_and_releases(controller):
+    assert controller.acquire("alice") == AdmissionController.ADMIT
+    with controller.running():
+        pass
+    
+    stats = controller.stats()
+    assert stats["backlog"] == 0
+    assert stats["latency_seconds"] is not None
@@ -0,0 +1,115 @@
+"""企业微信API客户端：限频错误码退避重试，传输层只重试不会造成重复调用的情况"""
+import asyncio
+
+import httpx
+import pytest
+
+from wecom.message import AsyncWeComApiClient, WeComApiClient
+
+
+class _FakeResponse:
+    def __init__(self, data: dict):
+        self._data = data
+    
+    def json(self) -> dict:
+        return self._data
+
+
+def test_transport_retry_is_limited_to_get():
+    retry = WeComApiClient(max_retries=3, backoff_seconds=0).session.get_adapter("https://qyapi").max_retries
+    
+    assert retry.total == 3
+    assert retry.is_retry("GET", 502)
+    # 读超时或5xx时 message/send 可能已被处理，不能重发
+    assert not retry.is_retry("POST", 502)
+
+
+def test_rate_limit_errcode_is_retried(monkeypatch):
+    client = WeComApiClient(max_retries=2, backoff_seconds=0)
+    responses = [{"errcode": 45009}, {"errcode": -1}, {"errcode": 0}]
+    calls = []
+    
+    def request(method, url, **kwargs):
+        calls.append(method)
+        return _FakeResponse(responses[len(calls) - 1])
+    
+    monkeypatch.setattr(client.session, "request", request)
+    # 限频错误码表示请求被拒绝、未被处理，POST 同样可以重试
+    assert client.post("/cgi-bin/message/send", json={}) == {"errcode": 0}
+    assert calls == ["POST"] * 3
+
+
+def _async_client(handler) -> AsyncWeComApiClient:
+    client = AsyncWeComApiClient(base_url="https://qyapi.test", max_retries=2, backoff_seconds=0)
+    client.client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    return client
+
+
+def _run(client: AsyncWeComApiClient, method: str):
+    async def call():
+        try:
+            return await client.request(method, "/cgi-bin/test")
+        finally:
+            await client.aclose()
+    return asyncio.run(call())
+
+
+def test_async_get_retries_server_errors():
+    calls = []
+    
+    def handler(request):
+        calls.append(request.method)
+        if len(calls) < 3:
+            return httpx.Response(502, json={"errcode": -1})
+        return httpx.Response(200, json={"errcode": 0})
+    
+    assert _run(_async_client(handler), "GET") == {"errcode": 0}
+    assert len(calls) == 3
+
+
+def test_async_post_is_not_retried_after_it_was_sent():
+    calls = []
+    
+    def server_error(request):
+        calls.append(request.method)
+        return httpx.Response(502, json={"errcode": 500})
+    
+    assert _run(_async_client(server_error), "POST") == {"errcode": 500}
+    assert len(calls) == 1
+    
+    def read_timeout(request):
+        calls.append(request.method)
+        raise httpx.ReadTimeout("timed out", request=request)
+    
+    with pytest.raises(httpx.ReadTimeout):
+        _run(_async_client(read_timeout), "POST")
+    assert len(calls) == 2
+
+
+def test_async_post_retries_connect_errors():
+    calls = []
+    
+    def handler(request):
+        calls.append(request.method)
+        if len(calls) == 1:
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"errcode": 0})
+    
+    assert _run(_async_client(handler), "POST") == {"errcode": 0}
+    assert len(calls) == 2
+
+
+def test_errcode_backoff_has_jitter(monkeypatch):
+    client = WeComApiClient(max_retries=3, backoff_seconds=1)
+    delays = []
+    monkeypatch.setattr(client.session, "request", lambda method, url, **kwargs: _FakeResponse({"errcode": 45009}))
+    monkeypatch.setattr("wecom.message.time.sleep", delays.append)
+    
+    for _ in range(20):
+        client.post("/cgi-bin/message/send", json={})
+    
+    # 第 n 次重试等待 2^n 秒乘以 0.5~1.5 的随机系数，多个worker不会在同一时刻重试
+    for attempt in range(3):
+        samples = delays[attempt::3]
+        assert all(0.5 * 2 ** attempt <= d <= 1.5 * 2 ** attempt for d in samples)
+        assert len(set(samples)) > 1
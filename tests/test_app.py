@@ -0,0 +1,147 @@
+"""Flask回调：时限内被动回复、超时转主动推送，以及消息去重的完成与释放"""
+import threading
+import time
+
+import pytest
+
+import app as flask_app
+from ai.scheduler import FairScheduler
+from config import Config
+from wecom.crypto import WXBizMsgCrypt
+from wecom.dedup import MessageDeduplicator
+from wecom.message import MessageHandler
+from wecom.parser import parse_fields
+
+NONCE = "nonce123"
+TIMESTAMP = "1700000000"
+
+USER_MESSAGE = """<xml>
+<ToUserName><![CDATA[{corp_id}]]></ToUserName>
+<FromUserName><![CDATA[zhangsan]]></FromUserName>
+<CreateTime>1700000000</CreateTime>
+<MsgType><![CDATA[text]]></MsgType>
+<Content><![CDATA[你好]]></Content>
+<MsgId>{msg_id}</MsgId>
+<AgentID>{agent_id}</AgentID>
+</xml>"""
+
+
+class _FakeChat:
+    """按设定耗时返回固定回复的对话服务"""
+    
+    def __init__(self, delay: float = 0.0, reply: str = "answer"):
+        self.delay = delay
+        self.reply = reply
+        self.calls = 0
+    
+    def chat(self, session_id: str, user_input: str) -> str:
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.reply
+
+
+class _FakeOutbound:
+    """记录主动推送"""
+    
+    def __init__(self):
+        self.sent = []
+        self.event = threading.Event()
+    
+    def submit(self, user_id: str, content: str) -> None:
+        self.sent.append((user_id, content))
+        self.event.set()
+
+
+@pytest.fixture
+def bot(fake_redis, monkeypatch):
+    """以假对话服务和假主动推送替换 app 的组件，返回 Flask 测试客户端"""
+    monkeypatch.setattr(Config, "AI_REPLY_DEADLINE_SECONDS", 0.2)
+    monkeypatch.setattr(Config, "AI_STREAM_ENABLED", False)
+    crypto = WXBizMsgCrypt(Config.WECOM_TOKEN, Config.WECOM_ENCODING_AES_KEY, Config.WECOM_CORP_ID)
+    chat = _FakeChat()
+    outbound = _FakeOutbound()
+    for name, value in {
+        "crypto": crypto,
+        "message_handler": MessageHandler(),
+        "deduplicator": MessageDeduplicator(),
+        "chat_service": chat,
+        "ai_scheduler": FairScheduler(2),
+        "outbound": outbound,
+        "admission": None,
+        "reply_queue": None,
+        "debouncer": None,
+        "recorder": None,
+    }.items():
+        monkeypatch.setattr(flask_app, name, value)
+    
+    client = flask_app.app.test_client()
+    client.crypto, client.chat, client.outbound = crypto, chat, outbound
+    return client
+
+
+def _post(client, msg_id: str = "10001"):
+    xml = USER_MESSAGE.format(corp_id=Config.WECOM_CORP_ID, agent_id=Config.WECOM_AGENT_ID, msg_id=msg_id)
+    _, body = client.crypto.encrypt_msg(xml, NONCE, TIMESTAMP)
+    signature = parse_fields(body)["MsgSignature"]
+    return client.post(
+        "/wecom/callback",
+        query_string={"msg_signature": signature, "timestamp": TIMESTAMP, "nonce": NONCE},
+        data=body.encode("utf-8")
+    )
+
+
+def _decrypt_reply(client, response) -> str:
+    body = response.get_data(as_text=True)
+    ret, xml = client.crypto.decrypt_msg(body, parse_fields(body)["MsgSignature"], TIMESTAMP, NONCE)
+    assert ret == WXBizMsgCrypt.WXBizMsgCrypt_OK
+    return parse_fields(xml)["Content"]
+
+
+def test_passive_reply_within_deadline(bot):
+    response = _post(bot)
+    
+    assert response.headers["Content-Type"] == "application/xml"
+    assert _decrypt_reply(bot, response) == "answer"
+    assert bot.outbound.sent == []
+    
+    # 企业微信重试同一消息：重放被动回复，不再调用AI
+    retry = _post(bot)
+    assert _decrypt_reply(bot, retry) == "answer"
+    assert bot.chat.calls == 1
+
+
+def test_slow_reply_is_pushed_after_deadline(bot):
+    bot.chat.delay = 0.5
+    started_at = time.monotonic()
+    response = _post(bot)
+    
+    # 超过时限先返回 success，消息标记为已完成（不含可重放的回复）
+    assert response.get_data(as_text=True) == "success"
+    assert time.monotonic() - started_at < 0.5
+    assert flask_app.deduplicator.begin("10001") == (MessageDeduplicator.STATUS_DONE, None)
+    assert _post(bot).get_data(as_text=True) == "success"
+    
+    # AI回复生成后通过主动消息推送，且只推送一次
+    assert bot.outbound.event.wait(timeout=2)
+    assert bot.outbound.sent == [("zhangsan", "answer")]
+    assert bot.chat.calls == 1
+
+
+def test_failed_reply_releases_claim(bot, monkeypatch):
+    build_text_reply = flask_app.message_handler.build_text_reply
+    failures = []
+    
+    def flaky_build(**kwargs):
+        if not failures:
+            failures.append(kwargs)
+            raise RuntimeError("boom")
+        return build_text_reply(**kwargs)
+    
+    monkeypatch.setattr(flask_app.message_handler, "build_text_reply", flaky_build)
+    monkeypatch.setattr(flask_app.app, "testing", False)
+    
+    # 处理异常时释放认领，企业微信的重试重新处理该消息
+    assert _post(bot).status_code == 500
+    retry = _post(bot)
+    assert _decrypt_reply(bot, retry) == "answer"
+    assert bot.chat.calls == 2
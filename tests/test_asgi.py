@@ -0,0 +1,174 @@
+"""ASGI应用：URL验证、去重与被动回复时限、超时转主动推送、会话接口"""
+import asyncio
+import time
+from typing import Optional
+from urllib.parse import urlencode
+
+import pytest
+
+from ai.history import ConversationHistory
+from ai.scheduler import AsyncFairScheduler
+from asgi import WeComBotApp
+from config import Config
+from wecom.crypto import WXBizMsgCrypt
+from wecom.dedup import MessageDeduplicator
+from wecom.message import MessageHandler
+from wecom.parser import parse_fields
+from wecom.sender import AsyncOutboundScheduler
+
+NONCE = "nonce123"
+TIMESTAMP = "1700000000"
+
+USER_MESSAGE = """<xml>
+<ToUserName><![CDATA[{corp_id}]]></ToUserName>
+<FromUserName><![CDATA[zhangsan]]></FromUserName>
+<CreateTime>1700000000</CreateTime>
+<MsgType><![CDATA[text]]></MsgType>
+<Content><![CDATA[你好]]></Content>
+<MsgId>{msg_id}</MsgId>
+<AgentID>{agent_id}</AgentID>
+</xml>"""
+
+
+class _FakeChat:
+    """按设定耗时返回固定回复的对话服务，历史使用真实的 ConversationHistory"""
+    
+    def __init__(self):
+        self.delay = 0.0
+        self.calls = 0
+        self.history = ConversationHistory()
+    
+    async def achat(self, session_id: str, user_input: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return "answer"
+
+
+class _FakeSender:
+    """记录主动推送的消息处理器"""
+    
+    def __init__(self):
+        self.sent = []
+    
+    async def asend_text_batch(self, user_ids, content) -> bool:
+        self.sent.extend((user_id, content) for user_id in user_ids)
+        return True
+
+
+@pytest.fixture
+def bot(fake_redis, monkeypatch):
+    """以假对话服务替换AI调用、以假发送接口替换主动推送的 ASGI 应用"""
+    monkeypatch.setattr(Config, "AI_REPLY_DEADLINE_SECONDS", 0.2)
+    monkeypatch.setattr(Config, "AI_STREAM_ENABLED", False)
+    monkeypatch.setattr(Config, "WECOM_SEND_BATCH_WINDOW_MS", 0)
+    bot = WeComBotApp()
+    bot.crypto = WXBizMsgCrypt(Config.WECOM_TOKEN, Config.WECOM_ENCODING_AES_KEY, Config.WECOM_CORP_ID)
+    bot.message_handler = MessageHandler()
+    bot.deduplicator = MessageDeduplicator()
+    bot.chat_service = _FakeChat()
+    bot.ai_scheduler = AsyncFairScheduler(2)
+    bot.sender = _FakeSender()
+    bot.outbound = AsyncOutboundScheduler(bot.sender)
+    return bot
+
+
+async def _call(bot: WeComBotApp, method: str, path: str, query: Optional[dict] = None, body: bytes = b""):
+    """以进程内ASGI调用发送请求，返回 (状态码, Content-Type, 响应体)"""
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": urlencode(query or {}).encode("ascii")
+    }
+    received = []
+    
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+    
+    async def send(message):
+        received.append(message)
+    
+    await bot(scope, receive, send)
+    headers = dict(received[0]["headers"])
+    return received[0]["status"], headers[b"content-type"].decode(), received[1]["body"]
+
+
+async def _post_message(bot: WeComBotApp, msg_id: str = "10001"):
+    xml = USER_MESSAGE.format(corp_id=Config.WECOM_CORP_ID, agent_id=Config.WECOM_AGENT_ID, msg_id=msg_id)
+    _, body = bot.crypto.encrypt_msg(xml, NONCE, TIMESTAMP)
+    query = {"msg_signature": parse_fields(body)["MsgSignature"], "timestamp": TIMESTAMP, "nonce": NONCE}
+    return await _call(bot, "POST", "/wecom/callback", query, body.encode("utf-8"))
+
+
+def _decrypt_reply(bot: WeComBotApp, body: bytes) -> str:
+    text = body.decode("utf-8")
+    ret, xml = bot.crypto.decrypt_msg(text, parse_fields(text)["MsgSignature"], TIMESTAMP, NONCE)
+    assert ret == WXBizMsgCrypt.WXBizMsgCrypt_OK
+    return parse_fields(xml)["Content"]
+
+
+def test_url_verification(bot):
+    _, echo = bot.crypto.encrypt_msg("echo-123", NONCE, TIMESTAMP)
+    fields = parse_fields(echo)
+    query = {"msg_signature": fields["MsgSignature"], "timestamp": TIMESTAMP, "nonce": NONCE, "echostr": fields["Encrypt"]}
+    
+    assert asyncio.run(_call(bot, "GET", "/wecom/callback", query))[2] == b"echo-123"
+    
+    query["msg_signature"] = "bad"
+    assert asyncio.run(_call(bot, "GET", "/wecom/callback", query))[0] == 403
+
+
+def test_passive_reply_and_replay(bot):
+    async def run():
+        first = await _post_message(bot)
+        retry = await _post_message(bot)
+        return first, retry
+    
+    first, retry = asyncio.run(run())
+    assert first[:2] == (200, "application/xml")
+    assert _decrypt_reply(bot, first[2]) == "answer"
+    # 企业微信重试同一消息：重放被动回复，不再调用AI
+    assert _decrypt_reply(bot, retry[2]) == "answer"
+    assert bot.chat_service.calls == 1
+    assert bot.sender.sent == []
+
+
+def test_slow_reply_is_pushed_after_deadline(bot):
+    bot.chat_service.delay = 0.5
+    
+    async def run():
+        started_at = time.monotonic()
+        first = await _post_message(bot)
+        elapsed = time.monotonic() - started_at
+        retry = await _post_message(bot)
+        await asyncio.wait(bot._tasks, timeout=2)
+        assert await bot.outbound.drain(timeout=2)
+        return first, elapsed, retry
+    
+    first, elapsed, retry = asyncio.run(run())
+    assert first[2] == b"success"
+    assert elapsed < 0.5
+    assert retry[2] == b"success"
+    # AI回复生成后经主动消息调度器推送，且只推送一次
+    assert bot.sender.sent == [("zhangsan", "answer")]
+    assert bot.chat_service.calls == 1
+
+
+def test_session_endpoints(bot):
+    bot.chat_service.history.add_turn("zhangsan", "q", "a")
+    
+    async def run():
+        info = await _call(bot, "GET", "/session/zhangsan")
+        cleared = await _call(bot, "DELETE", "/session/zhangsan")
+        empty_id = await _call(bot, "GET", "/session/")
+        nested_id = await _call(bot, "GET", "/session/a/b")
+        wrong_method = await _call(bot, "POST", "/session/zhangsan")
+        return info, cleared, empty_id, nested_id, wrong_method
+    
+    info, cleared, empty_id, nested_id, wrong_method = asyncio.run(run())
+    assert info[0] == 200 and b'"message_count": 2' in info[2]
+    assert cleared[0] == 200
+    assert bot.chat_service.history.get_messages("zhangsan") == []
+    assert empty_id[0] == 404
+    assert nested_id[0] == 404
+    assert wrong_method[0] == 405
@@ -0,0 +1,122 @@
+"""熔断器状态切换，以及Redis不可用时对话历史与会话锁的降级"""
+import time
+
+import fakeredis
+import pytest
+import redis
+
+import redis_client
+from ai.history import ConversationHistory
+from ai.session_lock import SessionBusyError, SessionLock
+from breaker import CircuitBreaker, CircuitOpenError
+from redis_client import GuardedRedis
+
+
+@pytest.fixture
+def redis_down(monkeypatch):
+    """Redis连接失败：命令抛出 ConnectionError，连续失败2次后熔断"""
+    server = fakeredis.FakeServer()
+    server.connected = False
+    breaker = CircuitBreaker("redis-test", failure_threshold=2, reset_seconds=60)
+    monkeypatch.setattr(redis_client, "redis_breaker", breaker)
+    monkeypatch.setattr(redis_client, "_redis_client", GuardedRedis(fakeredis.FakeRedis(server=server)))
+    monkeypatch.setattr(
+        redis_client,
+        "_async_redis_client",
+        GuardedRedis(fakeredis.FakeAsyncRedis(server=server))
+    )
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    
+    # 成功调用清零连续失败次数
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_half_open_probe_closes_or_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    
+    # 冷却时间过后只放行一个探测请求
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    
+    # 探测失败重新熔断
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    
+    # 探测成功恢复
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_half_open_releases_another_probe_when_result_is_lost():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    
+    # 探测请求一直未上报结果，冷却时间过后再放行一个
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+
+def test_guarded_redis_opens_on_connection_errors(redis_down):
+    client = redis_client.get_redis_client()
+    for _ in range(2):
+        with pytest.raises(redis.ConnectionError):
+            client.get("key")
+    
+    # 熔断后直接拒绝，不再尝试连接
+    assert redis_down.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.get("key")
+
+
+def test_history_falls_back_to_local_storage(redis_down):
+    history = ConversationHistory()
+    
+    assert history.add_turn("s1", "q1", "a1") == 0
+    assert [m.content for m in history.get_messages("s1")] == ["q1", "a1"]
+    
+    # 熔断后同样读写进程内历史
+    history.add_turn("s1", "q2", "a2")
+    assert redis_down.state == CircuitBreaker.OPEN
+    assert [m.content for m in history.get_messages("s1")] == ["q1", "a1", "q2", "a2"]
+    assert history.get_context("s2") == (None, [])
+
+
+def test_session_lock_degrades_to_local_lock(redis_down):
+    lock = SessionLock()
+    lock.wait_seconds = 0.1
+    
+    # Redis不可用时没有栅栏令牌，仅使用进程内锁
+    with lock.hold("s1") as token:
+        assert token is None
+        with pytest.raises(SessionBusyError):
+            with lock.hold("s1"):
+                pass
+    
+    with lock.hold("s1") as token:
+        assert token is None
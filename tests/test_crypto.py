@@ -0,0 +1,78 @@
+"""消息加解密：与重写前的实现逐字节一致，复用的CBC对象在多条消息、多线程间输出正确"""
+import random
+import threading
+
+import pytest
+
+from benchmarks.crypto_bench import ENCODING_AES_KEY, TOKEN, LegacyCrypt, check_compat
+from wecom.crypto import _ECB_DECRYPT_MAX_BYTES, WXBizMsgCrypt
+
+CORP_ID = "ww1234567890abcdef"
+
+# 覆盖填充块边界与 ECB/CBC 解密路径的分界
+SIZES = [0, 1, 11, 12, 13, 31, 32, 33, 500, _ECB_DECRYPT_MAX_BYTES - 100, _ECB_DECRYPT_MAX_BYTES, 8192]
+
+
+def _text(size: int) -> str:
+    return ("企业微信消息<xml>]]>" * (size // 10 + 1))[:size]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_roundtrip_with_legacy(size):
+    current = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, CORP_ID)
+    legacy = LegacyCrypt(TOKEN, ENCODING_AES_KEY, CORP_ID)
+    text = _text(size)
+    
+    # 同一个对象连续加密多条，复用的CBC对象不影响输出
+    for _ in range(3):
+        random.seed(size)
+        expected = legacy._encrypt(text)
+        random.seed(size)
+        assert current._encrypt(text) == expected
+        assert current._decrypt(expected[1]) == (WXBizMsgCrypt.WXBizMsgCrypt_OK, text)
+        assert legacy._decrypt(current._encrypt(text)[1]) == (WXBizMsgCrypt.WXBizMsgCrypt_OK, text)
+
+
+def test_other_corp_id_rejected():
+    current = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, CORP_ID)
+    _, encrypted = LegacyCrypt(TOKEN, ENCODING_AES_KEY, "other-corp")._encrypt("hello")
+    
+    assert current._decrypt(encrypted) == (WXBizMsgCrypt.WXBizMsgCrypt_ValidateCorpid_Error, None)
+
+
+def test_random_corpus_matches_legacy():
+    assert check_compat(300, seed=2024) == 0
+
+
+def test_encrypt_msg_decrypt_msg_roundtrip():
+    crypt = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, CORP_ID)
+    reply = "<xml><Content><![CDATA[你好]]></Content></xml>"
+    
+    ret, resp_xml = crypt.encrypt_msg(reply, "nonce", "1700000000")
+    assert ret == WXBizMsgCrypt.WXBizMsgCrypt_OK
+    signature = resp_xml.split("<MsgSignature><![CDATA[")[1].split("]]>")[0]
+    
+    assert crypt.decrypt_msg(resp_xml, signature, "1700000000", "nonce") == (WXBizMsgCrypt.WXBizMsgCrypt_OK, reply)
+    assert crypt.decrypt_msg(resp_xml, "bad", "1700000000", "nonce")[0] == WXBizMsgCrypt.WXBizMsgCrypt_ValidateSignature_Error
+
+
+def test_threads_share_one_instance():
+    crypt = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, CORP_ID)
+    legacy = LegacyCrypt(TOKEN, ENCODING_AES_KEY, CORP_ID)
+    errors = []
+    
+    def worker(index: int) -> None:
+        for i in range(200):
+            text = _text((index * 37 + i * 13) % 4096)
+            ret, encrypted = crypt._encrypt(text)
+            if ret != WXBizMsgCrypt.WXBizMsgCrypt_OK or legacy._decrypt(encrypted) != (ret, text):
+                errors.append((index, i))
+            if crypt._decrypt(encrypted) != (ret, text):
+                errors.append((index, i))
+    
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
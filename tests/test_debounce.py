@@ -0,0 +1,90 @@
+"""消息合并：窗口期内只由最后一条消息负责合并，序号变化时放弃"""
+import asyncio
+import threading
+import time
+
+from wecom.debounce import MessageDebouncer
+from wecom.message import WeChatMessage
+
+
+def _message(content: str, msg_id: str, user_id: str = "alice") -> WeChatMessage:
+    return WeChatMessage(
+        to_user_name="corp",
+        from_user_name=user_id,
+        create_time=0,
+        msg_type="text",
+        content=content,
+        msg_id=msg_id,
+        agent_id="1000001"
+    )
+
+
+def test_stale_take_loses_to_newer_message(fake_redis):
+    # 两个进程各收到一条消息，先到期的一方发现序号已变化，放弃合并
+    worker_a = MessageDebouncer(window_seconds=1, max_messages=10)
+    worker_b = MessageDebouncer(window_seconds=1, max_messages=10)
+    first, second = _message("m1", "1"), _message("m2", "2")
+    
+    assert worker_a._push(first) == (1, 1)
+    assert worker_b._push(second) == (2, 2)
+    
+    assert worker_a._take(first, 1) is None
+    merged = worker_b._take(second, 2)
+    assert merged.content == "m1\nm2"
+    assert merged.msg_id == "2"
+    # 已取出的消息不会被再次合并
+    assert worker_b._take(second, 2) is None
+
+
+def test_other_users_are_not_merged(fake_redis):
+    debouncer = MessageDebouncer(window_seconds=1, max_messages=10)
+    alice, bob = _message("a", "1", "alice"), _message("b", "2", "bob")
+    
+    seq_a, _ = debouncer._push(alice)
+    seq_b, _ = debouncer._push(bob)
+    
+    assert debouncer._take(alice, seq_a).content == "a"
+    assert debouncer._take(bob, seq_b).content == "b"
+
+
+def test_submit_replies_once_per_burst(fake_redis):
+    debouncer = MessageDebouncer(window_seconds=0.2, max_messages=10)
+    handled = []
+    done = threading.Event()
+    
+    def handler(msg: WeChatMessage) -> None:
+        handled.append(msg.content)
+        done.set()
+    
+    for i in range(3):
+        debouncer.submit(_message(f"m{i}", str(i)), handler)
+    
+    assert done.wait(2)
+    # 等待其余消息的窗口期结束，确认它们都已放弃
+    time.sleep(0.3)
+    assert handled == ["m0\nm1\nm2"]
+
+
+def test_submit_flushes_at_max_messages(fake_redis):
+    debouncer = MessageDebouncer(window_seconds=60, max_messages=2)
+    handled = []
+    
+    debouncer.submit(_message("m1", "1"), handled.append)
+    debouncer.submit(_message("m2", "2"), handled.append)
+    
+    # 达到上限的消息在当前线程中立即合并，不等待窗口期
+    assert [msg.content for msg in handled] == ["m1\nm2"]
+
+
+def test_asubmit_only_latest_message_replies(fake_redis):
+    debouncer = MessageDebouncer(window_seconds=0.2, max_messages=10)
+    
+    async def burst():
+        first = asyncio.create_task(debouncer.asubmit(_message("m1", "1")))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(debouncer.asubmit(_message("m2", "2")))
+        return await first, await second
+    
+    first, second = asyncio.run(burst())
+    assert first is None
+    assert second.content == "m1\nm2"
@@ -0,0 +1,68 @@
+"""回调去重：处理中/已完成状态、被动回复重放、处理失败释放与处理中标记过期"""
+import time
+
+from wecom.dedup import MessageDeduplicator
+
+
+def test_in_flight_then_done_replay(fake_redis):
+    worker_a = MessageDeduplicator()
+    worker_b = MessageDeduplicator()
+    
+    assert worker_a.begin("m1") == (MessageDeduplicator.STATUS_NEW, None)
+    # 其他worker收到重试时处理仍在进行
+    assert worker_b.begin("m1") == (MessageDeduplicator.STATUS_IN_FLIGHT, None)
+    
+    worker_a.finish("m1", "<xml>reply</xml>")
+    # 处理完成后收到的重试直接重放被动回复
+    assert MessageDeduplicator().begin("m1") == (MessageDeduplicator.STATUS_DONE, "<xml>reply</xml>")
+    assert worker_a.begin("m1") == (MessageDeduplicator.STATUS_DONE, "<xml>reply</xml>")
+
+
+def test_done_without_reply(fake_redis):
+    dedup = MessageDeduplicator()
+    dedup.begin("m1")
+    dedup.finish("m1")
+    
+    assert MessageDeduplicator().begin("m1") == (MessageDeduplicator.STATUS_DONE, None)
+
+
+def test_in_flight_marker_uses_short_ttl(fake_redis):
+    dedup = MessageDeduplicator(ttl_seconds=300, in_flight_ttl_seconds=5)
+    dedup.begin("m1")
+    assert 0 < fake_redis.pttl("wecom:msg:dedup:m1") <= 5000
+    
+    dedup.finish("m1", "reply")
+    # 处理完成后延长为完整的保留时长
+    assert 5 < fake_redis.ttl("wecom:msg:dedup:m1") <= 300
+
+
+def test_expired_in_flight_marker_can_be_reclaimed(fake_redis):
+    # 处理中的进程崩溃：标记很快过期，企业微信的重试可以重新处理
+    MessageDeduplicator(in_flight_ttl_seconds=0.2).begin("m1")
+    retry = MessageDeduplicator()
+    assert retry.begin("m1")[0] == MessageDeduplicator.STATUS_IN_FLIGHT
+    
+    time.sleep(0.3)
+    assert MessageDeduplicator().begin("m1") == (MessageDeduplicator.STATUS_NEW, None)
+
+
+def test_abort_releases_claim(fake_redis):
+    dedup = MessageDeduplicator()
+    assert dedup.begin("m1")[0] == MessageDeduplicator.STATUS_NEW
+    dedup.abort("m1")
+    
+    # 本进程与其他进程的重试都可以重新处理
+    assert dedup.begin("m1") == (MessageDeduplicator.STATUS_NEW, None)
+    dedup.abort("m1")
+    assert MessageDeduplicator().begin("m1") == (MessageDeduplicator.STATUS_NEW, None)
+
+
+def test_abort_keeps_finished_message(fake_redis):
+    dedup = MessageDeduplicator()
+    dedup.begin("m1")
+    dedup.finish("m1", "reply")
+    dedup.abort("m1")
+    
+    assert MessageDeduplicator().begin("m1") == (MessageDeduplicator.STATUS_DONE, "reply")
+    assert dedup.begin("m1") == (MessageDeduplicator.STATUS_DONE, "reply")
+
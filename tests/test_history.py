@@ -0,0 +1,139 @@
+"""对话历史：列表追加与裁剪、旧版整段JSON数据的迁移"""
+import json
+
+from langchain_core.messages import AIMessage, HumanMessage, messages_to_dict
+
+from ai.history import ConversationHistory
+from config import Config
+
+LEGACY_KEY = "wecom:chat:history:s1"
+LIST_KEY = "wecom:chat:messages:s1"
+
+
+def _contents(messages) -> list:
+    return [m.content for m in messages]
+
+
+def test_add_turn_appends_and_trims(fake_redis, monkeypatch):
+    monkeypatch.setattr(Config, "CONVERSATION_MAX_HISTORY", 4)
+    history = ConversationHistory()
+    
+    assert history.add_turn("s1", "q1", "a1") == 2
+    assert history.add_turn("s1", "q2", "a2") == 4
+    assert history.add_turn("s1", "q3", "a3") == 4
+    
+    assert _contents(history.get_messages("s1")) == ["q2", "a2", "q3", "a3"]
+    assert 0 < fake_redis.ttl(LIST_KEY) <= Config.CONVERSATION_TTL_SECONDS
+
+
+def test_legacy_history_is_migrated_on_read(fake_redis):
+    legacy = [HumanMessage(content="old question"), AIMessage(content="old answer")]
+    fake_redis.set(LEGACY_KEY, json.dumps(messages_to_dict(legacy)), ex=600)
+    history = ConversationHistory()
+    
+    assert _contents(history.get_messages("s1")) == ["old question", "old answer"]
+    assert not fake_redis.exists(LEGACY_KEY)
+    assert 0 < fake_redis.ttl(LIST_KEY) <= 600
+    
+    # 迁移后按列表格式继续追加
+    history.add_turn("s1", "q", "a")
+    assert _contents(ConversationHistory().get_messages("s1")) == ["old question", "old answer", "q", "a"]
+
+
+def test_legacy_messages_go_before_new_ones(fake_redis):
+    # 读取旧数据与执行迁移之间其他进程已追加新消息：旧消息插入到列表头部
+    legacy = [HumanMessage(content="old question"), AIMessage(content="old answer")]
+    fake_redis.set(LEGACY_KEY, json.dumps(messages_to_dict(legacy)))
+    history = ConversationHistory()
+    history.add_turn("s1", "q", "a")
+    
+    assert history._migrate_legacy("s1")
+    assert not history._migrate_legacy("s1")
+    assert _contents(ConversationHistory().get_messages("s1")) == ["old question", "old answer", "q", "a"]
+
+
+def test_migration_runs_once(fake_redis):
+    fake_redis.set(LEGACY_KEY, json.dumps(messages_to_dict([HumanMessage(content="old")])))
+    first, second = ConversationHistory(), ConversationHistory()
+    
+    assert _contents(first.get_messages("s1")) == ["old"]
+    assert _contents(second.get_messages("s1")) == ["old"]
+    assert fake_redis.llen(LIST_KEY) == 1
+
+
+def test_apply_summary_replaces_oldest_messages(fake_redis):
+    history = ConversationHistory()
+    for i in range(3):
+        history.add_turn("s1", f"q{i}", f"a{i}")
+    
+    items, messages = history.get_oldest("s1", 4)
+    assert _contents(messages) == ["q0", "a0", "q1", "a1"]
+    assert history.apply_summary("s1", items, "summary of q0-a1")
+    
+    # 其他进程缓存的窗口随版本号失效
+    summary, messages = ConversationHistory().get_context("s1")
+    assert summary == "summary of q0-a1"
+    assert _contents(messages) == ["q2", "a2"]
+    assert history.get_context("s1") == (summary, messages)
+
+
+def test_apply_summary_gives_up_when_history_changed(fake_redis, monkeypatch):
+    monkeypatch.setattr(Config, "CONVERSATION_MAX_HISTORY", 6)
+    history = ConversationHistory()
+    for i in range(3):
+        history.add_turn("s1", f"q{i}", f"a{i}")
+    items, _ = history.get_oldest("s1", 4)
+    
+    # 摘要生成期间新消息使最早的消息被裁剪
+    history.add_turn("s1", "q3", "a3")
+    assert not history.apply_summary("s1", items, "stale summary")
+    assert history.get_summary("s1") is None
+    
+    # 摘要生成期间历史被清除
+    items, _ = history.get_oldest("s1", 4)
+    history.clear_history("s1")
+    assert not history.apply_summary("s1", items, "stale summary")
+    assert history.get_context("s1") == (None, [])
+
+
+def test_window_keeps_latest_turn_over_budget(fake_redis):
+    history = ConversationHistory()
+    history.add_turn("s1", "q0", "a0")
+    history.add_turn("s1", "q1", "x" * 400)
+    
+    # 最近一轮单独超出预算时仍完整保留，更早的消息不再选入
+    assert _contents(history.get_messages("s1", max_tokens=50)) == ["q1", "x" * 400]
+    
+    history.add_turn("s1", "长" * 100, "a2")
+    assert _contents(history.get_messages("s1", max_tokens=50)) == ["长" * 100, "a2"]
+    assert _contents(history.get_messages("s1", max_tokens=10_000)) == ["q0", "a0", "q1", "x" * 400, "长" * 100, "a2"]
+
+
+def test_window_reports_stored_length(fake_redis):
+    history = ConversationHistory()
+    for i in range(3):
+        history.add_turn("s1", f"q{i}", "x" * 400)
+    
+    # 窗口按预算裁剪，但保存的消息数反映会话的完整上下文（用于判断能否使用回复缓存）
+    summary, messages, length = history.get_window("s1", max_tokens=50)
+    assert _contents(messages) == ["q2", "x" * 400]
+    assert length == 6
+
+
+def test_writes_from_another_instance_invalidate_local_cache(fake_redis, monkeypatch):
+    monkeypatch.setattr(Config, "CONVERSATION_LOCAL_CACHE_ENABLED", True)
+    local, other = ConversationHistory(), ConversationHistory()
+    local.add_turn("s1", "q0", "a0")
+    assert _contents(local.get_messages("s1")) == ["q0", "a0"]
+    assert local._local.get("s1") is not None
+    
+    # 其他进程追加消息使版本号递增，本进程LRU中的旧窗口不再使用
+    other.add_turn("s1", "q1", "a1")
+    assert _contents(local.get_messages("s1")) == ["q0", "a0", "q1", "a1"]
+    
+    # 其他进程清除历史同样递增版本号
+    other.clear_history("s1")
+    assert local.get_messages("s1") == []
+    
+    other.add_turn("s1", "q2", "a2")
+    assert _contents(local.get_messages("s1")) == ["q2", "a2"]
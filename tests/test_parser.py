@@ -0,0 +1,70 @@
+"""回调XML解析：拒绝实体膨胀、外部实体和超长报文，正常消息照常解析"""
+import pytest
+from lxml import etree
+
+from config import Config
+from wecom.message import MessageHandler
+from wecom.parser import XMLRejectedError, extract_encrypt, parse_fields
+
+TEXT_MESSAGE = """<xml>
+<ToUserName><![CDATA[ww1234567890abcdef]]></ToUserName>
+<FromUserName><![CDATA[zhangsan]]></FromUserName>
+<CreateTime>1700000000</CreateTime>
+<MsgType><![CDATA[text]]></MsgType>
+<Content><![CDATA[你好 <b>]]]]><![CDATA[></b>]]></Content>
+<MsgId>1234567890123456</MsgId>
+<AgentID>1000002</AgentID>
+</xml>"""
+
+BILLION_LAUGHS = """<?xml version="1.0"?>
+<!DOCTYPE xml [
+<!ENTITY lol "lol">
+<!ENTITY lol1 "&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;">
+<!ENTITY lol2 "&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;">
+<!ENTITY lol3 "&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;">
+]>
+<xml><Content>&lol3;</Content></xml>"""
+
+EXTERNAL_ENTITY = """<?xml version="1.0"?>
+<!DOCTYPE xml [<!ENTITY xxe SYSTEM "file:///etc/passwd">]>
+<xml><Encrypt>&xxe;</Encrypt></xml>"""
+
+
+def test_text_message_is_parsed():
+    msg = MessageHandler.parse_message(TEXT_MESSAGE)
+    
+    assert msg.from_user_name == "zhangsan"
+    assert msg.msg_type == "text"
+    assert msg.content == "你好 <b>]]></b>"
+    assert msg.msg_id == "1234567890123456"
+    assert msg.create_time == 1700000000
+
+
+@pytest.mark.parametrize("payload", [BILLION_LAUGHS, EXTERNAL_ENTITY, BILLION_LAUGHS.lower()])
+def test_entity_declarations_are_rejected(payload):
+    with pytest.raises(XMLRejectedError):
+        parse_fields(payload)
+    with pytest.raises(XMLRejectedError):
+        extract_encrypt(payload.encode("utf-8"))
+    assert MessageHandler.parse_message(payload) is None
+
+
+def test_mixed_case_doctype_is_not_expanded():
+    # 大小写混合的声明不是合法XML，解析失败而不是展开实体
+    with pytest.raises(etree.XMLSyntaxError):
+        parse_fields(EXTERNAL_ENTITY.replace("DOCTYPE", "DocType").replace("ENTITY", "Entity"))
+
+
+def test_oversized_payload_is_rejected(monkeypatch):
+    monkeypatch.setattr(Config, "WECOM_MAX_XML_BYTES", 1024)
+    payload = "<xml><Encrypt>" + "a" * 1024 + "</Encrypt></xml>"
+    
+    with pytest.raises(XMLRejectedError):
+        extract_encrypt(payload)
+    with pytest.raises(XMLRejectedError):
+        extract_encrypt(payload.encode("utf-8"))
+    # 按编码后的字节数计算：字符数未超限但UTF-8编码后超限
+    with pytest.raises(XMLRejectedError):
+        parse_fields("<xml><Content>" + "长" * 400 + "</Content></xml>")
+    
+    assert extract_encrypt("<xml><Encrypt>abc</Encrypt></xml>") == "abc"
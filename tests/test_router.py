@@ -0,0 +1,186 @@
+"""多模型路由：失败切换、对冲请求胜出与落败、全部熔断"""
+import asyncio
+import threading
+import time
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from prometheus_client import REGISTRY
+
+from ai.router import LLMRouter
+from breaker import CircuitOpenError
+from config import Config
+
+
+class _FailingChatModel(FakeListChatModel):
+    """调用即失败的模型"""
+    
+    responses: list = ["unused"]
+    error_on_chunk_number: int = 0
+    
+    def _call(self, *args, **kwargs) -> str:
+        raise RuntimeError("backend down")
+
+
+class _BlockingChatModel(FakeListChatModel):
+    """调用阻塞到 gate 被设置"""
+    
+    gate: threading.Event
+    
+    def _call(self, *args, **kwargs) -> str:
+        self.gate.wait()
+        return super()._call(*args, **kwargs)
+
+
+def _hedges(result: str) -> float:
+    return REGISTRY.get_sample_value("wecom_llm_hedges_total", {"result": result}) or 0.0
+
+
+def _observed(model: str) -> float:
+    return REGISTRY.get_sample_value("wecom_llm_seconds_count", {"model": model}) or 0.0
+
+
+def _requests(model: str, result: str) -> float:
+    return REGISTRY.get_sample_value("wecom_llm_backend_requests_total", {"model": model, "result": result}) or 0.0
+
+
+@pytest.fixture
+def fast_hedge(monkeypatch):
+    """无统计样本时 50ms 后发出对冲请求"""
+    monkeypatch.setattr(Config, "AI_REPLY_DEADLINE_SECONDS", 0.1)
+    monkeypatch.setattr(Config, "AI_ROUTER_HEDGE_MIN_SECONDS", 0.05)
+
+
+def test_invoke_fails_over_to_next_backend(fast_hedge):
+    router = LLMRouter({"broken": _FailingChatModel(), "backup": FakeListChatModel(responses=["ok"])})
+    errors = _requests("broken", "error")
+    
+    assert router.invoke("hi").content == "ok"
+    assert _requests("broken", "error") == errors + 1
+
+
+def test_failing_backend_stops_receiving_traffic(fast_hedge):
+    router = LLMRouter({"broken": _FailingChatModel(), "backup": FakeListChatModel(responses=["ok"])})
+    errors = _requests("broken", "error")
+    
+    for _ in range(20):
+        assert router.invoke("hi").content == "ok"
+    # 连续失败达到阈值后熔断，之后的请求直接发往备用后端
+    assert _requests("broken", "error") == errors + Config.AI_BREAKER_FAILURE_THRESHOLD
+    assert router.stats()["broken"]["breaker"] == "open"
+
+
+def test_stream_fails_over_before_first_chunk(fast_hedge):
+    router = LLMRouter({"broken": _FailingChatModel(), "backup": FakeListChatModel(responses=["ok"])})
+    
+    assert "".join(chunk.content for chunk in router.stream("hi")) == "ok"
+
+
+def test_all_backends_failing_raises_last_error(fast_hedge):
+    router = LLMRouter({"a": _FailingChatModel(), "b": _FailingChatModel()})
+    
+    with pytest.raises(RuntimeError, match="backend down"):
+        router.invoke("hi")
+
+
+def test_hedge_wins_over_slow_primary(fast_hedge):
+    router = LLMRouter({
+        "slow": FakeListChatModel(responses=["slow"], sleep=1),
+        "fast": FakeListChatModel(responses=["fast"])
+    })
+    won = _hedges("won")
+    
+    assert router.invoke("hi").content == "fast"
+    assert _hedges("won") == won + 1
+
+
+def test_stream_hedge_wins_and_cancels_primary(fast_hedge):
+    router = LLMRouter({
+        "slow": FakeListChatModel(responses=["slow"], sleep=0.5),
+        "fast": FakeListChatModel(responses=["fast"])
+    })
+    won = _hedges("won")
+    
+    # 胜出后只输出对冲方的分片
+    assert "".join(chunk.content for chunk in router.stream("hi")) == "fast"
+    assert _hedges("won") == won + 1
+
+
+def test_primary_still_wins_over_slower_hedge(fast_hedge):
+    router = LLMRouter({
+        "primary": FakeListChatModel(responses=["primary"], sleep=0.1),
+        "hedge": FakeListChatModel(responses=["hedge"], sleep=1)
+    })
+    lost = _hedges("lost")
+    
+    assert router.invoke("hi").content == "primary"
+    assert _hedges("lost") == lost + 1
+
+
+def test_async_hedge_and_failover(fast_hedge):
+    hedged = LLMRouter({
+        "slow": FakeListChatModel(responses=["slow"], sleep=1),
+        "fast": FakeListChatModel(responses=["fast"])
+    })
+    failover = LLMRouter({"broken": _FailingChatModel(), "backup": FakeListChatModel(responses=["ok"])})
+    
+    async def run():
+        chunks = [chunk.content async for chunk in failover.astream("hi")]
+        return (await hedged.ainvoke("hi")).content, (await failover.ainvoke("hi")).content, "".join(chunks)
+    
+    assert asyncio.run(run()) == ("fast", "ok", "ok")
+
+
+def test_open_breakers_are_skipped(fast_hedge):
+    router = LLMRouter({"a": FakeListChatModel(responses=["a"]), "b": FakeListChatModel(responses=["b"])})
+    for _ in range(Config.AI_BREAKER_FAILURE_THRESHOLD):
+        router.backends[0].breaker.record_failure()
+    
+    assert router.invoke("hi").content == "b"
+    
+    for _ in range(Config.AI_BREAKER_FAILURE_THRESHOLD):
+        router.backends[1].breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        router.invoke("hi")
+
+
+def test_latency_is_recorded_for_the_answering_backend(fast_hedge):
+    router = LLMRouter({
+        "slow-a": FakeListChatModel(responses=["slow"], sleep=1),
+        "fast-a": FakeListChatModel(responses=["fast"])
+    })
+    slow, fast = _observed("slow-a"), _observed("fast-a")
+    
+    async def run():
+        return (await router.ainvoke("hi")).content
+    
+    # 耗时记在实际返回的模型名下，被取消的落败请求不记录
+    assert asyncio.run(run()) == "fast"
+    assert _observed("fast-a") == fast + 1
+    assert _observed("slow-a") == slow
+
+
+def test_hedge_is_skipped_when_pool_is_busy(fast_hedge, monkeypatch):
+    monkeypatch.setattr(Config, "AI_EXECUTOR_MAX_WORKERS", 1)
+    gate = threading.Event()
+    router = LLMRouter({
+        "blocked": _BlockingChatModel(responses=["blocked"], gate=gate),
+        "fast": FakeListChatModel(responses=["fast"])
+    })
+    skipped = _hedges("skipped")
+    
+    # 对冲胜出后，落败的同步请求仍占用一个线程
+    assert router.invoke("hi").content == "fast"
+    
+    # 第二次调用的主请求占用最后一个线程，线程池已满，不再发出对冲请求
+    result = []
+    caller = threading.Thread(target=lambda: result.append(router.invoke("hi").content))
+    caller.start()
+    deadline = time.monotonic() + 2
+    while _hedges("skipped") == skipped and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _hedges("skipped") == skipped + 1
+    
+    gate.set()
+    caller.join(timeout=2)
+    assert result == ["blocked"]
@@ -0,0 +1,86 @@
+"""公平调度：赤字轮询的权重比例、分组嵌套、同一用户串行执行"""
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from ai.scheduler import FairScheduler, SchedulerRejectedError, _FairQueue, parse_weights
+
+
+def _always_ready(key: str) -> bool:
+    return True
+
+
+def test_parse_weights():
+    assert parse_weights("bot-sync:0.2, vip:3,bad,zero:0,") == {"bot-sync": 0.2, "vip": 3.0}
+    assert parse_weights("") == {}
+
+
+def test_drr_follows_weights():
+    queue = _FairQueue({"vip": 3, "bot": 0.5})
+    for user_id in ("vip", "normal", "bot"):
+        for _ in range(20):
+            queue.push((user_id,), user_id)
+    
+    # 每两轮：vip 6 次、normal 2 次、bot（权重0.5，累积两轮）1 次
+    popped = [queue.pop(_always_ready) for _ in range(18)]
+    assert Counter(popped) == {"vip": 12, "normal": 4, "bot": 2}
+    assert popped[:4] == ["vip", "vip", "vip", "normal"]
+
+
+def test_groups_share_by_group_weight():
+    queue = _FairQueue({"app-a": 2})
+    for group, user_id in (("app-a", "a1"), ("app-a", "a2"), ("app-b", "b1")):
+        for _ in range(6):
+            queue.push((group, user_id), user_id)
+    
+    # 分组之间按权重轮流，分组内的用户再轮流，a1、a2 合计不超过 app-a 的额度
+    popped = [queue.pop(_always_ready) for _ in range(9)]
+    assert popped == ["a1", "a2", "b1"] * 3
+
+
+def test_busy_user_is_skipped_without_blocking_others():
+    queue = _FairQueue({})
+    queue.push(("alice",), "alice-1")
+    queue.push(("bob",), "bob-1")
+    
+    assert queue.pop(lambda user_id: user_id != "alice") == "bob-1"
+    assert queue.pop(lambda user_id: user_id != "alice") is None
+    assert queue.pop(_always_ready) == "alice-1"
+    assert len(queue) == 0
+
+
+def test_same_user_runs_in_order_one_at_a_time():
+    scheduler = FairScheduler(concurrency=4, thread_name_prefix="test-scheduler")
+    events = []
+    lock = threading.Lock()
+    
+    def task(index: int) -> int:
+        with lock:
+            events.append(("start", index))
+        time.sleep(0.02)
+        with lock:
+            events.append(("end", index))
+        return index
+    
+    futures = [scheduler.submit("alice", "", task, i) for i in range(4)]
+    assert [f.result(timeout=5) for f in futures] == [0, 1, 2, 3]
+    assert events == [(kind, i) for i in range(4) for kind in ("start", "end")]
+
+
+def test_queue_limit_rejects():
+    scheduler = FairScheduler(concurrency=1, thread_name_prefix="test-scheduler")
+    scheduler.max_queue_per_user = 2
+    release = threading.Event()
+    
+    running = scheduler.submit("alice", "", release.wait, 5)
+    time.sleep(0.05)
+    queued = [scheduler.submit("alice", "", lambda: None) for _ in range(2)]
+    with pytest.raises(SchedulerRejectedError):
+        scheduler.submit("alice", "", lambda: None)
+    
+    release.set()
+    assert running.result(timeout=5)
+    for future in queued:
+        future.result(timeout=5)
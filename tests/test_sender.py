@@ -0,0 +1,169 @@
+"""主动消息发送调度：同一成员按提交顺序逐条发送，相同内容合并为一次调用"""
+import asyncio
+import random
+import threading
+import time
+
+import pytest
+
+from config import Config
+from wecom.sender import AsyncOutboundScheduler, OutboundScheduler
+
+
+class _FakeHandler:
+    """记录 send_text_batch 调用，每次调用耗时随机"""
+    
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = []
+        self._lock = threading.Lock()
+        self._active = set()
+        self.overlaps = []
+    
+    def send_text_batch(self, user_ids, content) -> bool:
+        with self._lock:
+            busy = self._active.intersection(user_ids)
+            if busy:
+                self.overlaps.append((sorted(busy), content))
+            self._active.update(user_ids)
+        time.sleep(random.uniform(0, 0.01))
+        with self._lock:
+            self._active.difference_update(user_ids)
+            self.calls.append((list(user_ids), content))
+        if self.fail:
+            raise RuntimeError("qyapi down")
+        return True
+    
+    async def asend_text_batch(self, user_ids, content) -> bool:
+        busy = self._active.intersection(user_ids)
+        if busy:
+            self.overlaps.append((sorted(busy), content))
+        self._active.update(user_ids)
+        await asyncio.sleep(random.uniform(0, 0.01))
+        self._active.difference_update(user_ids)
+        self.calls.append((list(user_ids), content))
+        if self.fail:
+            raise RuntimeError("qyapi down")
+        return True
+    
+    def received(self, user_id: str) -> list:
+        return [content for user_ids, content in self.calls if user_id in user_ids]
+
+
+@pytest.fixture(autouse=True)
+def fast_limits(monkeypatch):
+    monkeypatch.setattr(Config, "WECOM_SEND_APP_RATE", 1000)
+    monkeypatch.setattr(Config, "WECOM_SEND_USER_RATE_PER_MINUTE", 60000)
+    monkeypatch.setattr(Config, "WECOM_SEND_USER_BURST", 100)
+    monkeypatch.setattr(Config, "WECOM_SEND_BATCH_WINDOW_MS", 10)
+
+
+def test_segments_arrive_in_order_per_user():
+    handler = _FakeHandler()
+    outbound = OutboundScheduler(handler, concurrency=8)
+    users = [f"user-{i}" for i in range(5)]
+    
+    for segment in range(10):
+        for user_id in users:
+            outbound.submit(user_id, f"{user_id} segment {segment}")
+    
+    assert outbound.drain(timeout=10)
+    assert handler.overlaps == []
+    for user_id in users:
+        assert handler.received(user_id) == [f"{user_id} segment {n}" for n in range(10)]
+
+
+def test_same_content_is_merged():
+    handler = _FakeHandler()
+    outbound = OutboundScheduler(handler, concurrency=2)
+    
+    outbound.broadcast(["alice", "bob", "alice"], "notice")
+    outbound.submit("carol", "notice")
+    
+    assert outbound.drain(timeout=5)
+    assert len(handler.calls) == 1
+    assert sorted(handler.calls[0][0]) == ["alice", "bob", "carol"]
+
+
+def test_failed_send_is_not_retried_and_releases_next():
+    handler = _FakeHandler(fail=True)
+    outbound = OutboundScheduler(handler, concurrency=2)
+    
+    outbound.submit("alice", "first")
+    outbound.submit("alice", "second")
+    
+    # 发送失败不重发（企业微信可能已受理），但不阻塞该成员的后续消息
+    assert outbound.drain(timeout=5)
+    assert handler.received("alice") == ["first", "second"]
+
+
+def test_dispatch_error_releases_users_next_message():
+    handler = _FakeHandler()
+    outbound = OutboundScheduler(handler, concurrency=2)
+    submit = outbound._executor.submit
+    failures = []
+    
+    def flaky_submit(fn, job):
+        if not failures:
+            failures.append(job.content)
+            raise RuntimeError("executor shut down")
+        return submit(fn, job)
+    
+    outbound._executor.submit = flaky_submit
+    outbound.submit("alice", "lost")
+    outbound.submit("alice", "next")
+    
+    # 未能提交的消息丢弃，成员的下一条消息照常发送，drain 不会一直等待
+    assert outbound.drain(timeout=5)
+    assert failures == ["lost"]
+    assert handler.received("alice") == ["next"]
+    assert outbound._slots.acquire(blocking=False) and outbound._slots.acquire(blocking=False)
+
+
+def test_async_segments_arrive_in_order_and_merge():
+    handler = _FakeHandler()
+    users = [f"user-{i}" for i in range(5)]
+    
+    async def run():
+        outbound = AsyncOutboundScheduler(handler, concurrency=8)
+        outbound.broadcast(users, "notice")
+        for segment in range(10):
+            for user_id in users:
+                outbound.submit(user_id, f"{user_id} segment {segment}")
+        return await outbound.drain(timeout=10)
+    
+    assert asyncio.run(run())
+    assert handler.overlaps == []
+    assert handler.calls[0] == (users, "notice")
+    for user_id in users:
+        assert handler.received(user_id) == ["notice"] + [f"{user_id} segment {n}" for n in range(10)]
+
+
+def test_async_failed_send_releases_next():
+    handler = _FakeHandler(fail=True)
+    
+    async def run():
+        outbound = AsyncOutboundScheduler(handler, concurrency=2)
+        outbound.submit("alice", "first")
+        outbound.submit("alice", "second")
+        return await outbound.drain(timeout=5)
+    
+    assert asyncio.run(run())
+    assert handler.received("alice") == ["first", "second"]
+
+
+def test_async_user_rate_limit_defers_instead_of_dropping(monkeypatch):
+    monkeypatch.setattr(Config, "WECOM_SEND_USER_RATE_PER_MINUTE", 600)
+    monkeypatch.setattr(Config, "WECOM_SEND_USER_BURST", 1)
+    handler = _FakeHandler()
+    
+    async def run():
+        outbound = AsyncOutboundScheduler(handler, concurrency=2)
+        outbound.broadcast(["alice", "bob"], "first")
+        outbound.submit("alice", "second")
+        return await outbound.drain(timeout=5)
+    
+    # 每人每 0.1 秒一条：alice 的第二条延迟发送
+    assert asyncio.run(run())
+    assert handler.received("alice") == ["first", "second"]
+    assert handler.received("bob") == ["first"]
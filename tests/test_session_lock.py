@@ -0,0 +1,81 @@
+"""会话锁：栅栏令牌、过期持有者的写入被拒绝、等待超时与续租"""
+import asyncio
+import time
+
+import pytest
+
+from ai.history import ConversationHistory
+from ai.session_lock import SessionBusyError, SessionLock
+
+LOCK_KEY = "wecom:chat:lock:s1"
+
+
+def test_fence_token_increases_per_acquire(fake_redis):
+    lock = SessionLock()
+    with lock.hold("s1") as first:
+        assert fake_redis.get(LOCK_KEY) == str(first)
+    with lock.hold("s1") as second:
+        assert second == first + 1
+    assert not fake_redis.exists(LOCK_KEY)
+
+
+def test_fenced_append_rejects_stale_holder(fake_redis):
+    history = ConversationHistory()
+    stale_holder, new_holder = SessionLock(), SessionLock()
+    
+    stale = stale_holder.hold("s1")
+    stale_token = stale.__enter__()
+    # 持有者卡顿超过租约，锁过期后被其他进程接管
+    fake_redis.delete(LOCK_KEY)
+    current = new_holder.hold("s1")
+    token = current.__enter__()
+    assert token == stale_token + 1
+    
+    assert history.add_turn("s1", "stale question", "stale answer", fence=stale_token) == 0
+    assert history.get_messages("s1") == []
+    
+    assert history.add_turn("s1", "question", "answer", fence=token) == 2
+    assert [m.content for m in history.get_messages("s1")] == ["question", "answer"]
+    
+    # 过期持有者退出时不会释放他人的锁
+    stale.__exit__(None, None, None)
+    assert fake_redis.get(LOCK_KEY) == str(token)
+    current.__exit__(None, None, None)
+    assert not fake_redis.exists(LOCK_KEY)
+
+
+def test_async_fenced_append_rejects_stale_holder(fake_redis):
+    history = ConversationHistory()
+    
+    async def turn():
+        async with SessionLock().ahold("s1") as stale_token:
+            pass
+        async with SessionLock().ahold("s1") as token:
+            stale = await history.aadd_turn("s1", "stale question", "stale answer", fence=stale_token)
+            fresh = await history.aadd_turn("s1", "question", "answer", fence=token)
+        return stale, fresh
+    
+    assert asyncio.run(turn()) == (0, 2)
+    assert [m.content for m in history.get_messages("s1")] == ["question", "answer"]
+
+
+def test_wait_timeout_raises_busy(fake_redis):
+    holder, waiter = SessionLock(), SessionLock()
+    waiter.wait_seconds = 0.1
+    with holder.hold("s1"):
+        started_at = time.monotonic()
+        with pytest.raises(SessionBusyError):
+            with waiter.hold("s1"):
+                pass
+        assert time.monotonic() - started_at < 1
+
+
+def test_lease_is_renewed_while_held(fake_redis):
+    lock = SessionLock()
+    lock.lease_ms = 300
+    with lock.hold("s1") as token:
+        time.sleep(0.8)
+        # 持有时长已超过租约，续租后锁仍由自己持有
+        assert fake_redis.get(LOCK_KEY) == str(token)
+        assert fake_redis.pttl(LOCK_KEY) > 0
+    assert not fake_redis.exists(LOCK_KEY)
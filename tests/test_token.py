@@ -0,0 +1,81 @@
+"""access_token：多进程并发只刷新一次、持锁进程失效后自行刷新、后台提前刷新"""
+import threading
+import time
+
+from config import Config
+from wecom.token import AccessTokenProvider
+
+
+class _FakeFetcher:
+    """模拟 gettoken 接口，记录调用次数"""
+    
+    def __init__(self, delay: float = 0.2, expires_in: int = 7200):
+        self.delay = delay
+        self.expires_in = expires_in
+        self.calls = 0
+        self._lock = threading.Lock()
+    
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            token = f"token-{self.calls}"
+        time.sleep(self.delay)
+        return token, self.expires_in
+
+
+def _lock_key(provider: AccessTokenProvider) -> str:
+    return provider._get_lock_key()
+
+
+def test_concurrent_callers_fetch_once(fake_redis):
+    fetcher = _FakeFetcher()
+    # 多个 worker 进程各有一个提供者，每个进程内多个线程同时获取
+    providers = [AccessTokenProvider(fetcher) for _ in range(4)]
+    results = []
+    
+    def get(provider):
+        results.append(provider.get_token())
+    
+    threads = [threading.Thread(target=get, args=(p,)) for p in providers for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    
+    assert fetcher.calls == 1
+    assert results == ["token-1"] * 20
+    assert not fake_redis.exists(_lock_key(providers[0]))
+
+
+def test_refreshes_itself_when_lock_holder_dies(fake_redis, monkeypatch):
+    monkeypatch.setattr(AccessTokenProvider, "WAIT_SECONDS", 0.3)
+    fetcher = _FakeFetcher(delay=0)
+    provider = AccessTokenProvider(fetcher)
+    # 持锁进程崩溃：锁仍在，共享token一直未写入
+    fake_redis.set(_lock_key(provider), "dead-worker", ex=AccessTokenProvider.LOCK_TTL_SECONDS)
+    
+    started_at = time.monotonic()
+    assert provider.get_token() == "token-1"
+    assert 0.3 <= time.monotonic() - started_at < 2
+    assert fetcher.calls == 1
+    
+    # 自行刷新的结果同样共享给其他进程
+    assert AccessTokenProvider(fetcher).get_token() == "token-1"
+    assert fetcher.calls == 1
+
+
+def test_background_refresh_before_expiry(fake_redis, monkeypatch):
+    monkeypatch.setattr(Config, "WECOM_TOKEN_REFRESH_AHEAD_SECONDS", 60)
+    fetcher = _FakeFetcher(delay=0)
+    provider = AccessTokenProvider(fetcher)
+    # 本地token 10 秒后过期，不足提前刷新时间
+    provider._set_local("expiring", time.time() + 10)
+    provider._ensure_refresher()
+    
+    deadline = time.monotonic() + 2
+    while provider.refresh_count == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    assert provider.get_token() == "token-1"
+    assert AccessTokenProvider(fetcher).get_token() == "token-1"
+    assert fetcher.calls == 1
@@ -1,6 +1,9 @@
 """企业微信模块"""
 from .crypto import WXBizMsgCrypt
+from .debounce import MessageDebouncer
+from .dedup import MessageDeduplicator
 from .message import MessageHandler
+from .sender import AsyncOutboundScheduler, OutboundScheduler
 
-__all__ = ["WXBizMsgCrypt", "MessageHandler"]
+__all__ = ["WXBizMsgCrypt", "MessageDebouncer", "MessageDeduplicator", "MessageHandler", "OutboundScheduler", "AsyncOutboundScheduler"]
 
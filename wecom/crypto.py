@@ -5,14 +5,27 @@
 import base64
 import hashlib
 import random
-import socket
 import struct
+import threading
 import time
-import xml.etree.ElementTree as ET
 from typing import Tuple, Optional
+from xml.sax.saxutils import escape
 
 from Crypto.Cipher import AES
 
+import metrics
+from .parser import escape_cdata, extract_encrypt
+
+# 消息长度字段：4字节网络字节序
+_LENGTH = struct.Struct(">I")
+# PKCS7填充块大小
+_BLOCK_SIZE = 32
+# 预先生成的填充字节，下标为填充长度
+_PADDING = [bytes([n]) * n for n in range(_BLOCK_SIZE + 1)]
+# 不超过该长度（字节）的密文以 ECB+异或 方式解密；更长的密文大整数异或的开销超过
+# 创建CBC对象的开销，改用CBC解密
+_ECB_DECRYPT_MAX_BYTES = 3072
+
 
 class WXBizMsgCrypt:
     """企业微信消息加解密类"""
@@ -49,6 +62,30 @@ class WXBizMsgCrypt:
                 raise ValueError("Invalid AES key length")
         except Exception:
             raise ValueError("EncodingAESKey 无效")
+        
+        # 预先计算加解密用到的常量，避免每条消息重复计算
+        self._iv = self.aes_key[:16]
+        self._iv_int = int.from_bytes(self._iv, "big")
+        self._corp_id_bytes = corp_id.encode("utf-8")
+        # ECB模式对象无状态，可在多条消息（及多线程）间复用，用于短消息的CBC解密
+        self._ecb = AES.new(self.aes_key, AES.MODE_ECB)
+        # 加密用的CBC对象有状态，按线程复用
+        self._local = threading.local()
+    
+    def _encryptor(self) -> Tuple[object, int]:
+        """
+        当前线程复用的CBC加密对象
+        
+        Returns:
+            (CBC对象, 首块明文需异或的掩码)。复用的对象以上一条消息的最后一块密文作为链接值，
+            首块预先异或 IV 与该链接值后，输出与以 IV 新建的CBC对象一致
+        """
+        local = self._local
+        cipher = getattr(local, "cipher", None)
+        if cipher is None:
+            cipher = local.cipher = AES.new(self.aes_key, AES.MODE_CBC, self._iv)
+            local.last_block = self._iv_int
+        return cipher, self._iv_int ^ local.last_block
     
     def _get_signature(self, timestamp: str, nonce: str, encrypt: str) -> str:
         """计算签名"""
@@ -61,65 +98,77 @@ class WXBizMsgCrypt:
         except Exception:
             return ""
     
-    def _pkcs7_encode(self, text: bytes) -> bytes:
-        """PKCS7填充"""
-        block_size = 32
-        text_length = len(text)
-        amount_to_pad = block_size - (text_length % block_size)
-        if amount_to_pad == 0:
-            amount_to_pad = block_size
-        pad = chr(amount_to_pad).encode()
-        return text + pad * amount_to_pad
-    
-    def _pkcs7_decode(self, decrypted: bytes) -> bytes:
-        """PKCS7去填充"""
-        pad = decrypted[-1]
-        if pad < 1 or pad > 32:
-            pad = 0
-        return decrypted[:-pad]
-    
     def _encrypt(self, text: str) -> Tuple[int, Optional[str]]:
         """对明文进行加密"""
         try:
             text = text.encode("utf-8")
-            # 16字节随机字符串
+            corp_id = self._corp_id_bytes
+            # 明文结构：16字节随机字符串 + 4字节消息长度 + 消息 + corpid + PKCS7填充
+            size = 20 + len(text) + len(corp_id)
+            amount_to_pad = _BLOCK_SIZE - (size % _BLOCK_SIZE)
             random_str = str(random.randint(1000000000000000, 9999999999999999)).encode("utf-8")
-            # 网络字节序
-            text_length = struct.pack("I", socket.htonl(len(text)))
-            # 拼接
-            text = random_str + text_length + text + self.corp_id.encode("utf-8")
-            # 填充
-            text = self._pkcs7_encode(text)
-            # 加密
-            cipher = AES.new(self.aes_key, AES.MODE_CBC, self.aes_key[:16])
-            encrypted = cipher.encrypt(text)
+            cipher, mask = self._encryptor()
+            # 各部分一次拼接，填充字节预先生成；随机字符串恰为首块，直接与掩码异或
+            plaintext = b"".join((
+                (int.from_bytes(random_str, "big") ^ mask).to_bytes(16, "big"),
+                _LENGTH.pack(len(text)),
+                text,
+                corp_id,
+                _PADDING[amount_to_pad]
+            ))
+            
+            encrypted = cipher.encrypt(plaintext)
+            self._local.last_block = int.from_bytes(encrypted[-16:], "big")
             return self.WXBizMsgCrypt_OK, base64.b64encode(encrypted).decode("utf-8")
         except Exception:
+            # 链接值可能已不一致，丢弃复用的CBC对象
+            self._local.cipher = None
             return self.WXBizMsgCrypt_EncryptAES_Error, None
     
     def _decrypt(self, text: str) -> Tuple[int, Optional[str]]:
         """对密文进行解密"""
         try:
-            cipher = AES.new(self.aes_key, AES.MODE_CBC, self.aes_key[:16])
-            decrypted = cipher.decrypt(base64.b64decode(text))
-            decrypted = self._pkcs7_decode(decrypted)
+            encrypted = base64.b64decode(text)
+            if not encrypted:
+                return self.WXBizMsgCrypt_DecryptAES_Error, None
+            if len(encrypted) <= _ECB_DECRYPT_MAX_BYTES:
+                # CBC解密的各块相互独立：整体ECB解密后与前一块密文（首块为IV）异或，
+                # 免去每条消息创建CBC对象的开销
+                blocks = self._ecb.decrypt(encrypted)
+                chained = self._iv + encrypted[:-16]
+                decrypted = (int.from_bytes(blocks, "big") ^ int.from_bytes(chained, "big")).to_bytes(len(blocks), "big")
+            else:
+                decrypted = AES.new(self.aes_key, AES.MODE_CBC, self._iv).decrypt(encrypted)
+            
+            # 去除PKCS7填充（填充值非法时视为解密失败）
+            pad = decrypted[-1]
+            if pad < 1 or pad > _BLOCK_SIZE:
+                return self.WXBizMsgCrypt_DecryptAES_Error, None
+            # 用 memoryview 切片，避免复制
+            content = memoryview(decrypted)[:len(decrypted) - pad]
             
-            # 去掉16字节随机字符串
-            content = decrypted[16:]
-            # 获取消息长度
-            xml_length = socket.ntohl(struct.unpack("I", content[:4])[0])
-            # 获取消息内容
-            xml_content = content[4:xml_length + 4].decode("utf-8")
-            # 获取corpid
-            from_corp_id = content[xml_length + 4:].decode("utf-8")
+            # 跳过16字节随机字符串，获取消息长度
+            xml_length = _LENGTH.unpack_from(content, 16)[0]
+            xml_end = 20 + xml_length
+            xml_content = str(content[20:xml_end], "utf-8")
             
-            if from_corp_id != self.corp_id:
+            # 校验corpid
+            from_corp_id = content[xml_end:]
+            if from_corp_id != self._corp_id_bytes:
+                # 与逐段解码的实现保持一致：corpid 非法 UTF-8 时按解密失败处理
+                str(from_corp_id, "utf-8")
                 return self.WXBizMsgCrypt_ValidateCorpid_Error, None
             
             return self.WXBizMsgCrypt_OK, xml_content
         except Exception:
             return self.WXBizMsgCrypt_DecryptAES_Error, None
     
+    @staticmethod
+    def _error(code: int) -> Tuple[int, None]:
+        """返回错误码并计入监控指标"""
+        metrics.crypto_error(code)
+        return code, None
+    
     def verify_url(self, msg_signature: str, timestamp: str, nonce: str, echostr: str) -> Tuple[int, Optional[str]]:
         """
         验证URL有效性（用于配置回调URL时的验证）
@@ -135,9 +184,11 @@ class WXBizMsgCrypt:
         """
         signature = self._get_signature(timestamp, nonce, echostr)
         if signature != msg_signature:
-            return self.WXBizMsgCrypt_ValidateSignature_Error, None
+            return self._error(self.WXBizMsgCrypt_ValidateSignature_Error)
         
         ret, reply_echostr = self._decrypt(echostr)
+        if ret != self.WXBizMsgCrypt_OK:
+            return self._error(ret)
         return ret, reply_echostr
     
     def decrypt_msg(self, post_data: str, msg_signature: str, timestamp: str, nonce: str) -> Tuple[int, Optional[str]]:
@@ -154,19 +205,21 @@ class WXBizMsgCrypt:
             (错误码, 解密后的XML消息或None)
         """
         try:
-            root = ET.fromstring(post_data)
-            encrypt = root.find("Encrypt")
-            if encrypt is None:
-                return self.WXBizMsgCrypt_ParseXml_Error, None
-            encrypt_text = encrypt.text
+            encrypt_text = extract_encrypt(post_data)
+            if encrypt_text is None:
+                return self._error(self.WXBizMsgCrypt_ParseXml_Error)
         except Exception:
-            return self.WXBizMsgCrypt_ParseXml_Error, None
+            return self._error(self.WXBizMsgCrypt_ParseXml_Error)
         
-        signature = self._get_signature(timestamp, nonce, encrypt_text)
+        with metrics.SIGNATURE_SECONDS.time():
+            signature = self._get_signature(timestamp, nonce, encrypt_text)
         if signature != msg_signature:
-            return self.WXBizMsgCrypt_ValidateSignature_Error, None
+            return self._error(self.WXBizMsgCrypt_ValidateSignature_Error)
         
-        ret, xml_content = self._decrypt(encrypt_text)
+        with metrics.DECRYPT_SECONDS.time():
+            ret, xml_content = self._decrypt(encrypt_text)
+        if ret != self.WXBizMsgCrypt_OK:
+            return self._error(ret)
         return ret, xml_content
     
     def encrypt_msg(self, reply_msg: str, nonce: str, timestamp: Optional[str] = None) -> Tuple[int, Optional[str]]:
@@ -184,17 +237,18 @@ class WXBizMsgCrypt:
         if timestamp is None:
             timestamp = str(int(time.time()))
         
-        ret, encrypt = self._encrypt(reply_msg)
+        with metrics.ENCRYPT_SECONDS.time():
+            ret, encrypt = self._encrypt(reply_msg)
         if ret != self.WXBizMsgCrypt_OK:
-            return ret, None
+            return self._error(ret)
         
         signature = self._get_signature(timestamp, nonce, encrypt)
         
         resp_xml = f"""<xml>
 <Encrypt><![CDATA[{encrypt}]]></Encrypt>
 <MsgSignature><![CDATA[{signature}]]></MsgSignature>
-<TimeStamp>{timestamp}</TimeStamp>
-<Nonce><![CDATA[{nonce}]]></Nonce>
+<TimeStamp>{escape(timestamp)}</TimeStamp>
+<Nonce><![CDATA[{escape_cdata(nonce)}]]></Nonce>
 </xml>"""
         
         return self.WXBizMsgCrypt_OK, resp_xml
@@ -0,0 +1,237 @@
+"""
+用户消息合并模块
+用户常把一个问题拆成几条短消息连续发送。开启后同一成员在窗口期内发送的消息先缓存在Redis中，
+窗口期内没有新消息时由最后到达的一条负责将缓存的消息合并为一轮对话，只调用一次AI，
+回复通过主动消息推送。每条消息到达时递增该成员的序号，窗口期结束时序号已变化说明有更新的消息，
+直接放弃，由更新的消息负责合并（多进程部署时同样只回复一次）
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from dataclasses import replace
+from typing import Callable, Dict, Optional, Tuple
+import redis
+
+import metrics
+from breaker import CircuitOpenError
+from config import Config
+from redis_client import get_async_redis_client, get_redis_client
+from .message import WeChatMessage
+
+# 缓存消息并递增序号，返回 {序号, 缓存的消息数}
+_PUSH_SCRIPT = """
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[2]))
+local seq = redis.call('INCR', KEYS[2])
+redis.call('PEXPIRE', KEYS[2], tonumber(ARGV[2]))
+return {seq, redis.call('LLEN', KEYS[1])}
+"""
+
+# 序号未变化（窗口期内没有新消息）时取出并清空缓存的消息，否则返回nil
+_TAKE_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return false
+end
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+return items
+"""
+
+
+class MessageDebouncer:
+    """按成员合并窗口期内连续发送的消息"""
+    
+    def __init__(self, window_seconds: Optional[float] = None, max_messages: Optional[int] = None):
+        """
+        Args:
+            window_seconds: 合并窗口（秒），每条新消息重新计时
+            max_messages: 最多合并的消息数，达到后立即回复，避免连续发送时迟迟不回复
+        """
+        self.window_seconds = window_seconds or Config.WECOM_DEBOUNCE_SECONDS
+        self.max_messages = max_messages or Config.WECOM_DEBOUNCE_MAX_MESSAGES
+        # 缓存的过期时间，负责合并的进程崩溃时遗留的消息到期清理
+        self._key_ttl_ms = int(max(self.window_seconds * 10, 60) * 1000)
+        self._redis_client: Optional[redis.Redis] = None
+        self._async_redis_client = None
+        self._scripts: Dict[str, object] = {}
+        
+        # 等待窗口期结束的消息：(到期时间, 序号, 合并序号, 消息, 回调)
+        self._delayed: list = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._dispatcher: Optional[threading.Thread] = None
+    
+    @property
+    def redis_client(self) -> redis.Redis:
+        """懒加载Redis客户端"""
+        if self._redis_client is None:
+            self._redis_client = get_redis_client()
+        return self._redis_client
+    
+    @property
+    def async_redis_client(self):
+        """懒加载异步Redis客户端"""
+        if self._async_redis_client is None:
+            self._async_redis_client = get_async_redis_client()
+        return self._async_redis_client
+    
+    def _script(self, name: str, client, source: str):
+        """注册并缓存Lua脚本（同步、异步客户端分别注册）"""
+        script = self._scripts.get(name)
+        if script is None:
+            script = self._scripts[name] = client.register_script(source)
+        return script
+    
+    @staticmethod
+    def _get_keys(user_id: str) -> list:
+        """缓存消息列表和序号的Redis key"""
+        return [f"wecom:msg:debounce:{user_id}", f"wecom:msg:debounce:seq:{user_id}"]
+    
+    @staticmethod
+    def _merge(msg: WeChatMessage, items: list) -> Optional[WeChatMessage]:
+        """将缓存的消息合并为一条（其余字段沿用最后一条消息）"""
+        if not items:
+            return None
+        metrics.DEBOUNCED_MESSAGES.inc(len(items) - 1)
+        return replace(msg, content="\n".join(items))
+    
+    def _push(self, msg: WeChatMessage) -> Optional[Tuple[int, int]]:
+        """
+        缓存消息
+        
+        Returns:
+            (合并序号, 缓存的消息数)，Redis不可用时返回None
+        """
+        try:
+            push = self._script("push", self.redis_client, _PUSH_SCRIPT)
+            seq, length = push(keys=self._get_keys(msg.from_user_name), args=[msg.content, self._key_ttl_ms])
+            return int(seq), int(length)
+        except CircuitOpenError:
+            return None
+        except Exception as e:
+            metrics.redis_error("debounce")
+            print(f"缓存待合并消息失败，改为逐条回复: {e}")
+            return None
+    
+    def _take(self, msg: WeChatMessage, seq: int) -> Optional[WeChatMessage]:
+        """
+        窗口期结束，取出合并后的消息
+        
+        Returns:
+            合并后的消息，窗口期内有更新的消息时返回None（由更新的消息负责回复）
+        """
+        try:
+            take = self._script("take", self.redis_client, _TAKE_SCRIPT)
+            items = take(keys=self._get_keys(msg.from_user_name), args=[seq])
+        except CircuitOpenError:
+            return msg
+        except Exception as e:
+            metrics.redis_error("debounce")
+            print(f"取出待合并消息失败，仅回复最后一条: {e}")
+            return msg
+        return None if items is None else self._merge(msg, items)
+    
+    def submit(self, msg: WeChatMessage, handler: Callable[[WeChatMessage], None]) -> None:
+        """
+        缓存消息（立即返回），窗口期结束后将合并后的消息交给 handler
+        
+        Args:
+            msg: 收到的文本消息
+            handler: 处理合并后消息的回调，在调度线程中调用，应尽快返回（如提交到线程池）；
+                     Redis不可用时在当前线程中以原消息调用
+        """
+        pushed = self._push(msg)
+        if pushed is None:
+            handler(msg)
+            return
+        
+        seq, length = pushed
+        if length >= self.max_messages:
+            self._flush(msg, seq, handler)
+            return
+        
+        self._ensure_dispatcher()
+        with self._cond:
+            heapq.heappush(
+                self._delayed,
+                (time.monotonic() + self.window_seconds, next(self._order), seq, msg, handler)
+            )
+            self._cond.notify()
+    
+    def _flush(self, msg: WeChatMessage, seq: int, handler: Callable[[WeChatMessage], None]) -> None:
+        """取出合并后的消息并回调"""
+        merged = self._take(msg, seq)
+        if merged is not None:
+            handler(merged)
+    
+    def _ensure_dispatcher(self) -> None:
+        """启动调度线程（在首次使用时启动，兼容 gunicorn 的 fork 模型）"""
+        if self._dispatcher is not None and self._dispatcher.is_alive():
+            return
+        with self._cond:
+            if self._dispatcher is not None and self._dispatcher.is_alive():
+                return
+            self._dispatcher = threading.Thread(
+                target=self._dispatch_loop, name="wecom-debounce-dispatcher", daemon=True
+            )
+            self._dispatcher.start()
+    
+    def _dispatch_loop(self) -> None:
+        """调度线程：窗口期结束后合并消息"""
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._delayed and self._delayed[0][0] <= now:
+                        _, _, seq, msg, handler = heapq.heappop(self._delayed)
+                        break
+                    self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+            try:
+                self._flush(msg, seq, handler)
+            except Exception as e:
+                print(f"合并消息调度异常: {e}")
+    
+    async def _apush(self, msg: WeChatMessage) -> Optional[Tuple[int, int]]:
+        """_push 的异步版本"""
+        try:
+            push = self._script("apush", self.async_redis_client, _PUSH_SCRIPT)
+            seq, length = await push(keys=self._get_keys(msg.from_user_name), args=[msg.content, self._key_ttl_ms])
+            return int(seq), int(length)
+        except CircuitOpenError:
+            return None
+        except Exception as e:
+            metrics.redis_error("debounce")
+            print(f"缓存待合并消息失败，改为逐条回复: {e}")
+            return None
+    
+    async def _atake(self, msg: WeChatMessage, seq: int) -> Optional[WeChatMessage]:
+        """_take 的异步版本"""
+        try:
+            take = self._script("atake", self.async_redis_client, _TAKE_SCRIPT)
+            items = await take(keys=self._get_keys(msg.from_user_name), args=[seq])
+        except CircuitOpenError:
+            return msg
+        except Exception as e:
+            metrics.redis_error("debounce")
+            print(f"取出待合并消息失败，仅回复最后一条: {e}")
+            return msg
+        return None if items is None else self._merge(msg, items)
+    
+    async def asubmit(self, msg: WeChatMessage) -> Optional[WeChatMessage]:
+        """
+        submit 的异步版本：缓存消息并等待窗口期结束
+        
+        Returns:
+            合并后的消息，窗口期内有更新的消息时返回None（由更新的消息负责回复）；
+            Redis不可用时直接返回原消息
+        """
+        pushed = await self._apush(msg)
+        if pushed is None:
+            return msg
+        
+        seq, length = pushed
+        if length < self.max_messages:
+            await asyncio.sleep(self.window_seconds)
+        return await self._atake(msg, seq)
@@ -0,0 +1,168 @@
+"""
+企业微信回调去重模块
+企业微信在未及时收到响应时会重试推送同一消息（MsgId相同），
+这里基于MsgId保证每条消息只调用一次AI，并支持重放已生成的被动回复
+
+处理中的标记只保留被动回复时限加少量余量：处理请求的进程崩溃或被杀死时标记很快过期，
+企业微信的后续重试可以重新处理，不会一直被当作重复消息应答 success 而无人回复。
+处理完成后再延长为完整的保留时长
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+import redis
+
+import metrics
+from config import Config
+from redis_client import get_redis_client
+
+# 仍为处理中状态时才删除（处理失败后释放认领，不影响已完成或已被重新认领的记录）
+_ABORT_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class MessageDeduplicator:
+    """基于MsgId的回调去重（Redis SET NX + 进程内缓存）"""
+    
+    # 消息处理状态
+    STATUS_NEW = "new"  # 首次收到，由当前请求处理
+    STATUS_IN_FLIGHT = "in_flight"  # 正在处理中
+    STATUS_DONE = "done"  # 已处理完成
+    
+    # 处理中标记在被动回复时限之外多保留的秒数
+    IN_FLIGHT_MARGIN_SECONDS = 3
+    
+    _IN_FLIGHT_STATE = json.dumps({"status": STATUS_IN_FLIGHT})
+    
+    def __init__(self, ttl_seconds: Optional[int] = None, in_flight_ttl_seconds: Optional[float] = None):
+        """
+        Args:
+            ttl_seconds: 处理完成后记录的保留时长（秒）
+            in_flight_ttl_seconds: 处理中标记的保留时长（秒），默认为被动回复时限加余量
+        """
+        self.ttl_seconds = ttl_seconds or Config.WECOM_DEDUP_TTL_SECONDS
+        self.in_flight_ttl_seconds = (
+            in_flight_ttl_seconds or Config.AI_REPLY_DEADLINE_SECONDS + self.IN_FLIGHT_MARGIN_SECONDS
+        )
+        self._redis_client: Optional[redis.Redis] = None
+        self._abort_script = None
+        # msg_id -> (过期时间, 状态, 回复内容)，按写入顺序排列便于清理过期项
+        self._local: "OrderedDict[str, Tuple[float, str, Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @property
+    def redis_client(self) -> redis.Redis:
+        """懒加载Redis客户端"""
+        if self._redis_client is None:
+            self._redis_client = get_redis_client()
+        return self._redis_client
+    
+    def _get_key(self, msg_id: str) -> str:
+        """生成Redis key"""
+        return f"wecom:msg:dedup:{msg_id}"
+    
+    def _ttl(self, status: str) -> float:
+        """状态对应的保留时长（秒）"""
+        return self.in_flight_ttl_seconds if status == self.STATUS_IN_FLIGHT else self.ttl_seconds
+    
+    def _set_local(self, msg_id: str, status: str, reply: Optional[str]) -> None:
+        """写入进程内缓存（需持有锁）"""
+        now = time.monotonic()
+        self._local[msg_id] = (now + self._ttl(status), status, reply)
+        self._local.move_to_end(msg_id)
+        # 清理过期项（处理中标记的有效期较短，只作近似清理，读取时仍会检查过期时间）
+        while self._local:
+            oldest_id, (expires_at, _, _) = next(iter(self._local.items()))
+            if expires_at > now:
+                break
+            del self._local[oldest_id]
+    
+    def begin(self, msg_id: str) -> Tuple[str, Optional[str]]:
+        """
+        认领消息的处理权
+        
+        Args:
+            msg_id: 消息ID
+        
+        Returns:
+            (状态, 可重放的回复内容)。状态为 STATUS_NEW 时由调用方处理该消息，
+            处理结束后需调用 finish，处理失败时调用 abort
+        """
+        with self._lock:
+            entry = self._local.get(msg_id)
+            if entry is not None and entry[0] > time.monotonic():
+                metrics.DEDUP_HITS.labels(entry[1]).inc()
+                return entry[1], entry[2]
+            self._set_local(msg_id, self.STATUS_IN_FLIGHT, None)
+        
+        try:
+            claimed = self.redis_client.set(
+                self._get_key(msg_id),
+                self._IN_FLIGHT_STATE,
+                nx=True,
+                px=int(self.in_flight_ttl_seconds * 1000)
+            )
+            if not claimed:
+                # 其他worker已认领
+                data = self.redis_client.get(self._get_key(msg_id))
+                state = json.loads(data) if data else {"status": self.STATUS_IN_FLIGHT}
+                status, reply = state["status"], state.get("reply")
+                with self._lock:
+                    self._set_local(msg_id, status, reply)
+                metrics.DEDUP_HITS.labels(status).inc()
+                return status, reply
+        except Exception as e:
+            # Redis不可用时仅依赖进程内去重
+            metrics.redis_error("dedup")
+            print(f"消息去重检查失败: {e}")
+        
+        return self.STATUS_NEW, None
+    
+    def finish(self, msg_id: str, reply: Optional[str] = None) -> None:
+        """
+        标记消息处理完成
+        
+        Args:
+            msg_id: 消息ID
+            reply: 已作为被动回复返回的内容，重试时可直接重放；
+                   改为主动推送时传None，重试只需返回success
+        """
+        with self._lock:
+            self._set_local(msg_id, self.STATUS_DONE, reply)
+        
+        try:
+            self.redis_client.set(
+                self._get_key(msg_id),
+                json.dumps({"status": self.STATUS_DONE, "reply": reply}, ensure_ascii=False),
+                ex=self.ttl_seconds
+            )
+        except Exception as e:
+            metrics.redis_error("dedup")
+            print(f"保存消息去重状态失败: {e}")
+    
+    def abort(self, msg_id: str) -> None:
+        """
+        放弃处理权（处理过程中出现异常时调用），企业微信的重试可以重新处理该消息
+        已标记完成的消息不受影响
+        
+        Args:
+            msg_id: 消息ID
+        """
+        with self._lock:
+            entry = self._local.get(msg_id)
+            if entry is not None and entry[1] == self.STATUS_IN_FLIGHT:
+                del self._local[msg_id]
+        
+        try:
+            if self._abort_script is None:
+                self._abort_script = self.redis_client.register_script(_ABORT_SCRIPT)
+            self._abort_script(keys=[self._get_key(msg_id)], args=[self._IN_FLIGHT_STATE])
+        except Exception as e:
+            metrics.redis_error("dedup")
+            print(f"释放消息去重状态失败: {e}")
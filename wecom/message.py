@@ -2,13 +2,21 @@
 企业微信消息处理模块
 参考文档: https://work.weixin.qq.com/api/doc/90000/90135/90238
 """
+import asyncio
+import random
+import threading
 import time
-import xml.etree.ElementTree as ET
 from dataclasses import dataclass
-from typing import Optional
+from typing import List, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+import metrics
 from config import Config
+from .parser import escape_cdata, parse_fields
+from .segment import TEXT_MAX_BYTES, split_text
+from .token import AccessTokenProvider
 
 
 @dataclass
@@ -21,19 +29,253 @@ class WeChatMessage:
     content: str  # 文本消息内容
     msg_id: str  # 消息ID
     agent_id: str  # 企业应用ID
+    # 以下字段按消息/事件类型出现，缺省为空
+    pic_url: str = ""  # 图片链接（image）
+    media_id: str = ""  # 媒体文件ID（image/voice/video）
+    format: str = ""  # 语音格式（voice）
+    thumb_media_id: str = ""  # 视频缩略图媒体ID（video）
+    location_x: str = ""  # 纬度（location）
+    location_y: str = ""  # 经度（location）
+    scale: str = ""  # 地图缩放大小（location）
+    label: str = ""  # 地理位置信息（location）
+    title: str = ""  # 标题（link）
+    description: str = ""  # 描述（link）
+    url: str = ""  # 链接（link）
+    event: str = ""  # 事件类型（event）
+    event_key: str = ""  # 事件KEY值（event）
+    latitude: str = ""  # 纬度（LOCATION 上报事件）
+    longitude: str = ""  # 经度（LOCATION 上报事件）
+    precision: str = ""  # 精度（LOCATION 上报事件）
+    scan_type: str = ""  # 扫码类型（scancode_* 事件）
+    scan_result: str = ""  # 扫码结果（scancode_* 事件）
+
+
+# XML字段名 -> WeChatMessage 属性名（CreateTime 单独转换为整数）
+_MESSAGE_FIELDS = {
+    "ToUserName": "to_user_name",
+    "FromUserName": "from_user_name",
+    "MsgType": "msg_type",
+    "Content": "content",
+    "MsgId": "msg_id",
+    "AgentID": "agent_id",
+    "PicUrl": "pic_url",
+    "MediaId": "media_id",
+    "Format": "format",
+    "ThumbMediaId": "thumb_media_id",
+    "Location_X": "location_x",
+    "Location_Y": "location_y",
+    "Scale": "scale",
+    "Label": "label",
+    "Title": "title",
+    "Description": "description",
+    "Url": "url",
+    "Event": "event",
+    "EventKey": "event_key",
+    "Latitude": "latitude",
+    "Longitude": "longitude",
+    "Precision": "precision",
+    "ScanType": "scan_type",
+    "ScanResult": "scan_result",
+}
+
+
+# 错误码重试的退避时长乘以该范围内的随机系数，避免多个worker同时被限频后在同一时刻重试
+_RETRY_JITTER = (0.5, 1.5)
+
+
+def _retry_delay(backoff_seconds: float, attempt: int) -> float:
+    """第 attempt 次重试前的等待时间（秒）：指数退避加随机抖动"""
+    return backoff_seconds * (2 ** attempt) * random.uniform(*_RETRY_JITTER)
+
+
+class WeComApiClient:
+    """
+    企业微信API HTTP客户端
+    复用连接池与keep-alive连接，限频类错误码自动退避重试
+    
+    传输层只重试不会造成重复调用的情况：连接失败（请求未发出）以及 GET 的读超时和5xx。
+    POST（如 message/send）在读超时或5xx时企业微信可能已经处理，重试会让用户重复收到消息
+    """
+    
+    # 可重试的错误码：系统繁忙、接口调用频率超限、并发调用超限
+    RETRY_ERRCODES = (-1, 45009, 45033)
+    
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_seconds: Optional[float] = None,
+        timeout: Optional[float] = None
+    ):
+        self.base_url = (base_url or Config.WECOM_API_BASE_URL).rstrip("/")
+        self.max_retries = Config.WECOM_HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = Config.WECOM_HTTP_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.timeout = timeout or Config.WECOM_HTTP_TIMEOUT_SECONDS
+        pool_size = pool_size or Config.WECOM_HTTP_POOL_SIZE
+        
+        # 传输层重试：连接失败（任意方法）；读超时及5xx仅限 GET
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_seconds,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+    
+    def request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> dict:
+        """
+        调用企业微信API
+        
+        Args:
+            method: HTTP方法
+            path: 接口路径，如 /cgi-bin/message/send
+            timeout: 本次调用超时时间（秒），默认使用客户端配置
+            **kwargs: 透传给 requests 的参数（params、json等）
+        
+        Returns:
+            接口返回的JSON
+        """
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            resp = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            data = resp.json()
+            if data.get("errcode") not in self.RETRY_ERRCODES or attempt == self.max_retries:
+                return data
+            time.sleep(_retry_delay(self.backoff_seconds, attempt))
+        return data
+    
+    def get(self, path: str, **kwargs) -> dict:
+        """GET 请求"""
+        return self.request("GET", path, **kwargs)
+    
+    def post(self, path: str, **kwargs) -> dict:
+        """POST 请求"""
+        return self.request("POST", path, **kwargs)
+
+
+_api_client: Optional[WeComApiClient] = None
+_api_client_lock = threading.Lock()
+
+
+def get_api_client() -> WeComApiClient:
+    """获取进程内共享的企业微信API客户端"""
+    global _api_client
+    if _api_client is None:
+        with _api_client_lock:
+            if _api_client is None:
+                _api_client = WeComApiClient()
+    return _api_client
+
+
+class AsyncWeComApiClient:
+    """
+    企业微信API异步HTTP客户端（ASGI模式使用）
+    基于 httpx.AsyncClient 复用连接池，重试策略与 WeComApiClient 一致
+    """
+    
+    RETRY_ERRCODES = WeComApiClient.RETRY_ERRCODES
+    
+    # 传输层可重试的状态码（仅 GET）
+    RETRY_STATUS = (500, 502, 503, 504)
+    # 传输层重试的方法：其他方法只在连接失败时重试
+    RETRY_METHODS = ("GET",)
+    
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_seconds: Optional[float] = None,
+        timeout: Optional[float] = None
+    ):
+        import httpx
+        
+        self.base_url = (base_url or Config.WECOM_API_BASE_URL).rstrip("/")
+        self.max_retries = Config.WECOM_HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = Config.WECOM_HTTP_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.timeout = timeout or Config.WECOM_HTTP_TIMEOUT_SECONDS
+        pool_size = pool_size or Config.WECOM_HTTP_POOL_SIZE
+        
+        self._transport_errors = (httpx.TransportError,)
+        # 请求未发出的错误，任意方法均可重试
+        self._connect_errors = (httpx.ConnectError, httpx.ConnectTimeout)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+    
+    async def request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> dict:
+        """
+        调用企业微信API
+        
+        Args:
+            method: HTTP方法
+            path: 接口路径，如 /cgi-bin/message/send
+            timeout: 本次调用超时时间（秒），默认使用客户端配置
+            **kwargs: 透传给 httpx 的参数（params、json等）
+        
+        Returns:
+            接口返回的JSON
+        """
+        retry_transport = method.upper() in self.RETRY_METHODS
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                resp = await self.client.request(method, path, timeout=timeout or self.timeout, **kwargs)
+            except self._transport_errors as e:
+                if last_attempt or not (retry_transport or isinstance(e, self._connect_errors)):
+                    raise
+            else:
+                if resp.status_code not in self.RETRY_STATUS or not retry_transport or last_attempt:
+                    data = resp.json()
+                    if data.get("errcode") not in self.RETRY_ERRCODES or last_attempt:
+                        return data
+            await asyncio.sleep(_retry_delay(self.backoff_seconds, attempt))
+        return data
+    
+    async def get(self, path: str, **kwargs) -> dict:
+        """GET 请求"""
+        return await self.request("GET", path, **kwargs)
+    
+    async def post(self, path: str, **kwargs) -> dict:
+        """POST 请求"""
+        return await self.request("POST", path, **kwargs)
+    
+    async def aclose(self) -> None:
+        """关闭连接池"""
+        await self.client.aclose()
+
+
+_async_api_client: Optional[AsyncWeComApiClient] = None
+
+
+def get_async_api_client() -> AsyncWeComApiClient:
+    """获取进程内共享的企业微信API异步客户端（须在事件循环中调用）"""
+    global _async_api_client
+    if _async_api_client is None:
+        _async_api_client = AsyncWeComApiClient()
+    return _async_api_client
 
 
 class MessageHandler:
     """消息处理器"""
     
+    # access_token 无效或已过期的错误码
+    TOKEN_INVALID_ERRCODES = (40014, 42001)
+    
     def __init__(self):
-        self._access_token = None
-        self._token_expires_at = 0
+        self.token_provider = AccessTokenProvider(self._fetch_access_token)
     
     @staticmethod
     def parse_message(xml_data: str) -> Optional[WeChatMessage]:
         """
-        解析XML消息
+        解析XML消息（支持所有消息和事件类型，单次遍历）
         
         Args:
             xml_data: 解密后的XML消息
@@ -42,25 +284,11 @@ class MessageHandler:
             WeChatMessage对象或None
         """
         try:
-            root = ET.fromstring(xml_data)
-            
-            to_user_name = root.find("ToUserName")
-            from_user_name = root.find("FromUserName")
-            create_time = root.find("CreateTime")
-            msg_type = root.find("MsgType")
-            content = root.find("Content")
-            msg_id = root.find("MsgId")
-            agent_id = root.find("AgentID")
-            
-            return WeChatMessage(
-                to_user_name=to_user_name.text if to_user_name is not None else "",
-                from_user_name=from_user_name.text if from_user_name is not None else "",
-                create_time=int(create_time.text) if create_time is not None else 0,
-                msg_type=msg_type.text if msg_type is not None else "",
-                content=content.text if content is not None else "",
-                msg_id=msg_id.text if msg_id is not None else "",
-                agent_id=agent_id.text if agent_id is not None else ""
-            )
+            with metrics.PARSE_SECONDS.time():
+                fields = parse_fields(xml_data)
+            values = {attr: fields.get(tag, "") for tag, attr in _MESSAGE_FIELDS.items()}
+            create_time = fields.get("CreateTime")
+            return WeChatMessage(create_time=int(create_time) if create_time else 0, **values)
         except Exception:
             return None
     
@@ -79,39 +307,40 @@ class MessageHandler:
         """
         timestamp = int(time.time())
         return f"""<xml>
-<ToUserName><![CDATA[{to_user}]]></ToUserName>
-<FromUserName><![CDATA[{from_user}]]></FromUserName>
+<ToUserName><![CDATA[{escape_cdata(to_user)}]]></ToUserName>
+<FromUserName><![CDATA[{escape_cdata(from_user)}]]></FromUserName>
 <CreateTime>{timestamp}</CreateTime>
 <MsgType><![CDATA[text]]></MsgType>
-<Content><![CDATA[{content}]]></Content>
+<Content><![CDATA[{escape_cdata(content)}]]></Content>
 </xml>"""
     
     def get_access_token(self) -> Optional[str]:
         """
-        获取企业微信access_token
+        获取企业微信access_token（多进程共享，过期前后台自动刷新）
         
         Returns:
             access_token或None
         """
-        # 检查token是否过期
-        if self._access_token and time.time() < self._token_expires_at:
-            return self._access_token
+        return self.token_provider.get_token()
+    
+    @staticmethod
+    def _fetch_access_token() -> Optional[Tuple[str, int]]:
+        """
+        调用企业微信接口获取access_token
         
-        url = "https://qyapi.weixin.qq.com/cgi-bin/gettoken"
+        Returns:
+            (access_token, 有效期秒数) 或None
+        """
         params = {
             "corpid": Config.WECOM_CORP_ID,
             "corpsecret": Config.WECOM_SECRET
         }
         
         try:
-            resp = requests.get(url, params=params, timeout=10)
-            data = resp.json()
+            data = get_api_client().get("/cgi-bin/gettoken", params=params)
             
             if data.get("errcode") == 0:
-                self._access_token = data["access_token"]
-                # 提前5分钟过期
-                self._token_expires_at = time.time() + data["expires_in"] - 300
-                return self._access_token
+                return data["access_token"], data["expires_in"]
             else:
                 print(f"获取access_token失败: {data}")
                 return None
@@ -121,7 +350,7 @@ class MessageHandler:
     
     def send_text_message(self, user_id: str, content: str) -> bool:
         """
-        主动发送文本消息给用户
+        主动发送文本消息给用户，超过2048字节的内容自动分段发送
         
         Args:
             user_id: 用户ID
@@ -130,13 +359,51 @@ class MessageHandler:
         Returns:
             是否发送成功
         """
+        return self.send_text_batch([user_id], content)
+    
+    def send_text_batch(self, user_ids: List[str], content: str) -> bool:
+        """
+        向多个用户发送相同的文本消息（单次调用最多1000人），超长内容自动分段发送
+        
+        Args:
+            user_ids: 用户ID列表
+            content: 消息内容
+        
+        Returns:
+            是否发送成功
+        """
+        touser = "|".join(user_ids)
+        if len(content.encode("utf-8")) <= TEXT_MAX_BYTES:
+            return self._send_text(touser, content)
+        
+        success = True
+        for segment in split_text(content):
+            success = self._send_text(touser, segment) and success
+        return success
+    
+    def _send_text(self, touser: str, content: str) -> bool:
+        """发送单条文本消息，touser 为以 "|" 分隔的用户ID"""
         access_token = self.get_access_token()
         if not access_token:
             return False
         
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/message/send?access_token={access_token}"
-        data = {
-            "touser": user_id,
+        try:
+            with metrics.SEND_SECONDS.time():
+                result = get_api_client().post(
+                    "/cgi-bin/message/send",
+                    params={"access_token": access_token},
+                    json=self._text_payload(touser, content)
+                )
+            return self._check_send_result(result, access_token)
+        except Exception as e:
+            print(f"发送消息异常: {e}")
+            return False
+    
+    @staticmethod
+    def _text_payload(touser: str, content: str) -> dict:
+        """构建文本消息请求体"""
+        return {
+            "touser": touser,
             "msgtype": "text",
             "agentid": Config.WECOM_AGENT_ID,
             "text": {
@@ -144,16 +411,51 @@ class MessageHandler:
             },
             "safe": 0
         }
+    
+    def _check_send_result(self, result: dict, access_token: str) -> bool:
+        """检查发送结果，token失效时清除缓存"""
+        if result.get("errcode") == 0:
+            return True
+        if result.get("errcode") in self.TOKEN_INVALID_ERRCODES:
+            self.token_provider.invalidate(access_token)
+        print(f"发送消息失败: {result}")
+        return False
+    
+    async def asend_text_message(self, user_id: str, content: str) -> bool:
+        """send_text_message 的异步版本"""
+        return await self.asend_text_batch([user_id], content)
+    
+    async def asend_text_batch(self, user_ids: List[str], content: str) -> bool:
+        """send_text_batch 的异步版本"""
+        touser = "|".join(user_ids)
+        if len(content.encode("utf-8")) <= TEXT_MAX_BYTES:
+            return await self._asend_text(touser, content)
+        
+        success = True
+        for segment in split_text(content):
+            success = await self._asend_text(touser, segment) and success
+        return success
+    
+    async def _asend_text(self, touser: str, content: str) -> bool:
+        """_send_text 的异步版本"""
+        # 本地副本有效时直接使用，否则在线程中获取（可能访问Redis或企业微信接口）
+        access_token = self.token_provider.cached_token()
+        if not access_token:
+            access_token = await asyncio.to_thread(self.get_access_token)
+        if not access_token:
+            return False
         
         try:
-            resp = requests.post(url, json=data, timeout=10)
-            result = resp.json()
-            
+            with metrics.SEND_SECONDS.time():
+                result = await get_async_api_client().post(
+                    "/cgi-bin/message/send",
+                    params={"access_token": access_token},
+                    json=self._text_payload(touser, content)
+                )
             if result.get("errcode") == 0:
                 return True
-            else:
-                print(f"发送消息失败: {result}")
-                return False
+            # 失败时可能需要清除Redis中的token，放到线程中执行
+            return await asyncio.to_thread(self._check_send_result, result, access_token)
         except Exception as e:
             print(f"发送消息异常: {e}")
             return False
@@ -0,0 +1,107 @@
+"""
+企业微信回调XML解析模块
+基于 lxml 单次遍历提取所需字段；禁用DTD、实体解析和网络访问，
+并在解析前拒绝超长报文和 DOCTYPE/ENTITY 声明，防止实体膨胀（billion laughs）和XXE
+参考文档: https://developer.work.weixin.qq.com/document/path/90239
+"""
+import threading
+from typing import Dict, Optional, Union
+
+from lxml import etree
+
+from config import Config
+
+# CDATA 结束标记及其转义：拆分为两段 CDATA
+_CDATA_END = "]]>"
+_CDATA_END_ESCAPED = "]]]]><![CDATA[>"
+
+# 出现即拒绝的声明（企业微信回调不会包含）
+_FORBIDDEN_MARKERS = (b"<!DOCTYPE", b"<!ENTITY", b"<!doctype", b"<!entity")
+
+_local = threading.local()
+
+
+class XMLRejectedError(ValueError):
+    """报文超长或包含不安全的声明"""
+
+
+def _get_parser() -> etree.XMLParser:
+    """获取当前线程的解析器（lxml 解析器不能跨线程并发使用）"""
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = etree.XMLParser(
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+            dtd_validation=False,
+            huge_tree=False,
+            remove_comments=True,
+            remove_pis=True
+        )
+        _local.parser = parser
+    return parser
+
+
+def _to_bytes(data: Union[str, bytes]) -> bytes:
+    """统一为字节串并做安全检查"""
+    if isinstance(data, str):
+        # 字符数已超限时无需编码
+        if len(data) > Config.WECOM_MAX_XML_BYTES:
+            raise XMLRejectedError("XML报文过长")
+        data = data.encode("utf-8")
+    if len(data) > Config.WECOM_MAX_XML_BYTES:
+        raise XMLRejectedError("XML报文过长")
+    if b"<!" in data and any(marker in data for marker in _FORBIDDEN_MARKERS):
+        raise XMLRejectedError("XML报文包含DOCTYPE或ENTITY声明")
+    return data
+
+
+def parse_fields(data: Union[str, bytes]) -> Dict[str, str]:
+    """
+    解析回调XML，单次遍历返回所有字段
+    嵌套节点（如 ScanCodeInfo、SendLocationInfo）的叶子字段平铺到同一层，同名时以先出现的为准
+    
+    Args:
+        data: XML报文
+    
+    Returns:
+        字段名 -> 文本内容
+    
+    Raises:
+        XMLRejectedError: 报文超长或包含不安全的声明
+        etree.XMLSyntaxError: 报文格式错误
+    """
+    root = etree.fromstring(_to_bytes(data), _get_parser())
+    fields: Dict[str, str] = {}
+    for element in root.iter():
+        if element is root or len(element):
+            continue
+        tag = element.tag
+        if isinstance(tag, str) and tag not in fields:
+            fields[tag] = element.text or ""
+    return fields
+
+
+def extract_encrypt(post_data: Union[str, bytes]) -> Optional[str]:
+    """
+    从回调报文中提取 Encrypt 字段
+    
+    Returns:
+        Encrypt内容，不存在返回None
+    
+    Raises:
+        XMLRejectedError: 报文超长或包含不安全的声明
+        etree.XMLSyntaxError: 报文格式错误
+    """
+    root = etree.fromstring(_to_bytes(post_data), _get_parser())
+    for element in root:
+        if element.tag == "Encrypt":
+            return element.text
+    return None
+
+
+def escape_cdata(text: str) -> str:
+    """转义 CDATA 内容中的 "]]>"（不包含时直接返回原字符串，不产生复制）"""
+    if _CDATA_END in text:
+        return text.replace(_CDATA_END, _CDATA_END_ESCAPED)
+    return text
@@ -0,0 +1,139 @@
+"""
+文本消息分段模块
+企业微信文本消息内容最长2048字节，超长内容需要在段落/句子边界处拆分
+"""
+import re
+from typing import List, Optional
+
+from config import Config
+
+# 企业微信文本消息内容的最大字节数
+TEXT_MAX_BYTES = 2048
+
+# 句子结束位置（标点之后），段落边界单独处理
+_SENTENCE_END_PATTERN = re.compile(r"[。！？；!?;…]+[”’\"')）]*|\n")
+
+
+def _limit_index(text: str, max_bytes: int) -> int:
+    """返回不超过 max_bytes 字节的最长前缀的字符数"""
+    if len(text) * 4 <= max_bytes:
+        return len(text)
+    return len(text.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore"))
+
+
+def _last_boundary(text: str, start: int, end: int) -> int:
+    """
+    在 text[start:end] 中查找最后一个切分位置，段落边界优先于句子边界
+    
+    Returns:
+        切分位置（切分后前一段的长度），找不到返回-1
+    """
+    paragraph = text.rfind("\n\n", start, end)
+    if paragraph >= start:
+        return paragraph + 2
+    position = -1
+    for match in _SENTENCE_END_PATTERN.finditer(text, start, end):
+        position = match.end()
+    return position
+
+
+def _hard_cut(text: str, max_bytes: int) -> int:
+    """超长且无合适边界时的切分位置：尽量在空白处，否则按字节上限切分"""
+    limit = _limit_index(text, max_bytes)
+    boundary = _last_boundary(text, 1, limit)
+    if boundary > 0:
+        return boundary
+    space = text.rfind(" ", 1, limit)
+    return space + 1 if space > 0 else limit
+
+
+def split_text(text: str, max_bytes: int = TEXT_MAX_BYTES) -> List[str]:
+    """
+    将完整文本拆分为不超过字节上限的若干段，尽量少拆
+    
+    Args:
+        text: 文本内容
+        max_bytes: 每段最大字节数
+    
+    Returns:
+        分段列表
+    """
+    segments = []
+    while len(text.encode("utf-8")) > max_bytes:
+        cut = _hard_cut(text, max_bytes)
+        segment = text[:cut].strip()
+        if segment:
+            segments.append(segment)
+        text = text[cut:]
+    text = text.strip()
+    if text:
+        segments.append(text)
+    return segments
+
+
+class TextSegmenter:
+    """流式文本分段器：逐块输入模型输出，在段落/句子边界处切出可发送的分段"""
+    
+    def __init__(
+        self,
+        first_segment_chars: Optional[int] = None,
+        segment_chars: Optional[int] = None,
+        max_bytes: int = TEXT_MAX_BYTES
+    ):
+        """
+        Args:
+            first_segment_chars: 首段最少字数，较小以便尽快发出第一条消息
+            segment_chars: 后续每段最少字数，避免消息过碎
+            max_bytes: 每段最大字节数
+        """
+        self.first_segment_chars = first_segment_chars or Config.AI_STREAM_FIRST_SEGMENT_CHARS
+        self.segment_chars = segment_chars or Config.AI_STREAM_SEGMENT_CHARS
+        self.max_bytes = max_bytes
+        self._buffer = ""
+        self._emitted = 0
+    
+    def _cut(self) -> Optional[str]:
+        """从缓冲区切出一段，不满足切分条件返回None"""
+        buffer = self._buffer
+        min_chars = self.segment_chars if self._emitted else self.first_segment_chars
+        limit = _limit_index(buffer, self.max_bytes)
+        
+        cut = -1
+        if limit >= min_chars:
+            cut = _last_boundary(buffer, min_chars - 1, limit)
+        if cut <= 0 and limit < len(buffer):
+            # 超过字节上限仍无合适边界，强制切分
+            cut = _hard_cut(buffer, self.max_bytes)
+        if cut <= 0:
+            return None
+        
+        self._buffer = buffer[cut:]
+        return buffer[:cut].strip()
+    
+    def feed(self, text: str) -> List[str]:
+        """
+        输入一块模型输出
+        
+        Args:
+            text: 新生成的文本
+        
+        Returns:
+            已可发送的分段（可能为空）
+        """
+        self._buffer += text
+        segments = []
+        while True:
+            segment = self._cut()
+            if segment is None:
+                break
+            if segment:
+                segments.append(segment)
+                self._emitted += 1
+        return segments
+    
+    def flush(self) -> List[str]:
+        """生成结束，返回缓冲区中剩余的分段"""
+        segments = split_text(self._buffer, self.max_bytes)
+        self._buffer = ""
+        self._emitted += len(segments)
+        return segments
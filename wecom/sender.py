@@ -0,0 +1,411 @@
+"""
+主动消息发送调度模块
+企业微信 message/send 接口按应用和按成员限频。调度器将待发送消息排队，
+按应用/成员令牌桶限流，相同内容合并为一次调用（touser 以 "|" 分隔，最多1000人），
+由有限个发送线程并发发送。AsyncOutboundScheduler 为 ASGI 模式使用的异步版本，调度规则一致
+
+同一成员的消息按提交顺序逐条发送（流式回复的各分段依次到达）：每个成员同时最多有一条消息
+在调度中，其余在该成员的队列中等待，上一条发送结束后再提交下一条。
+限频类错误码由 WeComApiClient 退避重试，调度器不再重发：读超时等情况下企业微信可能已受理，
+重发会重复推送，也会打乱成员的消息顺序
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from config import Config
+from ratelimit import KeyedTokenBuckets, TokenBucket
+from .message import MessageHandler
+
+
+@dataclass
+class _SendJob:
+    """待发送任务"""
+    content: str
+    user_ids: List[str]
+
+
+class _OutboundBase:
+    """发送调度的公共部分：按成员排队、合并、限流"""
+    
+    # 企业微信单次调用最多接收人数
+    MAX_USERS_PER_CALL = 1000
+    
+    def __init__(self, message_handler: MessageHandler, concurrency: Optional[int] = None):
+        """
+        Args:
+            message_handler: 消息处理器，用于实际调用发送接口
+            concurrency: 并发发送数
+        """
+        self.message_handler = message_handler
+        self.concurrency = concurrency or Config.WECOM_SEND_CONCURRENCY
+        self.batch_window = Config.WECOM_SEND_BATCH_WINDOW_MS / 1000
+        
+        self._app_bucket = TokenBucket(Config.WECOM_SEND_APP_RATE, Config.WECOM_SEND_APP_RATE)
+        user_rate = Config.WECOM_SEND_USER_RATE_PER_MINUTE / 60
+        self._user_buckets = KeyedTokenBuckets(user_rate, Config.WECOM_SEND_USER_BURST)
+        
+        self._pending: List[_SendJob] = []
+        # 成员限流的延迟任务：(就绪时间, 序号, 任务)
+        self._delayed: list = []
+        self._seq = itertools.count()
+        # 有消息在调度中（待发送、延迟或发送中）的成员 -> 其后等待发送的消息
+        self._user_queues: Dict[str, Deque[str]] = {}
+    
+    def _enqueue(self, user_ids: List[str], content: str) -> bool:
+        """
+        按成员排队（需持有锁）：没有消息在调度中的成员立即加入待发送任务，其余进入成员队列
+        
+        Returns:
+            是否新增了待发送任务
+        """
+        ready = []
+        for user_id in dict.fromkeys(user_ids):
+            queue = self._user_queues.get(user_id)
+            if queue is None:
+                self._user_queues[user_id] = deque()
+                ready.append(user_id)
+            else:
+                queue.append(content)
+        if ready:
+            self._pending.append(_SendJob(content, ready))
+        return bool(ready)
+    
+    def _release_users(self, user_ids: List[str]) -> None:
+        """成员的当前消息发送结束，其队列中的下一条加入待发送任务（需持有锁）"""
+        for user_id in user_ids:
+            queue = self._user_queues.get(user_id)
+            if not queue:
+                self._user_queues.pop(user_id, None)
+                continue
+            self._pending.append(_SendJob(queue.popleft(), [user_id]))
+    
+    def _defer(self, job: _SendJob, delay: float) -> None:
+        """延迟一段时间后重新排队（需持有锁）"""
+        heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq), job))
+    
+    def _promote_delayed(self) -> Optional[float]:
+        """
+        到期的延迟任务加入待发送任务（需持有锁）
+        
+        Returns:
+            距离下一个延迟任务到期的秒数，没有延迟任务时返回None
+        """
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            self._pending.append(heapq.heappop(self._delayed)[2])
+        return self._delayed[0][0] - now if self._delayed else None
+    
+    @staticmethod
+    def _merge(jobs: List[_SendJob]) -> List[_SendJob]:
+        """
+        合并内容相同的任务并保持顺序
+        每个成员同时只有一条消息在调度中，合并不会改变同一成员的消息顺序
+        """
+        merged: Dict[str, _SendJob] = OrderedDict()
+        for job in jobs:
+            if job.content not in merged:
+                merged[job.content] = _SendJob(job.content, [])
+            merged[job.content].user_ids.extend(job.user_ids)
+        return list(merged.values())
+    
+    def _split(self, job: _SendJob) -> Tuple[List[List[str]], List[str], float]:
+        """
+        按成员限流筛选接收人
+        
+        Returns:
+            (可立即发送的各批接收人, 需延迟的接收人, 延迟秒数)
+        """
+        allowed, deferred = [], []
+        for user_id in job.user_ids:
+            if self._user_buckets.try_acquire(user_id):
+                allowed.append(user_id)
+            else:
+                deferred.append(user_id)
+        delay = max((self._user_buckets.wait_time(user_id) for user_id in deferred), default=0.0)
+        batches = [allowed[i:i + self.MAX_USERS_PER_CALL] for i in range(0, len(allowed), self.MAX_USERS_PER_CALL)]
+        return batches, deferred, delay
+
+
+class OutboundScheduler(_OutboundBase):
+    """主动消息发送调度器"""
+    
+    def __init__(self, message_handler: MessageHandler, concurrency: Optional[int] = None):
+        """
+        Args:
+            message_handler: 消息处理器，用于实际调用发送接口
+            concurrency: 并发发送线程数
+        """
+        super().__init__(message_handler, concurrency)
+        self._cond = threading.Condition()
+        
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="wecom-sender")
+        self._slots = threading.Semaphore(self.concurrency)
+        self._dispatcher: Optional[threading.Thread] = None
+    
+    def submit(self, user_id: str, content: str) -> None:
+        """
+        提交一条待发送消息（立即返回），同一成员的消息按提交顺序发送
+        
+        Args:
+            user_id: 接收人
+            content: 消息内容
+        """
+        self.broadcast([user_id], content)
+    
+    def broadcast(self, user_ids: List[str], content: str) -> None:
+        """
+        向多个成员发送相同内容（立即返回）
+        
+        Args:
+            user_ids: 接收人列表
+            content: 消息内容
+        """
+        if not user_ids:
+            return
+        self._ensure_dispatcher()
+        with self._cond:
+            if self._enqueue(user_ids, content):
+                self._cond.notify_all()
+    
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待已提交的消息全部发送结束（进程退出前调用）
+        
+        Args:
+            timeout: 最长等待秒数，None 表示一直等待
+        
+        Returns:
+            是否已全部发送结束
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._user_queues, timeout)
+    
+    def _ensure_dispatcher(self) -> None:
+        """启动调度线程（在首次使用时启动，兼容 gunicorn 的 fork 模型）"""
+        if self._dispatcher is not None and self._dispatcher.is_alive():
+            return
+        with self._cond:
+            if self._dispatcher is not None and self._dispatcher.is_alive():
+                return
+            self._dispatcher = threading.Thread(
+                target=self._dispatch_loop, name="wecom-send-dispatcher", daemon=True
+            )
+            self._dispatcher.start()
+    
+    def _finish(self, user_ids: List[str]) -> None:
+        """成员的当前消息发送结束，提交其队列中的下一条"""
+        with self._cond:
+            self._release_users(user_ids)
+            self._cond.notify_all()
+    
+    def _take_jobs(self) -> List[_SendJob]:
+        """等待并取出可发送的任务"""
+        with self._cond:
+            while True:
+                timeout = self._promote_delayed()
+                if self._pending:
+                    break
+                self._cond.wait(timeout)
+        
+        # 等待一个合并窗口，让同时到达的相同内容合并发送
+        if self.batch_window > 0:
+            time.sleep(self.batch_window)
+        with self._cond:
+            jobs, self._pending = self._pending, []
+        return jobs
+    
+    def _dispatch_loop(self) -> None:
+        """调度线程：合并、限流并分发发送任务"""
+        while True:
+            for job in self._merge(self._take_jobs()):
+                try:
+                    self._dispatch(job)
+                except Exception as e:
+                    print(f"消息发送调度异常: {e}")
+    
+    def _dispatch(self, job: _SendJob) -> None:
+        """
+        按成员限流筛选接收人，分批提交发送
+        出现异常时，尚未交给发送线程或延迟队列的成员视为发送结束，提交其队列中的下一条，
+        避免这些成员的后续消息一直等待
+        """
+        pending = list(job.user_ids)
+        try:
+            batches, deferred, delay = self._split(job)
+            if deferred:
+                with self._cond:
+                    self._defer(_SendJob(job.content, deferred), delay)
+                    self._cond.notify_all()
+            pending = [user_id for batch in batches for user_id in batch]
+            
+            for batch in batches:
+                self._app_bucket.acquire()
+                self._slots.acquire()
+                try:
+                    self._executor.submit(self._send, _SendJob(job.content, batch))
+                except BaseException:
+                    self._slots.release()
+                    raise
+                pending = pending[len(batch):]
+        except BaseException:
+            print(f"消息未能提交发送: users={len(pending)}")
+            self._finish(pending)
+            raise
+    
+    def _send(self, job: _SendJob) -> None:
+        """发送线程：调用接口，结束后提交各成员的下一条消息"""
+        try:
+            if not self.message_handler.send_text_batch(job.user_ids, job.content):
+                print(f"主动消息发送失败: users={len(job.user_ids)}")
+        except Exception as e:
+            print(f"主动消息发送异常: {e}")
+        finally:
+            self._slots.release()
+            self._finish(job.user_ids)
+
+
+class AsyncOutboundScheduler(_OutboundBase):
+    """OutboundScheduler 的异步版本（ASGI模式使用，只能在同一个事件循环中使用）"""
+    
+    def __init__(self, message_handler: MessageHandler, concurrency: Optional[int] = None):
+        """
+        Args:
+            message_handler: 消息处理器，用于实际调用发送接口
+            concurrency: 并发发送数
+        """
+        super().__init__(message_handler, concurrency)
+        # 事件循环中的对象在首次使用时创建
+        self._wakeup: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        # 发送中的任务，保留引用避免被回收
+        self._sending: Set[asyncio.Task] = set()
+    
+    def submit(self, user_id: str, content: str) -> None:
+        """
+        提交一条待发送消息（立即返回，须在事件循环中调用），同一成员的消息按提交顺序发送
+        
+        Args:
+            user_id: 接收人
+            content: 消息内容
+        """
+        self.broadcast([user_id], content)
+    
+    def broadcast(self, user_ids: List[str], content: str) -> None:
+        """
+        向多个成员发送相同内容（立即返回，须在事件循环中调用）
+        
+        Args:
+            user_ids: 接收人列表
+            content: 消息内容
+        """
+        if not user_ids:
+            return
+        self._ensure_dispatcher()
+        if self._enqueue(user_ids, content):
+            self._idle.clear()
+            self._wakeup.set()
+    
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待已提交的消息全部发送结束（进程退出前调用）
+        
+        Args:
+            timeout: 最长等待秒数，None 表示一直等待
+        
+        Returns:
+            是否已全部发送结束
+        """
+        if not self._user_queues:
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    def _ensure_dispatcher(self) -> None:
+        """启动调度任务"""
+        if self._dispatcher is not None and not self._dispatcher.done():
+            return
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.concurrency)
+        self._dispatcher = asyncio.ensure_future(self._dispatch_loop())
+    
+    def _finish(self, user_ids: List[str]) -> None:
+        """成员的当前消息发送结束，提交其队列中的下一条"""
+        self._release_users(user_ids)
+        if self._pending:
+            self._wakeup.set()
+        if not self._user_queues:
+            self._idle.set()
+    
+    async def _take_jobs(self) -> List[_SendJob]:
+        """等待并取出可发送的任务"""
+        while True:
+            timeout = self._promote_delayed()
+            if self._pending:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        
+        # 等待一个合并窗口，让同时到达的相同内容合并发送
+        if self.batch_window > 0:
+            await asyncio.sleep(self.batch_window)
+        jobs, self._pending = self._pending, []
+        return jobs
+    
+    async def _dispatch_loop(self) -> None:
+        """调度任务：合并、限流并分发发送任务"""
+        while True:
+            for job in self._merge(await self._take_jobs()):
+                try:
+                    await self._dispatch(job)
+                except Exception as e:
+                    print(f"消息发送调度异常: {e}")
+    
+    async def _dispatch(self, job: _SendJob) -> None:
+        """按成员限流筛选接收人，分批启动发送（异常处理与 OutboundScheduler._dispatch 一致）"""
+        pending = list(job.user_ids)
+        try:
+            batches, deferred, delay = self._split(job)
+            if deferred:
+                self._defer(_SendJob(job.content, deferred), delay)
+            pending = [user_id for batch in batches for user_id in batch]
+            
+            for batch in batches:
+                while not self._app_bucket.try_acquire():
+                    await asyncio.sleep(max(self._app_bucket.wait_time(), 0.001))
+                await self._slots.acquire()
+                task = asyncio.ensure_future(self._send(_SendJob(job.content, batch)))
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+                pending = pending[len(batch):]
+        except BaseException:
+            print(f"消息未能提交发送: users={len(pending)}")
+            self._finish(pending)
+            raise
+    
+    async def _send(self, job: _SendJob) -> None:
+        """调用接口，结束后提交各成员的下一条消息"""
+        try:
+            if not await self.message_handler.asend_text_batch(job.user_ids, job.content):
+                print(f"主动消息发送失败: users={len(job.user_ids)}")
+        except Exception as e:
+            print(f"主动消息发送异常: {e}")
+        finally:
+            self._slots.release()
+            self._finish(job.user_ids)
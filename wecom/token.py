@@ -0,0 +1,226 @@
+"""
+企业微信access_token管理模块
+access_token存放在Redis中供所有worker进程共享，通过短时锁保证同一时刻只有一个进程刷新，
+并在过期前由后台线程提前刷新，进程内另有本地副本避免每次发送都访问Redis
+"""
+import json
+import threading
+import time
+import uuid
+from typing import Callable, Optional, Tuple
+import redis
+
+import metrics
+from config import Config
+from redis_client import get_redis_client
+
+
+class AccessTokenProvider:
+    """跨进程共享的access_token提供者"""
+    
+    # 释放刷新锁（仅当锁仍由自己持有）
+    _RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+    
+    # 刷新锁有效期（秒）
+    LOCK_TTL_SECONDS = 10
+    # 未抢到刷新锁时等待其他进程刷新的最长时间（秒）
+    WAIT_SECONDS = 3
+    
+    def __init__(self, fetch_token: Callable[[], Optional[Tuple[str, int]]]):
+        """
+        Args:
+            fetch_token: 调用企业微信接口获取token的函数，返回 (access_token, expires_in) 或None
+        """
+        self._fetch_token = fetch_token
+        self._redis_client: Optional[redis.Redis] = None
+        self._release_script = None
+        
+        # 本地副本
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        
+        self._refresher: Optional[threading.Thread] = None
+        # 累计刷新次数
+        self.refresh_count = 0
+    
+    @property
+    def redis_client(self) -> redis.Redis:
+        """懒加载Redis客户端"""
+        if self._redis_client is None:
+            self._redis_client = get_redis_client()
+        return self._redis_client
+    
+    def _get_key(self) -> str:
+        """生成Redis key（同一企业应用共享一个token）"""
+        return f"wecom:access_token:{Config.WECOM_CORP_ID}:{Config.WECOM_AGENT_ID}"
+    
+    def _get_lock_key(self) -> str:
+        """生成刷新锁的Redis key"""
+        return f"{self._get_key()}:lock"
+    
+    def _is_fresh(self, expires_at: float, margin: float = 0) -> bool:
+        """token在 margin 秒后是否仍有效"""
+        return time.time() + margin < expires_at
+    
+    def get_token(self) -> Optional[str]:
+        """
+        获取access_token
+        
+        Returns:
+            access_token或None
+        """
+        self._ensure_refresher()
+        
+        token, expires_at = self._token, self._expires_at
+        if token and self._is_fresh(expires_at):
+            return token
+        
+        with self._lock:
+            # 双重检查：等锁期间其他线程可能已刷新
+            if self._token and self._is_fresh(self._expires_at):
+                return self._token
+            return self._load_or_refresh()
+    
+    def cached_token(self) -> Optional[str]:
+        """
+        返回仍有效的本地副本，不访问Redis和企业微信接口（供异步调用方快速判断是否需要放到线程中获取）
+        
+        Returns:
+            access_token或None
+        """
+        token, expires_at = self._token, self._expires_at
+        if token and self._is_fresh(expires_at):
+            return token
+        return None
+    
+    def invalidate(self, token: str) -> None:
+        """
+        标记token失效（企业微信返回token无效/过期时调用），下次获取时重新拉取
+        
+        Args:
+            token: 已失效的token
+        """
+        with self._lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+        try:
+            data = self.redis_client.get(self._get_key())
+            if data and json.loads(data).get("token") == token:
+                self.redis_client.delete(self._get_key())
+        except Exception as e:
+            metrics.redis_error("token")
+            print(f"清除access_token缓存失败: {e}")
+    
+    def _set_local(self, token: str, expires_at: float) -> None:
+        self._token = token
+        self._expires_at = expires_at
+    
+    def _read_shared(self) -> Optional[Tuple[str, float]]:
+        """读取Redis中的共享token"""
+        data = self.redis_client.get(self._get_key())
+        if not data:
+            return None
+        state = json.loads(data)
+        return state["token"], state["expires_at"]
+    
+    def _load_or_refresh(self, margin: float = 0) -> Optional[str]:
+        """
+        优先使用Redis中的共享token，不可用时抢锁刷新（需持有本地锁）
+        
+        Args:
+            margin: 共享token剩余有效期不足 margin 秒时视为需要刷新
+        """
+        try:
+            shared = self._read_shared()
+            if shared and self._is_fresh(shared[1], margin):
+                self._set_local(*shared)
+                return shared[0]
+            
+            lock_token = uuid.uuid4().hex
+            if self.redis_client.set(self._get_lock_key(), lock_token, nx=True, ex=self.LOCK_TTL_SECONDS):
+                try:
+                    return self._refresh()
+                finally:
+                    self._release_lock(lock_token)
+            
+            # 其他进程正在刷新，等待其写入
+            deadline = time.monotonic() + self.WAIT_SECONDS
+            while time.monotonic() < deadline:
+                time.sleep(0.1)
+                shared = self._read_shared()
+                if shared and self._is_fresh(shared[1], margin):
+                    self._set_local(*shared)
+                    return shared[0]
+        except Exception as e:
+            # Redis不可用时退化为进程内刷新
+            metrics.redis_error("token")
+            print(f"读取共享access_token失败: {e}")
+            return self._refresh(share=False)
+        
+        # 等待超时（持锁进程可能刷新失败），自行刷新
+        return self._refresh()
+    
+    def _refresh(self, share: bool = True) -> Optional[str]:
+        """调用企业微信接口获取新token并写入本地和Redis"""
+        result = self._fetch_token()
+        if result is None:
+            return None
+        
+        token, expires_in = result
+        self.refresh_count += 1
+        metrics.TOKEN_REFRESHES.inc()
+        # 提前5分钟过期
+        expires_at = time.time() + expires_in - 300
+        self._set_local(token, expires_at)
+        
+        if share:
+            try:
+                self.redis_client.set(
+                    self._get_key(),
+                    json.dumps({"token": token, "expires_at": expires_at}),
+                    ex=max(int(expires_at - time.time()), 1)
+                )
+            except Exception as e:
+                metrics.redis_error("token")
+                print(f"保存共享access_token失败: {e}")
+        return token
+    
+    def _release_lock(self, lock_token: str) -> None:
+        if self._release_script is None:
+            self._release_script = self.redis_client.register_script(self._RELEASE_SCRIPT)
+        self._release_script(keys=[self._get_lock_key()], args=[lock_token])
+    
+    def _ensure_refresher(self) -> None:
+        """启动后台刷新线程（在首次使用时启动，兼容 gunicorn 的 fork 模型）"""
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name="wecom-token-refresher", daemon=True
+            )
+            self._refresher.start()
+    
+    def _refresh_loop(self) -> None:
+        """后台线程：token剩余有效期不足 WECOM_TOKEN_REFRESH_AHEAD_SECONDS 时提前刷新"""
+        ahead = Config.WECOM_TOKEN_REFRESH_AHEAD_SECONDS
+        while True:
+            if self._token:
+                wait = self._expires_at - time.time() - ahead
+                if wait > 0:
+                    time.sleep(min(wait, 60))
+                    continue
+                try:
+                    with self._lock:
+                        self._load_or_refresh(margin=ahead)
+                except Exception as e:
+                    print(f"后台刷新access_token失败: {e}")
+            time.sleep(30)
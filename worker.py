@@ -0,0 +1,148 @@
+"""
+AI回复 worker 启动脚本
+从 Redis Stream 消费回调消息，调用AI服务并通过主动消息推送回复
+
+需配合 AI_QUEUE_ENABLED=true 使用，可独立于 Web 服务横向扩展：
+    python worker.py --concurrency 16
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from ai.chat import ChatService
+from ai.reply_queue import ReplyQueue
+from wecom.message import MessageHandler, WeChatMessage
+from wecom.sender import OutboundScheduler
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class ReplyWorker:
+    """AI回复worker：消费队列、调用AI、主动推送"""
+    
+    # 检查并接管崩溃worker遗留消息的间隔（秒）
+    RECLAIM_INTERVAL_SECONDS = 30
+    # 退出前等待已提交的主动推送发送完成的最长时间（秒）
+    DRAIN_TIMEOUT_SECONDS = 30
+    
+    def __init__(self, consumer: str, concurrency: int):
+        self.consumer = consumer
+        self.concurrency = concurrency
+        self.queue = ReplyQueue()
+        self.chat_service = ChatService()
+        self.message_handler = MessageHandler()
+        self.outbound = OutboundScheduler(self.message_handler)
+        
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ai-worker")
+        self._slots = threading.Semaphore(concurrency)
+        self._stop = threading.Event()
+    
+    def stop(self, *_) -> None:
+        """停止消费（处理中的消息会继续完成）"""
+        logger.info("收到停止信号，等待处理中的消息完成...")
+        self._stop.set()
+    
+    def _acquire_slots(self) -> int:
+        """获取空闲处理槽位，返回本次可拉取的消息数"""
+        if not self._slots.acquire(timeout=1):
+            return 0
+        acquired = 1
+        while acquired < self.concurrency and self._slots.acquire(blocking=False):
+            acquired += 1
+        return acquired
+    
+    def _release_slots(self, count: int) -> None:
+        for _ in range(count):
+            self._slots.release()
+    
+    def _handle(self, entry_id: str, msg: WeChatMessage) -> None:
+        """处理单条消息"""
+        try:
+            if Config.AI_STREAM_ENABLED:
+                self.chat_service.chat_stream(
+                    msg.from_user_name,
+                    msg.content,
+                    lambda segment: self.outbound.submit(msg.from_user_name, segment)
+                )
+            else:
+                ai_reply = self.chat_service.chat(
+                    session_id=msg.from_user_name,
+                    user_input=msg.content
+                )
+                self.outbound.submit(msg.from_user_name, ai_reply)
+            self.queue.ack(entry_id)
+        except Exception as e:
+            # 不确认，留待超时后由其他worker接管重试
+            logger.error(f"处理消息失败: id={entry_id}, error={e}")
+        finally:
+            self._slots.release()
+    
+    def _dispatch(self, entries: list, slots: int) -> None:
+        """提交消息到线程池处理，归还未用完的槽位"""
+        for entry_id, msg in entries:
+            self._executor.submit(self._handle, entry_id, msg)
+        self._release_slots(slots - len(entries))
+    
+    def run(self) -> None:
+        """消费主循环"""
+        self.queue.ensure_group()
+        logger.info(f"worker启动: consumer={self.consumer}, concurrency={self.concurrency}, stream={self.queue.stream}")
+        
+        last_reclaim = 0.0
+        while not self._stop.is_set():
+            slots = self._acquire_slots()
+            if slots == 0:
+                continue
+            try:
+                if time.monotonic() - last_reclaim >= self.RECLAIM_INTERVAL_SECONDS:
+                    last_reclaim = time.monotonic()
+                    entries = self.queue.reclaim(self.consumer, Config.AI_QUEUE_CLAIM_IDLE_MS, slots)
+                    if entries:
+                        logger.info(f"接管未确认消息: {len(entries)} 条")
+                        self._dispatch(entries, slots)
+                        continue
+                
+                entries = self.queue.read(self.consumer, slots, Config.AI_QUEUE_BLOCK_MS)
+                self._dispatch(entries, slots)
+            except Exception as e:
+                self._release_slots(slots)
+                logger.error(f"读取队列失败: {e}")
+                self._stop.wait(1)
+        
+        self._executor.shutdown(wait=True)
+        if not self.outbound.drain(self.DRAIN_TIMEOUT_SECONDS):
+            logger.warning("部分主动推送未在退出前发送完成")
+        logger.info("worker已停止")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="企业微信智能机器人 AI 回复 worker")
+    parser.add_argument(
+        "--concurrency", type=int, default=Config.AI_WORKER_CONCURRENCY,
+        help="单个worker并发处理的消息数"
+    )
+    parser.add_argument(
+        "--consumer", default=f"{socket.gethostname()}-{os.getpid()}",
+        help="消费者名称，同一消费组内需唯一"
+    )
+    args = parser.parse_args()
+    
+    Config.validate()
+    worker = ReplyWorker(consumer=args.consumer, concurrency=args.concurrency)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()